@@ -3,6 +3,7 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 import logging
 from users.token_auth import get_user_from_token
 from channels.db import database_sync_to_async
+from django_server.broadcast import EncodedSendMixin, encoded_event, group_send_json
 
 logger = logging.getLogger(__name__)
 
@@ -33,7 +34,7 @@ PENDING_GAME_RESULTS = {}  # user_id -> game result message to deliver on next r
 # self.channel_name - a unique ID that Django Channels assigns to this specific WebSocket
 # connection, like "specific.abc123". Each browser tab gets a different one.
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(EncodedSendMixin, AsyncWebsocketConsumer):
 	async def connect(self):
 
 		# Auth: read JWT from HTTP-only cookie set at login.
@@ -131,7 +132,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
 			target = data.get("target")
 			payload = {
-				"type": "chat.message",
+				"type": "chat",
 				"message": message,
 				"sender": self.user_id,
 				"name": self.username,
@@ -146,17 +147,20 @@ class ChatConsumer(AsyncWebsocketConsumer):
 				# Private message: deliver to all of the recipient's open tabs,
 				# and echo back to all of the sender's own tabs (so other tabs stay in sync).
 				# group_send reaches every connection in the group automatically.
+				# The message is encoded once and the same event goes to both groups.
 				payload["private"] = True
 				payload["target"] = target
-				await self.channel_layer.group_send(f"user_{target}", payload)
-				await self.channel_layer.group_send(f"user_{self.user_id}", payload)
+				event = encoded_event(payload)
+				await self.channel_layer.group_send(f"user_{target}", event)
+				await self.channel_layer.group_send(f"user_{self.user_id}", event)
 				# Persist the message and update conversation state in the database.
 				await self.save_dm(target, message)
 			else:
 				# Global message: broadcast to everyone in the global group.
 				# Global messages are not saved to the database.
 				payload["private"] = False
-				await self.channel_layer.group_send(self.group_name, payload)
+				payload["target"] = None
+				await group_send_json(self.channel_layer, self.group_name, payload)
 
 		elif msg_type == "fetch_history":
 			other_id = data.get("target")
@@ -199,9 +203,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
 			# Reset the unread counter for this conversation in the database.
 			await self.mark_read(self.user_id, other_id)
 			# Notify the other user that their messages were read.
-			await self.channel_layer.group_send(
+			await group_send_json(
+				self.channel_layer,
 				f"user_{other_id}",
-				{"type": "messages.read", "by": self.user_id}
+				{"type": "messages_read", "by": self.user_id}
 			)
 
 		elif msg_type == "close_conversation":
@@ -227,14 +232,14 @@ class ChatConsumer(AsyncWebsocketConsumer):
 				}))
 				return
 			payload = {
-				"type": "game.invite",
+				"type": "game_invite",
 				"sender": self.user_id,
 				"name": self.username,
 				"game_type": game_type,
 				"game_id": game_id,
 			}
 			# If the target has no open tabs the group_send is a no-op; the invite is still saved to DB.
-			await self.channel_layer.group_send(f"user_{target}", payload)
+			await group_send_json(self.channel_layer, f"user_{target}", payload)
 			await self.save_invite(target, game_type, game_id)
 
 		elif msg_type == "game_invite_expired":
@@ -256,14 +261,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
 			if game_id:
 				sender_id = await self.delete_invite(game_id)
 				if sender_id:
-					await self.channel_layer.group_send(f"user_{sender_id}", {
-						"type": "game.invite.accepted",
-						"game_id": game_id,
-					})
-					await self.channel_layer.group_send(f"user_{self.user_id}", {
-						"type": "game.invite.accepted",
+					event = encoded_event({
+						"type": "game_invite_accepted",
 						"game_id": game_id,
 					})
+					await self.channel_layer.group_send(f"user_{sender_id}", event)
+					await self.channel_layer.group_send(f"user_{self.user_id}", event)
 
 		elif msg_type == "user_blocked":
 			target = data.get("target")
@@ -279,25 +282,20 @@ class ChatConsumer(AsyncWebsocketConsumer):
 						f'user_{target}',
 						{'type': 'game.invite.expired', 'game_id': gid}
 					)
-				await self.channel_layer.group_send(
-					f'user_{self.user_id}',
-					{'type': 'friend.list.changed'}
-				)
-				await self.channel_layer.group_send(
-					f'user_{target}',
-					{'type': 'friend.list.changed'}
-				)
+				event = encoded_event({'type': 'friendListChanged'})
+				await self.channel_layer.group_send(f'user_{self.user_id}', event)
+				await self.channel_layer.group_send(f'user_{target}', event)
 			await self.broadcast_online_users()
 
 		elif msg_type in ["typing", "stop_typing"]:
 			target = data.get("target")
 			logger.debug(f"[{msg_type}] user={self.username}({self.user_id}) → target={target}")
 			group = f"user_{target}" if target else self.group_name
-			await self.channel_layer.group_send(
+			await group_send_json(
+				self.channel_layer,
 				group,
 				{
-					"type": "typing.notification",
-					"action": msg_type,
+					"type": msg_type,  # "typing" or "stop_typing"
 					"user": self.user_id,
 					"name": self.username,
 					"target": target,
@@ -307,33 +305,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
 	# ─── Event handlers ───────────────────────────────────────────────────────
 	# These are called by the channel layer when a message arrives for this consumer.
 	# The method name must match the "type" field in the payload, with dots
-	# replaced by underscores — e.g. "chat.message" -> chat_message()
-
-	async def chat_message(self, event):
-		# Deliver a chat message (global or DM) to this consumer's client.
-		await self.send(text_data=json.dumps({
-			"type": "chat",
-			"message": event["message"],
-			"sender": event["sender"],
-			"name": event.get("name"),
-			"private": event.get("private", False),  # True for DMs, False for global
-			"target": event.get("target")             # user_id of DM recipient, or None for global
-		}))
-
-	async def messages_read(self, event):
-		await self.send(text_data=json.dumps({
-			"type": "messages_read",
-			"by": event["by"],
-		}))
-
-	async def game_invite(self, event):
-		await self.send(text_data=json.dumps({
-			"type": "game_invite",
-			"sender": event["sender"],
-			"name": event["name"],
-			"game_type": event["game_type"],
-			"game_id": event["game_id"],
-		}))
+	# replaced by underscores — e.g. "game.invite.expired" -> game_invite_expired()
+	# Plain notifications (chat, typing, invites, online users, game results) are
+	# encoded once by the sender and arrive as "send.encoded" (see EncodedSendMixin).
 
 	def format_game_result_message(self, event):
 		winner = event.get("winner")
@@ -349,25 +323,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
 		else:
 			return f"A game of {game_type} ended in a draw."
 
-	async def game_result(self, event):
-		await self.send(text_data=json.dumps({
-			"type": "game_result",
-			"winner": event.get("winner"),
-			"loser": event.get("loser"),
-			"draw_players": event.get("draw_players"),
-			"game_type": event.get("game_type", "game"),
-		}))
-
 	async def trigger_online_users_broadcast(self, event):
 		logger.debug(f"[broadcast] IN_GAME_USERS at broadcast time: {IN_GAME_USERS}")
 		await self.broadcast_online_users()
 
-	async def game_invite_accepted(self, event):
-		await self.send(text_data=json.dumps({
-			"type": "game_invite_accepted",
-			"game_id": event["game_id"],
-		}))
-
 	async def game_invite_blocked(self, event):
 		game_id = event["game_id"]
 		await self.delete_invite(game_id)
@@ -384,26 +343,6 @@ class ChatConsumer(AsyncWebsocketConsumer):
 			"game_id": game_id,
 		}))
 
-	async def friend_list_changed(self, _event):
-		await self.send(text_data=json.dumps({'type': 'friendListChanged'}))
-
-	async def typing_notification(self, event):
-		# Deliver a typing indicator to this consumer's client.
-		await self.send(text_data=json.dumps({
-			"type": event["action"],  # "typing" or "stop_typing"
-			"user": event["user"],
-			"name": event.get("name"),
-			"target": event.get("target"),
-		}))
-
-	async def online_users(self, event):
-		# Deliver the updated online users list to this consumer's client.
-		await self.send(text_data=json.dumps({
-			"type": "online_users",
-			"users": event["users"],
-			"blocked_me_ids": event.get("blocked_me_ids", [])
-		}))
-
 	async def broadcast_online_users(self):
 		# Send each online user a personalized online users list.
 		# Each user sees a different list: users who blocked them are hidden,
@@ -420,8 +359,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
 					"blocked_by_me": uid in blocked_by_me,
 					"in_game": uid in IN_GAME_USERS,
 				}
-			await self.channel_layer.group_send(f"user_{user_id}", {
-				"type": "online.users",
+			await group_send_json(self.channel_layer, f"user_{user_id}", {
+				"type": "online_users",
 				"users": users,
 				"blocked_me_ids": list(blocked_me)
 			})
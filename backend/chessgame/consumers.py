@@ -2,13 +2,51 @@ import json
 import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async
-from .models import ChessPlayer, ChessMatch
+from .models import ChessPlayer
 from .models import ChessSession
 from chat.consumers import IN_GAME_USERS, PENDING_GAME_RESULTS
+from django_server.broadcast import EncodedSendMixin, group_send_json
+from game.matchmaking import RatingMatchmaker
+from game.results import result_pipeline
+from channels.layers import get_channel_layer
 
 logger = logging.getLogger(__name__)
 
-class ChessConsumer(AsyncWebsocketConsumer):
+
+#seat the guest at the host's table and tell the guest's socket to move there
+async def pair_chess_players(host, guest):
+	host_game = ChessSession.get_game(host.game_id)
+	guest_game = ChessSession.get_game(guest.game_id)
+	with ChessSession._lock:
+		host_open = host_game is not None and host_game.is_open()
+		guest_open = guest_game is not None and guest_game.is_open()
+		if host_open and guest_open:
+			guest_color = 'white' if guest_game.players['white'] else 'black'
+			host_color = 'white' if host_game.players['white'] is None else 'black'
+			host_game.players[host_color] = guest_game.players[guest_color]
+			#leave the guest's old table empty so its socket closing has no effect
+			guest_game.players[guest_color] = None
+			ChessSession.matchmaking.discard(host.game_id)
+			ChessSession.matchmaking.discard(guest.game_id)
+	if not (host_open and guest_open):
+		#one side left in the meantime; the other keeps its place in the queue
+		for ticket, still_open in ((host, host_open), (guest, guest_open)):
+			if still_open:
+				chess_matchmaker.enqueue(ticket.user_id, ticket.game_id, ticket.rating, since=ticket.since)
+		return
+
+	logger.info(f"[chess matchmaking] {guest.user_id} ({guest.rating}) joins {host.user_id} ({host.rating}) at {host.game_id}")
+	#connect() turns away users still marked in a game; the guest's new socket marks them again
+	IN_GAME_USERS.discard(str(guest.user_id))
+	await group_send_json(get_channel_layer(), f'chess_{guest.game_id}', {
+		'type': 'matchFound',
+		'gameId': host.game_id,
+	})
+
+
+chess_matchmaker = RatingMatchmaker('chess', pair_chess_players)
+
+class ChessConsumer(EncodedSendMixin, AsyncWebsocketConsumer):
 	async def connect(self):
 		self.game_id = self.scope['url_route']['kwargs']['game_id']
 		self.game_group_name = f'chess_{self.game_id}'
@@ -75,8 +113,8 @@ class ChessConsumer(AsyncWebsocketConsumer):
 							{'type': 'game.invite.expired', 'game_id': gid}
 						)
 
-			await self.channel_layer.group_send(self.game_group_name, {
-				'type': 'game_start',
+			await group_send_json(self.channel_layer, self.game_group_name, {
+				'type': 'gameStart',
 				'fen': self.game.board.fen(),
 				'white': getattr(self.game.players['white'], 'username', 'Player 1'),
 				'black': getattr(self.game.players['black'], 'username', 'Player 2'),
@@ -85,15 +123,21 @@ class ChessConsumer(AsyncWebsocketConsumer):
 			})
 		else:
 			await self.channel_layer.group_send('global_chat', {'type': 'trigger.online.users.broadcast'})
+			#waiting alone at an open table: look for an opponent of similar rating
+			if self.game.is_open():
+				user_id = self.scope['user'].id
+				chess_matchmaker.enqueue(user_id, self.game_id, await get_rating(self.scope['user']))
 	
 
 	async def disconnect(self, _close_code):
+		if hasattr(self, 'game') and self.game:
+			chess_matchmaker.remove(self.scope['user'].id, self.game_id)
 		if self.color and hasattr(self, 'game') and self.game:
 			if self.game.status == 'active':
 				winner = 'black' if self.color == 'white' else 'white'
 				self.game.status = 'finished'
-				await self.channel_layer.group_send(self.game_group_name, {
-					'type': 'game_over',
+				await group_send_json(self.channel_layer, self.game_group_name, {
+					'type': 'gameOver',
 					'winner': winner,
 					'result': 'abandonment'
 				})
@@ -109,10 +153,10 @@ class ChessConsumer(AsyncWebsocketConsumer):
 					'type': 'game_result',
 					'winner': winner_name,
 					'loser': loser_name,
+					'draw_players': None,
 					'game_type': 'chess',
-					'is_tournament': False,
 				}
-				await self.channel_layer.group_send('global_chat', result_msg)
+				await group_send_json(self.channel_layer, 'global_chat', result_msg)
 				# Store for the abandoning player — their chat WS closed with the tab,
 				# so the global_chat broadcast won't reach them. Deliver on reconnect.
 				loser_id = str(self.game.players[self.color].id)
@@ -153,8 +197,8 @@ class ChessConsumer(AsyncWebsocketConsumer):
 			await self.send(text_data=json.dumps({'type': 'illegal_move'}))
 			return
 		
-		await self.channel_layer.group_send(self.game_group_name, {
-			'type': 'game_state',
+		await group_send_json(self.channel_layer, self.game_group_name, {
+			'type': 'gameState',
 			'fen': fen,
 			'turn': 'white' if self.game.board.turn else 'black'
 		})
@@ -183,45 +227,20 @@ class ChessConsumer(AsyncWebsocketConsumer):
 			await self.channel_layer.group_send('global_chat', {'type': 'trigger.online.users.broadcast'})
 			ChessSession.delete_game(self.game_id)
 
-			await self.channel_layer.group_send(self.game_group_name, {
-				'type': 'game_over',
+			await group_send_json(self.channel_layer, self.game_group_name, {
+				'type': 'gameOver',
 				'winner': over['winner'],
 				'result': over['result']
 			})
 
-			await self.channel_layer.group_send('global_chat', {
+			await group_send_json(self.channel_layer, 'global_chat', {
 				'type': 'game_result',
 				'winner': winner_name,
 				'loser': loser_name,
 				'draw_players': draw_players,
 				'game_type': 'chess',
-				'is_tournament': False
 			})
 	
-	async def game_start(self, event):
-		await self.send(text_data=json.dumps({
-			'type': 'gameStart',
-			'fen': event['fen'],
-			'white': event['white'],
-			'black': event['black'],
-			'white_elo': event['white_elo'],
-			'black_elo': event['black_elo'],
-		}))
-	
-	async def game_state(self, event):
-		await self.send(text_data=json.dumps({
-			 'type': 'gameState',
-		'fen':  event['fen'],
-		'turn': event['turn'],
-		}))
-	
-	async def game_over(self, event):
-		await self.send(text_data=json.dumps({
-		'type':   'gameOver',
-		'winner': event['winner'],
-		'result': event['result'],
-		}))
-
 	@sync_to_async
 	def get_pending_invites_for_recipient(self, user_id):
 		from chat.models import GameInvite
@@ -234,45 +253,20 @@ class ChessConsumer(AsyncWebsocketConsumer):
 		black_user = game.players['black']
 		if not white_user or not black_user:
 			return
+		#written behind by the result pipeline so the game over goes out without waiting for the db
+		result_pipeline.submit(
+			'chess',
+			game_id=game.id,
+			white_id=white_user.id,
+			black_id=black_user.id,
+			winner=winner,
+			result=result_str,
+		)
 
-		@sync_to_async
-		def _save():
-			white_cp, _ = ChessPlayer.objects.get_or_create(user=white_user)
-			black_cp, _ = ChessPlayer.objects.get_or_create(user=black_user)
-
-			white_elo_before = white_cp.elo_rating
-			black_elo_before = black_cp.elo_rating
-
-			if winner == 'white':
-				white_result, black_result = 1, 0
-				result_str = '1-0'
-				white_cp.total_wins += 1
-				black_cp.total_losses += 1
-			elif winner == 'black':
-				white_result, black_result = 0, 1
-				result_str = '0-1'
-				white_cp.total_losses += 1
-				black_cp.total_wins += 1
-			else:
-				white_result, black_result = 0.5, 0.5
-				result_str = '1/2-1/2'
-			
-			#update players' elo
-			white_cp.update_elo(black_elo_before, white_result)
-			black_cp.update_elo(white_elo_before, black_result)
-
-			white_cp.total_games += 1
-			black_cp.total_games += 1
-
-			ChessMatch.objects.create(
-				white=white_cp,
-				black=black_cp,
-				result=result_str,
-				white_elo_before=white_elo_before,
-				black_elo_before=black_elo_before,
-			)
-
-		await _save()
+@sync_to_async
+def get_rating(user):
+	rating = ChessPlayer.objects.filter(user=user).values_list('elo_rating', flat=True).first()
+	return 1200 if rating is None else rating
 
 @sync_to_async
 def get_elos(white_user, black_user):
@@ -0,0 +1,110 @@
+import chess
+import chess.polyglot
+
+#same keys as chess.polyglot.zobrist_hash, so hashes can be checked against it
+HASHER = chess.polyglot.ZobristHasher(chess.polyglot.POLYGLOT_RANDOM_ARRAY)
+
+
+def _piece_key(piece, square):
+	return HASHER.array[64 * ((piece.piece_type - 1) * 2 + int(piece.color)) + square]
+
+
+class GameEndTracker:
+	"""Decides after every move whether a game is over, like board.outcome(claim_draw=True).
+
+	outcome(claim_draw=True) replays the moves since the last irreversible one to
+	count repetitions, and its fivefold check scans the whole move stack, so its
+	cost grows with the length of the game. This keeps a Zobrist hash of the
+	position, updated from the squares a move touches, and a counter of the
+	positions seen since the last irreversible move. Every check is then a
+	dictionary lookup or a cheap board test, whatever the length of the game.
+
+	All moves must go through push().
+	"""
+
+	def __init__(self, board):
+		self.board = board
+		self.pieces = HASHER.hash_board(board)  #piece placement part of the hash
+		self.key = self._key()
+		self.counts = {self.key: 1}             #position hash -> occurrences since the last irreversible move
+		self.repeated = set()                   #positions in counts seen at least twice
+
+	def _key(self, pieces=None):
+		board = self.board
+		pieces = self.pieces if pieces is None else pieces
+		return pieces ^ HASHER.hash_castling(board) ^ HASHER.hash_ep_square(board) ^ HASHER.hash_turn(board)
+
+	def _touched(self, move):
+		board = self.board
+		squares = [move.from_square, move.to_square]
+		if board.is_castling(move):
+			#the rook moves too; the whole back rank is 8 lookups
+			rank = chess.square_rank(move.from_square)
+			squares = [chess.square(f, rank) for f in range(8)]
+		elif board.is_en_passant(move):
+			squares.append(chess.square(chess.square_file(move.to_square), chess.square_rank(move.from_square)))
+		return squares
+
+	def _push(self, move):
+		"""Push `move` and return the piece placement hash of the new position"""
+		board = self.board
+		squares = self._touched(move)
+		before = [board.piece_at(square) for square in squares]
+		board.push(move)
+		pieces = self.pieces
+		for square, old in zip(squares, before):
+			new = board.piece_at(square)
+			if old != new:
+				if old:
+					pieces ^= _piece_key(old, square)
+				if new:
+					pieces ^= _piece_key(new, square)
+		return pieces
+
+	def push(self, move):
+		if self.board.is_irreversible(move):
+			#no position from before this move can come back
+			self.counts.clear()
+			self.repeated.clear()
+		self.pieces = self._push(move)
+		self.key = self._key()
+		seen = self.counts.get(self.key, 0) + 1
+		self.counts[self.key] = seen
+		if seen == 2:
+			self.repeated.add(self.key)
+
+	def _next_move_repeats(self):
+		#a draw can also be claimed with a move that makes a position occur for the third time
+		if not self.repeated:
+			return False
+		board = self.board
+		for move in board.generate_legal_moves():
+			if board.is_irreversible(move):
+				continue
+			pieces = self._push(move)
+			try:
+				if self._key(pieces) in self.repeated:
+					return True
+			finally:
+				board.pop()
+		return False
+
+	def outcome(self):
+		"""The chess.Outcome board.outcome(claim_draw=True) would return, or None"""
+		board = self.board
+		if board.is_checkmate():
+			return chess.Outcome(chess.Termination.CHECKMATE, not board.turn)
+		if board.is_insufficient_material():
+			return chess.Outcome(chess.Termination.INSUFFICIENT_MATERIAL, None)
+		if not any(board.generate_legal_moves()):
+			return chess.Outcome(chess.Termination.STALEMATE, None)
+		if board.is_seventyfive_moves():
+			return chess.Outcome(chess.Termination.SEVENTYFIVE_MOVES, None)
+		if self.counts[self.key] >= 5:
+			return chess.Outcome(chess.Termination.FIVEFOLD_REPETITION, None)
+		#can_claim_fifty_moves only tries moves once the clock is at 99 half-moves
+		if board.halfmove_clock >= 99 and board.can_claim_fifty_moves():
+			return chess.Outcome(chess.Termination.FIFTY_MOVES, None)
+		if self.counts[self.key] >= 3 or self._next_move_repeats():
+			return chess.Outcome(chess.Termination.THREEFOLD_REPETITION, None)
+		return None
@@ -0,0 +1,50 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class LegalMoveCache:
+	"""Legal moves of recently seen opening positions, by Zobrist hash (GameEndTracker.key).
+
+	Most games go through the same few opening positions, so their legal move
+	sets are generated once and then shared by every session: checking a move
+	there is a set lookup. Past the opening positions rarely repeat between
+	games, and board.is_legal (pseudo-legality plus a king safety test for that
+	one move) is cheaper than generating all moves to fill the cache.
+	"""
+
+	CAPACITY = 4096
+	MAX_PLY = 16  #positions after more half-moves than this are not cached
+
+	def __init__(self):
+		self._lock = Lock()
+		self._moves = OrderedDict()  #position hash -> frozenset of legal moves
+		self.hits = 0
+		self.misses = 0
+
+	def is_legal(self, board, key, move):
+		"""Whether `move` is legal on `board`, whose position hash is `key`"""
+		if board.ply() > self.MAX_PLY:
+			return board.is_legal(move)
+		with self._lock:
+			moves = self._moves.get(key)
+			if moves is not None:
+				self._moves.move_to_end(key)
+				self.hits += 1
+				return move in moves
+			self.misses += 1
+		moves = frozenset(board.legal_moves)
+		with self._lock:
+			self._moves[key] = moves
+			while len(self._moves) > self.CAPACITY:
+				self._moves.popitem(last=False)
+		return move in moves
+
+	def get_stats(self):
+		return {
+			'cached': len(self._moves),
+			'hits': self.hits,
+			'misses': self.misses,
+		}
+
+
+opening_moves = LegalMoveCache()
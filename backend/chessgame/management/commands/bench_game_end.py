@@ -0,0 +1,75 @@
+import random
+import time
+
+import chess
+import chess.polyglot
+from django.core.management.base import BaseCommand, CommandError
+
+from chessgame.endings import GameEndTracker
+
+
+def _random_game(rng, plies, reversible):
+	"""Moves of a random game of up to `plies` half-moves; most moves are reversible so games run long and repeat"""
+	board = chess.Board()
+	moves = []
+	while len(moves) < plies:
+		legal = list(board.legal_moves)
+		if not legal:
+			break
+		quiet = [move for move in legal if not board.is_irreversible(move)]
+		move = rng.choice(quiet if quiet and rng.random() < reversible else legal)
+		board.push(move)
+		moves.append(move)
+		if board.is_insufficient_material():
+			break
+	return moves
+
+
+class Command(BaseCommand):
+	help = "Time game-end detection per move, GameEndTracker against board.outcome(claim_draw=True), over long random games"
+
+	def add_arguments(self, parser):
+		parser.add_argument('--games', type=int, default=10)
+		parser.add_argument('--plies', type=int, default=2000, help='length of the games at most')
+		parser.add_argument('--bucket', type=int, default=250, help='plies per row of the report')
+		parser.add_argument('--reversible', type=float, default=0.9, help='share of moves picked among the reversible ones')
+		parser.add_argument('--seed', type=int, default=0)
+
+	def handle(self, *args, **options):
+		rng = random.Random(options['seed'])
+		bucket = options['bucket']
+		#bucket -> [moves, seconds with outcome(claim_draw=True), seconds with the tracker]
+		times = {}
+		endings = 0
+		for _ in range(options['games']):
+			moves = _random_game(rng, options['plies'], options['reversible'])
+			board = chess.Board()
+			tracked = chess.Board()
+			tracker = GameEndTracker(tracked)
+			for ply, move in enumerate(moves):
+				started = time.perf_counter()
+				board.push(move)
+				expected = board.outcome(claim_draw=True)
+				middle = time.perf_counter()
+				tracker.push(move)
+				outcome = tracker.outcome()
+				done = time.perf_counter()
+
+				if outcome != expected:
+					raise CommandError(f"ply {ply + 1} of {board.fen()}: tracker says {outcome}, python-chess {expected}")
+				if tracker.key != chess.polyglot.zobrist_hash(tracked):
+					raise CommandError(f"ply {ply + 1}: incremental hash differs from zobrist_hash")
+				endings += outcome is not None
+				row = times.setdefault(ply // bucket, [0, 0.0, 0.0])
+				row[0] += 1
+				row[1] += middle - started
+				row[2] += done - middle
+
+		self.stdout.write(f"{sum(row[0] for row in times.values())} moves, {endings} of them game-ending, all outcomes identical")
+		self.stdout.write(f"{'plies':>13} {'moves':>7} {'outcome() us':>13} {'tracker us':>11} {'speedup':>8}")
+		for i in sorted(times):
+			moves, full, tracked = times[i]
+			self.stdout.write(
+				f"{i * bucket + 1:>6}-{(i + 1) * bucket:<6} {moves:>7} {full / moves * 1e6:>13.1f} "
+				f"{tracked / moves * 1e6:>11.1f} {full / tracked:>7.1f}x"
+			)
@@ -0,0 +1,76 @@
+import random
+import time
+
+import chess
+from django.core.management.base import BaseCommand, CommandError
+
+from chessgame.endings import GameEndTracker
+from chessgame.legality import LegalMoveCache
+
+
+def _positions(rng, games, plies, book_plies):
+	"""(board, position hash, move) to validate: every move of random games plus one made-up, mostly illegal move per position.
+
+	The first book_plies moves are picked among two per position, so games
+	share their openings the way real ones do.
+	"""
+	samples = []
+	for _ in range(games):
+		board = chess.Board()
+		tracker = GameEndTracker(board)
+		for ply in range(plies):
+			legal = sorted(board.legal_moves, key=chess.Move.uci)
+			if not legal:
+				break
+			move = rng.choice(legal[:2] if ply < book_plies else legal)
+			made_up = chess.Move(rng.choice(list(chess.SquareSet(board.occupied_co[board.turn]))), rng.randrange(64))
+			snapshot = board.copy(stack=False)
+			samples.append((snapshot, tracker.key, move))
+			samples.append((snapshot, tracker.key, made_up))
+			tracker.push(move)
+	return samples
+
+
+class Command(BaseCommand):
+	help = "Moves validated per second: board.legal_moves membership, board.is_legal and the opening LegalMoveCache"
+
+	def add_arguments(self, parser):
+		parser.add_argument('--games', type=int, default=200)
+		parser.add_argument('--plies', type=int, default=60, help='length of the games')
+		parser.add_argument('--book-plies', type=int, default=10, help='opening half-moves games share')
+		parser.add_argument('--rounds', type=int, default=5, help='passes over the positions (the cache stays warm)')
+		parser.add_argument('--seed', type=int, default=0)
+
+	def handle(self, *args, **options):
+		rng = random.Random(options['seed'])
+		samples = _positions(rng, options['games'], options['plies'], options['book_plies'])
+		cache = LegalMoveCache()
+		checks = {
+			'move in board.legal_moves': lambda board, key, move: move in board.legal_moves,
+			'board.is_legal(move)': lambda board, key, move: board.is_legal(move),
+			'LegalMoveCache.is_legal': cache.is_legal,
+		}
+		expected = [board.is_legal(move) for board, _, move in samples]
+		groups = {
+			f'ply <= {cache.MAX_PLY}': [s for s in samples if s[0].ply() <= cache.MAX_PLY],
+			f'ply > {cache.MAX_PLY}': [s for s in samples if s[0].ply() > cache.MAX_PLY],
+		}
+		for name, check in checks.items():
+			answers = [check(*sample) for sample in samples]
+			if answers != expected:
+				raise CommandError(f"{name} disagrees with board.is_legal")
+
+		self.stdout.write(f"{len(samples)} moves ({sum(expected)} legal) from {options['games']} games, all checks agree")
+		self.stdout.write(f"{'':<27}" + ''.join(f"{group:>16}" for group in groups))
+		for name, check in checks.items():
+			rates = []
+			for group in groups.values():
+				started = time.perf_counter()
+				for _ in range(options['rounds']):
+					for board, key, move in group:
+						check(board, key, move)
+				elapsed = time.perf_counter() - started
+				rates.append(len(group) * options['rounds'] / elapsed if elapsed else 0)
+			self.stdout.write(f"{name:<27}" + ''.join(f"{rate:>12,.0f}/s  " for rate in rates))
+		stats = cache.get_stats()
+		self.stdout.write(f"cache: {stats['cached']} positions, {stats['hits']} hits, {stats['misses']} misses")
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chessgame', '0002_chessmatch_settlement_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chessmatch',
+            index=models.Index(fields=['white', '-timestamp', '-id'], name='chessmatch_white_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chessmatch',
+            index=models.Index(fields=['black', '-timestamp', '-id'], name='chessmatch_black_history_idx'),
+        ),
+    ]
@@ -3,14 +3,19 @@ from threading import Lock
 import chess
 from django.db import models
 from django.conf import settings
+from game.matchmaking import MatchmakingQueue
+from .endings import GameEndTracker
+from .legality import opening_moves
 
 class ChessSession:
 	_games = {}
 	_lock = Lock()
+	matchmaking = MatchmakingQueue()  #waiting sessions for join_chess, guarded by _lock
 
 	def __init__(self, game_id=None):
 		self.id = game_id or str(uuid.uuid4())
 		self.board = chess.Board()
+		self.endings = GameEndTracker(self.board)  #moves go through it, see apply_move
 		self.players = {'white': None, 'black': None}
 		self.status = 'waiting'
 		self.invitee_id = None
@@ -47,13 +52,14 @@ class ChessSession:
 		except ValueError:
 			return False, None, None
 		
-		if move not in self.board.legal_moves:
+		#set lookup for common opening positions, otherwise a check of this one move (no move generation)
+		if not opening_moves.is_legal(self.board, self.endings.key, move):
 			return False, None, None
 		
-		self.board.push(move)
+		self.endings.push(move)
 
-		#game might have just ended
-		outcome = self.board.outcome(claim_draw=True)
+		#game might have just ended; same answer as board.outcome(claim_draw=True) without replaying the game
+		outcome = self.endings.outcome()
 		if outcome:
 			self.status = 'finished'
 			if outcome.winner == chess.WHITE:
@@ -72,11 +78,19 @@ class ChessSession:
 	def delete_game(cls, game_id):
 		with cls._lock:
 			cls._games.pop(game_id, None)
+			cls.matchmaking.discard(game_id)
 	
 	@classmethod
 	def get_game(cls, game_id):
 		return cls._games.get(game_id)
 
+	#open matchmaking table that still waits for its second player
+	def is_open(self):
+		if self.status != 'waiting' or self.invitee_id is not None:
+			return False
+		#only one slot is filled
+		return (self.players['white'] is None) != (self.players['black'] is None)
+
 	def can_start(self):
 		return self.players['white'] and self.players['black'] and self.status == 'waiting'
 	
@@ -91,19 +105,6 @@ class ChessPlayer(models.Model):
 	total_wins = models.IntegerField(default = 0)
 	total_losses = models.IntegerField(default = 0)
 
-	def update_elo(self, opponent_elo, result):
-		#result is 1 for win, .5 for draw and 0 for loss
-		k = 40
-		expected = 1 / (1 + 10 ** ((opponent_elo - self.elo_rating) / 400))
-		self.elo_rating = round(self.elo_rating + k * (result - expected))
-		self.total_games += 1
-		#we currently don't track draws since we don't do it for stats either
-		if result == 1:
-			self.total_wins += 1
-		elif result == 0:
-			self.total_losses += 1
-		self.save()
-
 	@classmethod
 	def get_leaderboard(cls):
 		return cls.objects.select_related('user').order_by('-elo_rating')[:10]
@@ -115,5 +116,14 @@ class ChessMatch(models.Model):
 	white_elo_before = models.IntegerField()
 	black_elo_before = models.IntegerField()
 	timestamp = models.DateTimeField(auto_now_add=True)
+	#id of the result event this match was recorded from (game/results.py)
+	settlement_id = models.UUIDField(unique=True, null=True, blank=True, editable=False)
+
+	class Meta:
+		#a player's history is read newest first from each side (game/history.py)
+		indexes = [
+			models.Index(fields=['white', '-timestamp', '-id'], name='chessmatch_white_history_idx'),
+			models.Index(fields=['black', '-timestamp', '-id'], name='chessmatch_black_history_idx'),
+		]
 
 
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from game.models import HeadToHead, RatingResult
+from game.signals import match_settled
+from .models import ChessMatch, ChessPlayer
+
+
+#result is 1 for win, .5 for draw and 0 for loss
+RESULTS = {
+	'white': (1, 0, '1-0'),
+	'black': (0, 1, '0-1'),
+	None: (0.5, 0.5, '1/2-1/2'),
+}
+
+
+ELO_K = 40
+
+
+def elo_after(rating, opponent_rating, result):
+	expected = 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+	return round(rating + ELO_K * (result - expected))
+
+
+def settle_chess_match(white_user_id, black_user_id, winner, settlement_id=None):
+	"""Record a finished chess game and update both players in one transaction.
+
+	`winner` is 'white', 'black' or None for a draw. Both ChessPlayer rows are
+	locked together, so both Elo changes use the ratings the game was played at.
+	"""
+	white_result, black_result, result_str = RESULTS[winner]
+	with transaction.atomic():
+		locked = {
+			cp.user_id: cp
+			for cp in ChessPlayer.objects.select_for_update().filter(user_id__in=(white_user_id, black_user_id))
+		}
+		for user_id in (white_user_id, black_user_id):
+			if user_id not in locked:
+				ChessPlayer.objects.get_or_create(user_id=user_id)
+				locked[user_id] = ChessPlayer.objects.select_for_update().get(user_id=user_id)
+		white_cp, black_cp = locked[white_user_id], locked[black_user_id]
+
+		match = ChessMatch.objects.create(
+			white=white_cp,
+			black=black_cp,
+			result=result_str,
+			white_elo_before=white_cp.elo_rating,
+			black_elo_before=black_cp.elo_rating,
+			settlement_id=settlement_id,
+		)
+		HeadToHead.record('chess', white_user_id, black_user_id, white_result if winner else None, when=match.timestamp)
+		#we currently don't track draws since we don't do it for stats either
+		if settings.RATING_ENGINE == 'glicko2':
+			#rated later in a batched rating period (game/glicko2.py)
+			new_elos = (white_cp.elo_rating, black_cp.elo_rating)
+			RatingResult.objects.create(game_type='chess', user_id=white_user_id, opponent_id=black_user_id, score=white_result)
+		else:
+			new_elos = (
+				elo_after(white_cp.elo_rating, black_cp.elo_rating, white_result),
+				elo_after(black_cp.elo_rating, white_cp.elo_rating, black_result),
+			)
+		for cp, result, elo in ((white_cp, white_result, new_elos[0]), (black_cp, black_result, new_elos[1])):
+			ChessPlayer.objects.filter(pk=cp.pk).update(
+				elo_rating=elo,
+				total_games=F('total_games') + 1,
+				total_wins=F('total_wins') + int(result == 1),
+				total_losses=F('total_losses') + int(result == 0),
+			)
+			#mirror the update for match_settled receivers
+			cp.elo_rating = elo
+			cp.total_games += 1
+			cp.total_wins += int(result == 1)
+			cp.total_losses += int(result == 0)
+		transaction.on_commit(lambda: match_settled.send(sender=ChessMatch, game_type='chess', players=(white_cp, black_cp)))
+	return match
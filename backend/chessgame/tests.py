@@ -0,0 +1,73 @@
+import random
+
+import chess
+import chess.polyglot
+from django.test import SimpleTestCase
+
+from .endings import GameEndTracker
+
+
+class GameEndTrackerTests(SimpleTestCase):
+	def play(self, moves, fen=chess.STARTING_FEN):
+		"""Push `moves` (uci) and check the tracker against python-chess after every one"""
+		board = chess.Board(fen)
+		tracker = GameEndTracker(chess.Board(fen))
+		self.assertEqual(tracker.outcome(), board.outcome(claim_draw=True))
+		for uci in moves:
+			move = chess.Move.from_uci(uci)
+			board.push(move)
+			tracker.push(move)
+			self.assertEqual(tracker.key, chess.polyglot.zobrist_hash(tracker.board), uci)
+			self.assertEqual(tracker.outcome(), board.outcome(claim_draw=True), f"after {uci} in {board.fen()}")
+		return tracker.outcome()
+
+	def test_threefold_repetition(self):
+		knights = ['g1f3', 'g8f6', 'f3g1', 'f6g8'] * 2
+		self.assertEqual(self.play(knights).termination, chess.Termination.THREEFOLD_REPETITION)
+
+	def test_repetition_claimed_with_the_next_move(self):
+		#after 7 half-moves, g8 would repeat the start position for the third time
+		outcome = self.play(['g1f3', 'g8f6', 'f3g1', 'f6g8', 'g1f3', 'g8f6', 'f3g1'])
+		self.assertEqual(outcome.termination, chess.Termination.THREEFOLD_REPETITION)
+
+	def test_fivefold_repetition(self):
+		knights = ['g1f3', 'g8f6', 'f3g1', 'f6g8'] * 4
+		self.assertEqual(self.play(knights).termination, chess.Termination.FIVEFOLD_REPETITION)
+
+	def test_irreversible_move_resets_repetitions(self):
+		#the pawn moves make the earlier positions unreachable, so they don't count
+		knights = ['g1f3', 'g8f6', 'f3g1', 'f6g8']
+		moves = knights + ['e2e4', 'e7e5'] + knights + ['d2d4', 'e5d4'] + knights[:3]
+		self.assertIsNone(self.play(moves))
+
+	def test_castling_and_en_passant(self):
+		moves = ['e2e4', 'a7a6', 'e4e5', 'd7d5', 'e5d6', 'a6a5', 'g1f3', 'a5a4', 'f1e2', 'a8a7', 'e1g1', 'a7a8', 'f1e1', 'a8a7']
+		self.assertIsNone(self.play(moves))
+
+	def test_fifty_moves(self):
+		#kings and rooks shuffle; every move is reversible
+		fen = '4k3/8/8/8/8/8/R7/4K2r w - - 90 80'
+		outcome = self.play(['a2b2', 'h1g1', 'b2c2', 'g1f1', 'e1d1', 'f1g1', 'd1e1', 'g1h1', 'c2d2', 'e8f8'], fen)
+		self.assertEqual(outcome.termination, chess.Termination.FIFTY_MOVES)
+
+	def test_insufficient_material(self):
+		fen = '4k3/8/8/8/8/8/3p4/4K3 w - - 0 1'
+		self.assertEqual(self.play(['e1d2'], fen).termination, chess.Termination.INSUFFICIENT_MATERIAL)
+
+	def test_checkmate_and_stalemate(self):
+		self.assertEqual(self.play(['f2f3', 'e7e5', 'g2g4', 'd8h4']).termination, chess.Termination.CHECKMATE)
+		stalemate = self.play(['c1c2'], '7k/5Q2/8/8/8/8/8/K1R5 w - - 0 1')
+		self.assertEqual(stalemate.termination, chess.Termination.STALEMATE)
+
+	def test_random_games(self):
+		rng = random.Random(0)
+		for _ in range(20):
+			board = chess.Board()
+			moves = []
+			while len(moves) < 300 and not board.is_game_over(claim_draw=True):
+				legal = list(board.legal_moves)
+				quiet = [move for move in legal if not board.is_irreversible(move)]
+				move = rng.choice(quiet if quiet and rng.random() < 0.8 else legal)
+				board.push(move)
+				moves.append(move.uci())
+			self.play(moves)
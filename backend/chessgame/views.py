@@ -1,5 +1,5 @@
 from django.http import JsonResponse
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import condition, require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import get_user_model
 import jwt
@@ -7,11 +7,16 @@ from django.conf import settings
 import logging
 import random
 import json
-from .models import ChessSession, ChessPlayer, ChessMatch
+from .models import ChessSession, ChessPlayer
+from game.leaderboard import chess_leaderboard as chess_leaderboard_cache
+from game.history import InvalidCursor, get_history
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
+LEADERBOARD_SIZE = 10
+MAX_RANK_WINDOW = 50
+
 
 def get_user_from_access_cookie(request):
 	#jwt from access_token cookie like tournament helpers, not django session login
@@ -40,39 +45,51 @@ def join_chess(request):
 	body = json.loads(request.body or '{}')
 	invitee_id = body.get('invitee_id')
 
-	#search and create are atomic so two players never both see an empty lobby
+	#a player waiting for a close enough rating is joined right away; otherwise every player
+	#waits at their own table, and once their socket is connected the rating matchmaker
+	#(chessgame/consumers.py) pairs them and moves one to the other's table
 	#colors are pre-assigned here so WS connect order does not cause a race
+	#the matchmaking queue keeps the lock hold O(1) instead of a scan over every session
+	from .consumers import chess_matchmaker
+	rating = ChessPlayer.objects.filter(user=user).values_list('elo_rating', flat=True).first()
 	with ChessSession._lock:
+		queue = ChessSession.matchmaking
 		if not invitee_id:
-			for game in ChessSession._games.values():
-				if game.status == 'waiting' and game.invitee_id is not None:
-					logger.debug(f"[join_chess] skipping invite-only session {game.id} for open matchmaking user={user}")
-					continue
-				if game.status == 'waiting' and game.invitee_id is None:
-					white_id = getattr(game.players['white'], 'id', None)
-					black_id = getattr(game.players['black'], 'id', None)
-					#if only one slot is filled
-					if (white_id is None) != (black_id is None):
-						#if the slot is not filled by this user
-						if user.id not in (white_id, black_id):
-							if game.players['white'] is None:
-								game.players['white'] = user
-							else:
-								game.players['black'] = user
-
-						return JsonResponse({'gameId': game.id})
+			#a player who is already waiting gets their own table back
+			game_id = queue.open_game_of(user.id, _is_open_chess_game)
+			if game_id is not None:
+				return JsonResponse({'gameId': game_id})
+
+			while True:
+				ticket = chess_matchmaker.claim(user.id, 1200 if rating is None else rating)
+				if ticket is None:
+					break
+				game = ChessSession._games.get(ticket.game_id)
+				if game is not None and game.is_open():
+					game.players['white' if game.players['white'] is None else 'black'] = user
+					queue.discard(game.id)
+					logger.info(f"[chess matchmaking] {user.id} joins {ticket.user_id} at {game.id} over HTTP")
+					return JsonResponse({'gameId': game.id})
 
 		game = ChessSession()
 		color = random.choice(['white', 'black'])
 		game.players[color] = user
+		ChessSession._games[game.id] = game
 		if invitee_id:
 			game.invitee_id = str(invitee_id)
-		ChessSession._games[game.id] = game
+		else:
+			queue.add_open(game.id, user.id)
 
 	logger.info(f"Player {user} created game {game.id} as {color}")
 	return JsonResponse({'gameId': game.id})
 
 
+def _is_open_chess_game(game_id):
+	#a queued table can still take a second player
+	game = ChessSession._games.get(game_id)
+	return game is not None and game.is_open()
+
+
 @require_http_methods(["GET"])
 def chess_stats(request):
 	user = get_user_from_access_cookie(request)
@@ -90,19 +107,38 @@ def chess_stats(request):
 	})
 
 
+#served from memory (game/leaderboard.py), a poll of an unchanged board gets a 304
 @require_http_methods(["GET"])
+@condition(etag_func=lambda request: chess_leaderboard_cache.top(LEADERBOARD_SIZE)[0])
 def chess_leaderboard(request):
-	players = ChessPlayer.get_leaderboard()
-	leaderboard = [
-		{
-			'username': p.user.username,
-			'elo_rating': p.elo_rating,
-			'total_wins': p.total_wins,
-			'total_games': p.total_games,
-		}
-		for p in players
-	]
-	return JsonResponse({'leaderboard': leaderboard})
+	_, leaderboard = chess_leaderboard_cache.top(LEADERBOARD_SIZE)
+	response = JsonResponse({'leaderboard': leaderboard})
+	response['Cache-Control'] = 'no-cache'
+	return response
+
+
+#rank of a player (?username=..., the caller by default) with ?around=N players above and below
+@require_http_methods(["GET"])
+def chess_leaderboard_rank(request):
+	username = request.GET.get('username')
+	if username:
+		user_id = User.objects.filter(username=username).values_list('pk', flat=True).first()
+		if user_id is None:
+			return JsonResponse({'error': 'User not found'}, status=404)
+	else:
+		user = get_user_from_access_cookie(request)
+		if not user:
+			return JsonResponse({'error': 'Authentication required'}, status=401)
+		user_id = user.id
+	try:
+		around = min(max(int(request.GET.get('around', 5)), 0), MAX_RANK_WINDOW)
+	except ValueError:
+		return JsonResponse({'error': 'around must be a number'}, status=400)
+
+	rank, total, rows = chess_leaderboard_cache.around(user_id, around)
+	if rank is None:
+		return JsonResponse({'error': 'Player not found'}, status=404)
+	return JsonResponse({'rank': rank, 'total_players': total, 'leaderboard': rows})
 
 
 @require_http_methods(["GET"])
@@ -113,31 +149,14 @@ def chess_match_history(request):
 	try:
 		player = ChessPlayer.objects.get(user=user)
 	except ChessPlayer.DoesNotExist:
-		return JsonResponse({'matches': []})
-	matches_qs = ChessMatch.objects.filter(
-		white=player
-	).union(
-		ChessMatch.objects.filter(black=player)
-	).order_by('-timestamp')[:20]
-	matches = []
-	for m in matches_qs:
-		white_user = m.white.user.username if m.white and m.white.user else '?'
-		black_user = m.black.user.username if m.black and m.black.user else '?'
-		is_white = m.white_id == player.id
-		opponent = black_user if is_white else white_user
-		if m.result == '1-0':
-			winner = white_user
-		elif m.result == '0-1':
-			winner = black_user
-		else:
-			winner = None
-		matches.append({
-			'white': white_user,
-			'black': black_user,
-			'opponent': opponent,
-			'result': m.result,
-			'winner': winner,
-			'timestamp': m.timestamp.isoformat(),
-		})
-	return JsonResponse({'matches': matches})
-
+		return JsonResponse({'matches': [], 'next_cursor': None})
+	try:
+		limit = int(request.GET.get('limit', 20))
+	except ValueError:
+		return JsonResponse({'error': 'limit must be a number'}, status=400)
+	#keyset pages: pass next_cursor back as ?cursor= for older games
+	try:
+		matches, next_cursor = get_history(chess_player=player, limit=limit, cursor=request.GET.get('cursor'))
+	except InvalidCursor as e:
+		return JsonResponse({'error': str(e)}, status=400)
+	return JsonResponse({'matches': matches, 'next_cursor': next_cursor})
@@ -14,12 +14,16 @@ from game.routing import websocket_urlpatterns as game_ws
 from chat.routing import websocket_urlpatterns as chat_ws
 from users.token_auth import TokenAuthMiddleware
 from chessgame.routing import websocket_urlpatterns as chess_ws
+from django_server.startup import StartupMiddleware, schedule_startup
 
-application = ProtocolTypeRouter({
+# the result pipeline and cross-process invalidations run from startup, for HTTP-only workers too
+schedule_startup()
+
+application = StartupMiddleware(ProtocolTypeRouter({
 	"http": django_asgi_app,
 	"websocket": AuthMiddlewareStack(
 		TokenAuthMiddleware(
 			URLRouter(game_ws + chat_ws + chess_ws)
 		)
 	),
-})
\ No newline at end of file
+}))
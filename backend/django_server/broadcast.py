@@ -0,0 +1,41 @@
+import json
+
+# Serialize-once fan-out.
+# A group_send with a plain dict makes every receiving consumer run its own
+# json.dumps on the same payload, so a global chat message to N users gets
+# encoded N times. Instead the sender encodes the client-facing message once
+# and every member just forwards the finished text (or bytes) frame.
+
+
+def encoded_event(message, frame=None, latest=None):
+    """Channel-layer event carrying `message` already encoded as JSON text.
+
+    `frame` is an optional binary encoding of the same message for consumers
+    that speak a binary protocol (see EncodedSendMixin.binary). With `latest`
+    set, a layer that supports it (django_server.layers.FanoutChannelLayer)
+    replaces a still-queued event with the same key instead of queueing this one,
+    and marks it 'conflated'.
+    """
+    event = {'type': 'send.encoded', 'text': json.dumps(message)}
+    if frame is not None:
+        event['bytes'] = frame
+    if latest is not None:
+        event['latest'] = latest
+    return event
+
+
+async def group_send_json(channel_layer, group, message):
+    """Send the client-facing `message` to every socket in `group`, encoding it once"""
+    await channel_layer.group_send(group, encoded_event(message))
+
+
+class EncodedSendMixin:
+    """Consumer mixin that delivers events built by encoded_event() as-is"""
+
+    binary = False  # set per connection by consumers that negotiated binary frames
+
+    async def send_encoded(self, event):
+        if self.binary and 'bytes' in event:
+            await self.send(bytes_data=event['bytes'])
+        else:
+            await self.send(text_data=event['text'])
@@ -0,0 +1,219 @@
+import asyncio
+import random
+import string
+import time
+from collections import deque
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+
+class _Mailbox:
+    """Pending messages of one channel plus the receivers waiting on it"""
+
+    __slots__ = ('queue', 'waiters', 'latest')
+
+    def __init__(self):
+        self.queue = deque()    # [expires_at, message] entries, oldest first
+        self.waiters = deque()  # futures of receive() calls blocked on an empty queue
+        self.latest = {}        # conflation key -> its still-queued entry
+
+
+class FanoutChannelLayer(BaseChannelLayer):
+    """In-process channel layer built for group fan-out.
+
+    Drop-in replacement for channels.layers.InMemoryChannelLayer (select it in
+    CHANNEL_LAYERS) with three differences:
+
+    - group_send() queues the same message object for every member instead of
+      a deepcopy per channel. Messages must be treated as read-only once sent,
+      which holds for every handler in this project (see django_server.broadcast).
+    - Groups are dicts and every channel keeps the set of groups it joined, so
+      add, discard and expiry cleanup never scan all groups.
+    - A message carrying a 'latest' key replaces the queued message of the same
+      channel with the same key instead of queueing behind it. Pong uses this
+      for state frames so a slow socket gets the newest frame, not a backlog.
+      The replacement is marked 'conflated' so the receiver knows it missed
+      messages (a Pong JSON client gets a full frame instead of a delta).
+
+    get_stats() reports queue depth and how many messages were dropped (queue
+    full) or conflated.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.group_expiry = group_expiry
+        self.channels = {}     # channel -> _Mailbox
+        self.groups = {}       # group -> {channel: joined_at}
+        self.memberships = {}  # channel -> set of groups
+        self.sent = 0
+        self.dropped = 0
+        self.conflated = 0
+        self.max_depth = 0
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        """Send a message onto a channel; raises ChannelFull when its queue is full."""
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        assert "__asgi_channel__" not in message
+        if not self._deliver(channel, message, time.time() + self.expiry):
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        """Receive the first message that arrives on the channel."""
+        self.require_valid_channel_name(channel)
+        mailbox = self.channels.get(channel)
+        if mailbox is None:
+            mailbox = self.channels[channel] = _Mailbox()
+        now = time.time()
+        while mailbox.queue:
+            expires_at, message = self._pop(mailbox)
+            if not mailbox.queue and not mailbox.waiters:
+                del self.channels[channel]
+            if expires_at >= now:
+                return message
+        mailbox = self.channels.setdefault(channel, mailbox)
+        waiter = asyncio.get_running_loop().create_future()
+        mailbox.waiters.append(waiter)
+        try:
+            return await waiter
+        finally:
+            if waiter in mailbox.waiters:
+                mailbox.waiters.remove(waiter)
+            # A consumer that stopped receiving leaves nothing behind
+            if not mailbox.waiters and not mailbox.queue and self.channels.get(channel) is mailbox:
+                del self.channels[channel]
+
+    async def new_channel(self, prefix="specific."):
+        return "%s.fanout!%s" % (
+            prefix,
+            "".join(random.choice(string.ascii_letters) for i in range(12)),
+        )
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        self.groups.setdefault(group, {})[channel] = time.time()
+        self.memberships.setdefault(channel, set()).add(group)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        self._leave(group, channel)
+
+    async def group_send(self, group, message):
+        """Queue one shared message object for every member of the group."""
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        members = self.groups.get(group)
+        if not members:
+            return
+        now = time.time()
+        expires_at = now + self.expiry
+        stale_before = now - self.group_expiry
+        for channel, joined_at in list(members.items()):
+            if joined_at < stale_before:
+                self._leave(group, channel)
+                continue
+            self._deliver(channel, message, expires_at)
+
+    # Flush extension
+
+    async def flush(self):
+        for mailbox in self.channels.values():
+            for waiter in mailbox.waiters:
+                waiter.cancel()
+        self.channels = {}
+        self.groups = {}
+        self.memberships = {}
+
+    async def close(self):
+        pass
+
+    def get_stats(self):
+        depths = [len(mailbox.queue) for mailbox in self.channels.values()]
+        return {
+            'channels': len(self.channels),
+            'groups': len(self.groups),
+            'queued': sum(depths),
+            'depth': max(depths, default=0),
+            'max_depth': self.max_depth,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'conflated': self.conflated,
+        }
+
+    # Internals
+
+    def _deliver(self, channel, message, expires_at):
+        """Queue (or hand straight to a waiting receiver) one message; False if it was dropped"""
+        mailbox = self.channels.get(channel)
+        if mailbox is None:
+            mailbox = self.channels[channel] = _Mailbox()
+
+        while mailbox.waiters:
+            waiter = mailbox.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(message)
+                self.sent += 1
+                return True
+
+        key = message.get('latest')
+        if key is not None:
+            entry = mailbox.latest.get(key)
+            if entry is not None:
+                message = {**message, 'conflated': True}
+                entry[0] = expires_at
+                entry[1] = message
+                self.conflated += 1
+                return True
+
+        queue = mailbox.queue
+        if len(queue) >= self.get_capacity(channel):
+            if queue[0][0] < time.time():
+                # Nobody has read this channel for `expiry` seconds: treat it as gone
+                self._expire(channel)
+            self.dropped += 1
+            return False
+
+        entry = [expires_at, message]
+        queue.append(entry)
+        if key is not None:
+            mailbox.latest[key] = entry
+        self.sent += 1
+        if len(queue) > self.max_depth:
+            self.max_depth = len(queue)
+        return True
+
+    def _pop(self, mailbox):
+        entry = mailbox.queue.popleft()
+        key = entry[1].get('latest')
+        if key is not None and mailbox.latest.get(key) is entry:
+            del mailbox.latest[key]
+        return entry
+
+    def _expire(self, channel):
+        """Drop a channel that let messages expire unread, like the stock layer does"""
+        mailbox = self.channels.get(channel)
+        if mailbox is not None and not mailbox.waiters:
+            del self.channels[channel]
+        for group in list(self.memberships.get(channel, ())):
+            self._leave(group, channel)
+
+    def _leave(self, group, channel):
+        members = self.groups.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                del self.groups[group]
+        groups = self.memberships.get(channel)
+        if groups is not None:
+            groups.discard(group)
+            if not groups:
+                del self.memberships[channel]
@@ -69,12 +69,32 @@ WSGI_APPLICATION = 'django_server.wsgi.application'
 ASGI_APPLICATION = 'django_server.asgi.application'
 
 # Channels configuration
+# FanoutChannelLayer shares one message object across a group instead of copying it per
+# member; set CHANNEL_LAYER_BACKEND=channels.layers.InMemoryChannelLayer for the stock layer.
+# Both only reach consumers of this process: nothing that must cross processes may go
+# through the channel layer (cache invalidations use the database log, game/leaderboard.py).
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
+        "BACKEND": os.getenv('CHANNEL_LAYER_BACKEND', 'django_server.layers.FanoutChannelLayer'),
     },
 }
 
+# Pong simulation: every live match is stepped by one shared fixed-timestep clock
+PONG_TICK_RATE = 60  # physics steps per second
+PONG_PHYSICS_ENGINE = os.getenv('PONG_PHYSICS_ENGINE', 'python')  # 'numpy' steps all matches in one vectorized batch
+# Network snapshots per second a client can pick (?rate=<hz> on the game socket); the first is the default
+PONG_SNAPSHOT_RATES = [30, 20]
+# Per-socket cap on inbound game messages (token bucket: sustained per second, burst)
+PONG_INPUT_RATE = 120
+PONG_INPUT_BURST = 20
+
+# Finished-match results are journaled here and written to the database in the background (game/results.py)
+RESULT_JOURNAL_PATH = os.getenv('RESULT_JOURNAL_PATH', str(BASE_DIR / 'var' / 'result_journal.jsonl'))
+
+# 'elo' updates ratings per match at settlement; 'glicko2' only records results there and
+# rates them in batched periods with `manage.py rate_period` (run it on a schedule, e.g. hourly)
+RATING_ENGINE = os.getenv('RATING_ENGINE', 'elo')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
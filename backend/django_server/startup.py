@@ -0,0 +1,54 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+_started = False
+
+
+def start_background_services():
+    """Start this process's background work: results journaled by earlier runs are applied. Needs the running loop."""
+    global _started
+    if _started:
+        return
+    from game.results import result_pipeline
+
+    result_pipeline.start()
+    _started = True
+
+
+def schedule_startup():
+    """Run start_background_services as soon as the server's event loop runs.
+
+    Called when the ASGI application is imported. uvicorn imports it from inside
+    its running loop; daphne imports it before starting the loop it installed
+    as the current one. Servers speaking the ASGI lifespan protocol also start
+    the services through StartupMiddleware.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        try:
+            loop = asyncio.get_event_loop_policy().get_event_loop()
+        except RuntimeError:
+            return  # StartupMiddleware starts them with the first connection
+    loop.call_soon(start_background_services)
+
+
+class StartupMiddleware:
+    """Answers ASGI lifespan events and makes sure the background services run before any connection is served"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        start_background_services()
+        if scope['type'] != 'lifespan':
+            return await self.app(scope, receive, send)
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
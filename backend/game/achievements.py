@@ -0,0 +1,123 @@
+from bisect import bisect_right
+from threading import Lock
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .leaderboard import publish_invalidation, sync_invalidations
+from .models import Achievement, Player
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AchievementIndex:
+    """The achievement catalog, as sorted thresholds per requirement type.
+
+    Unlock checks used to read the whole Achievement table (minus what the player
+    already had) after every match. The catalog is small and rarely changes, so it
+    is kept here instead: per requirement type the thresholds are sorted, and the
+    achievements a stat reached (or crossed during a match) are a bisect away.
+
+    Loaded on first use and dropped whenever an Achievement is saved or deleted,
+    so the next lookup reloads it; other worker processes drop theirs through
+    the leaderboard invalidation log (leaderboard.sync_invalidations).
+    """
+
+    # Stats that never decrease: an achievement crossed by one of these cannot have been earned before
+    MONOTONIC = {'total_games', 'total_wins', 'win_streak', 'best_win_streak'}
+
+    def __init__(self):
+        self._lock = Lock()
+        self._thresholds = None  # requirement_type -> ([requirement_value, ...], [Achievement, ...]), sorted by value
+        self.loads = 0
+
+    def _load(self):
+        thresholds = {}
+        for achievement in Achievement.objects.order_by('requirement_type', 'requirement_value', 'pk'):
+            values, achievements = thresholds.setdefault(achievement.requirement_type, ([], []))
+            values.append(achievement.requirement_value)
+            achievements.append(achievement)
+        self.loads += 1
+        return thresholds
+
+    def thresholds(self):
+        sync_invalidations()
+        thresholds = self._thresholds
+        if thresholds is None:
+            with self._lock:
+                if self._thresholds is thresholds:
+                    self._thresholds = self._load()
+                thresholds = self._thresholds
+        return thresholds
+
+    def invalidate(self):
+        with self._lock:
+            self._thresholds = None
+
+    def reached(self, requirement_type, value):
+        """Achievements of `requirement_type` whose requirement `value` meets"""
+        entry = self.thresholds().get(requirement_type)
+        if entry is None:
+            return []
+        values, achievements = entry
+        return achievements[:bisect_right(values, value)]
+
+    def crossed(self, requirement_type, before, after):
+        """Achievements of `requirement_type` with a requirement in (before, after]"""
+        entry = self.thresholds().get(requirement_type)
+        if entry is None or after <= before:
+            return []
+        values, achievements = entry
+        return achievements[bisect_right(values, before):bisect_right(values, after)]
+
+    def reached_by(self, player):
+        """Every achievement the player's current stats qualify for"""
+        return [
+            achievement
+            for requirement_type in self.thresholds()
+            for achievement in self.reached(requirement_type, player.achievement_stat(requirement_type))
+        ]
+
+    def crossed_by(self, player, before):
+        """Achievements the player's stats crossed since `before` (requirement_type -> stat value).
+
+        Returns (certainly_new, maybe_earned): the second list holds achievements
+        of non-monotonic stats (elo), which the player may have crossed before.
+        """
+        certainly_new, maybe_earned = [], []
+        for requirement_type in self.thresholds():
+            crossed = self.crossed(requirement_type, before[requirement_type], player.achievement_stat(requirement_type))
+            if crossed:
+                (certainly_new if requirement_type in self.MONOTONIC else maybe_earned).extend(crossed)
+        return certainly_new, maybe_earned
+
+    def stat_snapshot(self, player):
+        """The player's value for every indexed requirement type, to pass to crossed_by() later"""
+        return {requirement_type: player.achievement_stat(requirement_type) for requirement_type in self.thresholds()}
+
+    def get_stats(self):
+        thresholds = self._thresholds or {}
+        return {
+            'loaded': self._thresholds is not None,
+            'loads': self.loads,
+            'types': {requirement_type: len(values) for requirement_type, (values, _) in thresholds.items()},
+        }
+
+
+achievement_index = AchievementIndex()
+
+
+@receiver(post_save, sender=Achievement)
+@receiver(post_delete, sender=Achievement)
+def invalidate_achievement_index(sender, **kwargs):
+    achievement_index.invalidate()
+    publish_invalidation(None, achievements=True)
+
+
+def players_qualifying(achievement):
+    """Players whose stats meet `achievement` but who have not earned it (for backfills)"""
+    field = Player.ACHIEVEMENT_STATS.get(achievement.requirement_type)
+    if field is None:
+        return Player.objects.none()
+    return Player.objects.filter(**{f'{field}__gte': achievement.requirement_value}).exclude(
+        achievements__achievement=achievement
+    )
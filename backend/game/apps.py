@@ -1,5 +1,12 @@
+from importlib import import_module
+
 from django.apps import AppConfig
 
 class GameConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'game'
\ No newline at end of file
+    name = 'game'
+
+    def ready(self):
+        # connect the in-memory index, leaderboard and profile signals
+        for module in ('achievements', 'leaderboard', 'profiles'):
+            import_module(f'{self.name}.{module}')
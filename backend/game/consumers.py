@@ -6,12 +6,29 @@ from .models import GameSession
 from django.utils import timezone
 from channels.db import database_sync_to_async
 from .models import GameSession, Player
-from .services import match_ends
+from .results import submit_pong_result
+from .scheduler import scheduler
+from .protocol import DeltaEncoder, pack_state, unpack_input, select_subprotocol
+from .throttle import TokenBucket
+from .matchmaking import RatingMatchmaker
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django_server.broadcast import EncodedSendMixin, encoded_event, group_send_json
+from urllib.parse import parse_qs
+import time
 import logging
 from chat.consumers import IN_GAME_USERS, PENDING_GAME_RESULTS
 
 logger = logging.getLogger(__name__)
 
+# Snapshot rates clients can choose from, and how many simulation ticks apart their frames go out
+SNAPSHOT_RATES = getattr(settings, 'PONG_SNAPSHOT_RATES', [30])
+SNAPSHOT_STRIDES = {rate: max(1, round(scheduler.tick_rate / rate)) for rate in SNAPSHOT_RATES}
+
+# Inbound messages per second (sustained, burst) each game socket may send
+INPUT_RATE = getattr(settings, 'PONG_INPUT_RATE', 120)
+INPUT_BURST = getattr(settings, 'PONG_INPUT_BURST', 20)
+
 # Helper functions for database operations (synchronous)
 def update_game_to_ready(game_id):
     """Update tournament game status to ready"""
@@ -157,11 +174,52 @@ def update_game_completed_tie(game_id):
         logger.debug(f"No tournament game found for game_id {game_id}")
         return False
 
-class GameConsumer(AsyncWebsocketConsumer):
+async def pair_pong_players(host, guest):
+    """Seat the guest in the host's session and tell the guest's socket to move there"""
+    host_game = GameSession.get_game(host.game_id)
+    guest_game = GameSession.get_game(guest.game_id)
+    with GameSession._lock:
+        host_open = host_game is not None and host_game.is_open()
+        guest_open = guest_game is not None and guest_game.is_open()
+        if host_open and guest_open:
+            guest_side = 'left' if guest_game.players['left'] else 'right'
+            host_side = 'left' if host_game.players['left'] is None else 'right'
+            host_game.players[host_side] = guest_game.players[guest_side]
+            # Leave the guest's old session empty so its socket closing has no effect
+            guest_game.players[guest_side] = None
+            guest_game.players_ids[guest_side] = None
+            GameSession.matchmaking.discard(host.game_id)
+            GameSession.matchmaking.discard(guest.game_id)
+    if not (host_open and guest_open):
+        # One side left in the meantime; the other keeps its place in the queue
+        for ticket, still_open in ((host, host_open), (guest, guest_open)):
+            if still_open:
+                pong_matchmaker.enqueue(ticket.user_id, ticket.game_id, ticket.rating, since=ticket.since)
+        return
+
+    logger.info(f"[pong matchmaking] {guest.user_id} ({guest.rating}) joins {host.user_id} ({host.rating}) in {host.game_id}")
+    # connect() turns away users still marked in a game; the guest's new socket marks them again
+    IN_GAME_USERS.discard(str(guest.user_id))
+    await group_send_json(
+        get_channel_layer(),
+        f'game_{guest.game_id}',
+        {'type': 'matchFound', 'gameId': host.game_id}
+    )
+
+
+pong_matchmaker = RatingMatchmaker('pong', pair_pong_players)
+
+
+class GameConsumer(EncodedSendMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.game_id = self.scope['url_route']['kwargs']['game_id']
         self.game_group_name = f'game_{self.game_id}'
         self.role = None
+        self.binary = False
+        self.snapshot_rate = self.choose_snapshot_rate()
+        self.snapshot_group_name = f'{self.game_group_name}_{self.snapshot_rate}'
+        self.sent_score = None
+        self.input_bucket = TokenBucket(INPUT_RATE, INPUT_BURST)
         
         # Get or reject game
         self.game = GameSession.get_game(self.game_id)
@@ -200,19 +258,22 @@ class GameConsumer(AsyncWebsocketConsumer):
         # Add player to game
         self.role = self.game.add_player(self.scope['user'], getattr(self.scope.get('user'), 'id', None))
         logger.debug(f"Assigned role: {self.role} to: {self.scope['user']}")
-        # Join game group
+        # Join game group, and the group that gets state frames at our snapshot rate
         await self.channel_layer.group_add(
             self.game_group_name,
             self.channel_name
         )
+        await self.channel_layer.group_add(
+            self.snapshot_group_name,
+            self.channel_name
+        )
         
         # Accept WebSocket connection with subprotocol if provided
         headers = dict(self.scope.get('headers', []))
         
-        subprotocol = headers.get(b'sec-websocket-protocol')
-        if subprotocol:
-            # Echo back the first subprotocol (JWT token)
-            protocol_str = subprotocol.decode().split(',')[0].strip()
+        # Echo back the binary state protocol if offered, otherwise the first subprotocol (JWT token)
+        protocol_str, self.binary = select_subprotocol(headers.get(b'sec-websocket-protocol'))
+        if protocol_str:
             logger.debug(f"protocolstr = {protocol_str}")
             await self.accept(subprotocol=protocol_str)
         else:
@@ -229,7 +290,9 @@ class GameConsumer(AsyncWebsocketConsumer):
         await self.send(text_data=json.dumps({
             'type': 'assign',
             'role': self.role,
-            'user_id': user_id
+            'user_id': user_id,
+            'tick_rate': scheduler.tick_rate,
+            'snapshot_rate': self.snapshot_rate,
         }))
         logger.debug(f"Start game?: {self.game.can_start()}")
 
@@ -261,27 +324,32 @@ class GameConsumer(AsyncWebsocketConsumer):
             players = self.game.get_players()
             p1 = players.get('left')
             p2 = players.get('right')
-            await self.channel_layer.group_send(
+            await group_send_json(
+                self.channel_layer,
                 self.game_group_name,
                 {
-                    'type': 'game_start',
+                    'type': 'gameStart',
                     'P1': getattr(p1, 'username', 'Player 1'),
                     'P2': getattr(p2, 'username', 'Player 2'),
                     'p1_id': getattr(p1, 'id', None),
                     'p2_id': getattr(p2, 'id', None)
                 }
             )
-            # Start game loop
-            asyncio.create_task(self.game_loop())
+            # Hand the game to the shared tick scheduler
+            scheduler.register(self.game, self.on_tick)
         else:
             await self.channel_layer.group_send('global_chat', {'type': 'trigger.online.users.broadcast'})
             if self.game.isTournamentGame:
                 # Start timeout checker if this is a tournament game in waiting state
                 asyncio.create_task(self.check_join_timeout())
+            elif user_id is not None and self.game.is_open():
+                # Waiting alone in an open session: look for an opponent of similar rating
+                pong_matchmaker.enqueue(user_id, self.game_id, await self.get_rating(user_id))
 
     async def disconnect(self, close_code):
         logger.debug(f"Disconnecting from game: {self.game_id} with channel: {self.channel_name} and player {self.scope['user']}")
         if hasattr(self, 'game') and self.game:
+            pong_matchmaker.remove(getattr(self.scope.get('user'), 'id', None), self.game_id)
             players_before = self.game.get_players()
             departing_user = self.scope.get('user')
             departing_role = None
@@ -292,6 +360,8 @@ class GameConsumer(AsyncWebsocketConsumer):
 
             status_before = self.game.status
             self.game.remove_player(self.scope['user'])
+            if self.game.status != 'active':
+                scheduler.unregister(self.game_id)
 
             # If a participant disconnects during an active game, finish the game
             # and award win to the remaining player to avoid freeze on opponent side.
@@ -302,29 +372,24 @@ class GameConsumer(AsyncWebsocketConsumer):
                 winner_name = getattr(winner_user, 'username', 'Player disconnected')
 
                 self.game.status = 'completed'
-                await sync_to_async(update_game_completed)(self.game_id, winner_id, winner_name)
 
-                # Force winner's score so match_ends can determine winner correctly
+                # Force winner's score so the settlement can determine winner correctly
                 if departing_role == 'left':
-                    self.game.state['score']['p1'] = 0
-                    self.game.state['score']['p2'] = 1
+                    self.game.state.score_p1 = 0
+                    self.game.state.score_p2 = 1
                 else:
-                    self.game.state['score']['p1'] = 1
-                    self.game.state['score']['p2'] = 0
-                result_data = await database_sync_to_async(match_ends)(
-                    self.game,
-                    players_before['left'],
-                    players_before['right'],
-                )
-                new_achievements = result_data.get('new_achievements', {})
+                    self.game.state.score_p1 = 1
+                    self.game.state.score_p2 = 0
+                # Tournament update and settlement are written behind; achievements follow on the chat socket
+                submit_pong_result(self.game, players_before['left'], players_before['right'], winner_id, winner_name)
 
-                await self.channel_layer.group_send(
+                await group_send_json(
+                    self.channel_layer,
                     self.game_group_name,
                     {
-                        'type': 'game_over',
+                        'type': 'gameOver',
                         'winner': winner_name,
                         'winner_id': winner_id,
-                        'new_achievements': new_achievements,
                     }
                 )
                 loser_name = getattr(departing_user, 'username', None)
@@ -332,10 +397,10 @@ class GameConsumer(AsyncWebsocketConsumer):
                     "type": "game_result",
                     "winner": winner_name,
                     "loser": loser_name,
+                    "draw_players": None,
                     "game_type": "pong",
-                    "is_tournament": self.game.isTournamentGame
                 }
-                await self.channel_layer.group_send("global_chat", result_msg)
+                await group_send_json(self.channel_layer, "global_chat", result_msg)
                 for pid in [str(winner_id), str(getattr(departing_user, 'id', None))]:
                     if pid:
                         PENDING_GAME_RESULTS[pid] = result_msg
@@ -357,12 +422,13 @@ class GameConsumer(AsyncWebsocketConsumer):
                 await sync_to_async(reset_game_to_ready)(self.game_id)
 
             if self.game.status == 'completed' and status_before != 'active':
-                await self.channel_layer.group_send(
+                await group_send_json(
+                    self.channel_layer,
                     self.game_group_name,
                     {
-                        'type': 'game_over',
+                        'type': 'gameOver',
                         'winner': 'Player disconnected',
-                        'winner_id': None
+                        'winner_id': None,
                     }
                 )
 
@@ -377,110 +443,129 @@ class GameConsumer(AsyncWebsocketConsumer):
                 self.game_group_name,
                 self.channel_name
             )
+            await self.channel_layer.group_discard(
+                self.snapshot_group_name,
+                self.channel_name
+            )
     
-    async def receive(self, text_data):
+    async def send_encoded(self, event):
+        # A conflated state frame replaced ones this socket never got, so a delta
+        # would miss its base; the keyframe is only built for these rare cases.
+        if event.get('conflated') and not self.binary and self.game:
+            stream = self.game.streams.get(self.snapshot_rate)
+            keyframe = stream.keyframe() if stream else None
+            if keyframe:
+                await self.send(text_data=json.dumps(keyframe))
+                return
+        await super().send_encoded(event)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        # Over the rate limit: don't parse, keep the newest message for the next tick
+        # (GameSession.apply_inputs), so the last paddle position is never lost.
+        # A resync is rare and the client waits on it, so it is never limited.
+        if not self.input_bucket.allow() and not (text_data is not None and 'resync' in text_data):
+            if self.game:
+                self.game.defer_input(self.role, bytes_data if bytes_data is not None else text_data)
+            return
+        if bytes_data is not None:
+            y = unpack_input(bytes_data)
+            if y is not None and self.game:
+                self.game.handle_paddle_move(self.role, y)
+            return
         try:
             data = json.loads(text_data)
             
             if data.get('type') == 'paddleMove' and self.game:
                 self.game.handle_paddle_move(self.role, data.get('y', 0))
+            elif data.get('type') == 'resync' and self.game:
+                # Client missed a delta; send it the full frame the next delta builds on.
+                stream = self.game.streams.get(self.snapshot_rate)
+                keyframe = stream.keyframe() if stream else None
+                if keyframe:
+                    await self.send(text_data=json.dumps(keyframe))
         except json.JSONDecodeError:
             pass
     
-    async def game_loop(self):
-        """Main game loop running at 60 FPS"""
-        while self.game and self.game.status == 'active':
-            result = self.game.tick()
-            # logger.debug(f"Game tick result: {result}")
-            if result:
-                await self.channel_layer.group_send(
-                    self.game_group_name,
-                    {
-                        'type': 'game_state',
-                        'state': result
-                    }
-                )
-                players = self.game.get_players()
-                winner_id = None
-                winner_name = None
-
-                if result.get('winner') == 'left':
-                    winner_user = players['left']
-                    winner_id = getattr(winner_user, 'id', None)
-                    winner_name = getattr(winner_user, 'username', 'Player 1')
-                elif result.get('winner') == 'right':
-                    winner_user = players['right']
-                    winner_id = getattr(winner_user, 'id', None)
-                    winner_name = getattr(winner_user, 'username', 'Player 2')
-                
-                if result.get('winner'):
-                    # Update tournament game with winner and completion status
-                    logger.info("FINISH")
-                    self.game.status = "completed"
-                    await sync_to_async(update_game_completed)(self.game_id, winner_id, winner_name)
-
-                    loser_user = players['right'] if result.get('winner') == 'left' else players['left']
-                    loser_name = getattr(loser_user, 'username', None)
-
-                    # Run DB work in sync thread; pass users and resolve profiles in service.
-                    result_data = await database_sync_to_async(match_ends)(
-                        self.game,
-                        self.game.players['left'],
-                        self.game.players['right'],
-                    )
-                    new_achievements = result_data.get('new_achievements', {})
+    def choose_snapshot_rate(self):
+        """Snapshot rate requested with ?rate=<hz>, if it is one we offer"""
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            requested = int(query.get('rate', [''])[0])
+        except ValueError:
+            requested = None
+        return requested if requested in SNAPSHOT_STRIDES else SNAPSHOT_RATES[0]
+
+    async def on_tick(self, result):
+        """Called by the shared tick scheduler with every simulation step of this game.
+
+        Physics runs at the scheduler's tick rate; each snapshot group only gets
+        every n-th step. Goals and the final frame go out on every group at once.
+        """
+        score = (result.score_p1, result.score_p2)
+        urgent = result.winner is not None or score != self.sent_score
+        self.sent_score = score
+
+        frame = None
+        for rate, stride in SNAPSHOT_STRIDES.items():
+            if not urgent and result.tick % stride:
+                continue
+            if frame is None:
+                frame = pack_state(result)
+                server_time = int(time.time() * 1000)
+            stream = self.game.streams.get(rate)
+            if stream is None:
+                stream = self.game.streams[rate] = DeltaEncoder()
+            # JSON text and binary frame are both encoded here once; members forward one of them.
+            # A socket that has not drained the previous frame yet only gets the newest one,
+            # as a full frame (see send_encoded).
+            group = f'{self.game_group_name}_{rate}'
+            await self.channel_layer.group_send(
+                group,
+                encoded_event(stream.encode(result, server_time), frame, latest=group)
+            )
 
-                    await self.channel_layer.group_send(
-                        self.game_group_name,
-                        {
-                            'type': 'game_over',
-                            'winner': winner_name,
-                            'winner_id': winner_id,
-                            'new_achievements': new_achievements,
-                        }
-                    )
-                    result_msg = {
-                        'type': 'game_result',
-                        'winner': winner_name,
-                        'loser': loser_name,
-                        'game_type': 'pong',
-                        'is_tournament': self.game.isTournamentGame,
-                    }
-                    await self.channel_layer.group_send('global_chat', result_msg)
-                    for pid in [str(winner_id), str(getattr(loser_user, 'id', None))]:
-                        if pid:
-                            PENDING_GAME_RESULTS[pid] = result_msg
-                    break
-            
-            await asyncio.sleep(1/60)  # 60 FPS
-    
-    async def game_start(self, event):
-        """Handle game start broadcast"""
-        await self.send(text_data=json.dumps({
-            'type': 'gameStart',
-            'P1': event.get('P1'),
-            'P2': event.get('P2'),
-            'p1_id': event.get('p1_id'),
-            'p2_id': event.get('p2_id')
-        }))
-    
-    async def game_state(self, event):
-        """Handle game state broadcast"""
-        await self.send(text_data=json.dumps({
-            'type': 'state',
-            **event['state']
-        }))
+        if result.winner:
+            # Stop stepping right away; the DB work runs off the scheduler.
+            logger.info("FINISH")
+            self.game.status = "completed"
+            scheduler.unregister(self.game_id)
+            asyncio.create_task(self.finish_game(result.winner))
+
+    async def finish_game(self, winner_role):
+        """Settle a game that ended on score and announce the result"""
+        players = self.game.get_players()
+        winner_user = players[winner_role]
+        winner_id = getattr(winner_user, 'id', None)
+        winner_name = getattr(winner_user, 'username', 'Player 1' if winner_role == 'left' else 'Player 2')
+
+        loser_user = players['right'] if winner_role == 'left' else players['left']
+        loser_name = getattr(loser_user, 'username', None)
+
+        # The tournament update and the settlement are journaled and written by the
+        # result pipeline; players hear about the result (and later their achievements) right away.
+        submit_pong_result(self.game, players['left'], players['right'], winner_id, winner_name)
+
+        await group_send_json(
+            self.channel_layer,
+            self.game_group_name,
+            {
+                'type': 'gameOver',
+                'winner': winner_name,
+                'winner_id': winner_id,
+            }
+        )
+        result_msg = {
+            'type': 'game_result',
+            'winner': winner_name,
+            'loser': loser_name,
+            'draw_players': None,
+            'game_type': 'pong',
+        }
+        await group_send_json(self.channel_layer, 'global_chat', result_msg)
+        for pid in [str(winner_id), str(getattr(loser_user, 'id', None))]:
+            if pid:
+                PENDING_GAME_RESULTS[pid] = result_msg
     
-    async def game_over(self, event):
-        """Handle game over broadcast"""
-        logger.info(f"Game over event received: {event}")
-        await self.send(text_data=json.dumps({
-            'type': 'gameOver',
-            'winner': event['winner'],
-            'winner_id': event['winner_id'],
-            'new_achievements': event.get('new_achievements', {}),
-        }))
-
     async def check_join_timeout(self):
         if not self.game or not self.game.isTournamentGame:
             return
@@ -488,10 +573,11 @@ class GameConsumer(AsyncWebsocketConsumer):
         while self.game and self.game.status == 'waiting' and not self.game.timeout_handled:
             # Send remaining time update every second
             remaining_time = self.game.get_remaining_time()
-            await self.channel_layer.group_send(
+            await group_send_json(
+                self.channel_layer,
                 self.game_group_name,
                 {
-                    'type': 'time_update',
+                    'type': 'timeUpdate',
                     'remaining_time': remaining_time
                 }
             )
@@ -508,23 +594,25 @@ class GameConsumer(AsyncWebsocketConsumer):
                 if is_tie:
                     # No players joined - it's a tie
                     await sync_to_async(update_game_completed_tie)(self.game_id)
-                    await self.channel_layer.group_send(
+                    await group_send_json(
+                        self.channel_layer,
                         self.game_group_name,
                         {
-                            'type': 'game_over',
+                            'type': 'gameOver',
                             'winner': 'Tie - No players joined',
-                            'winner_id': None
+                            'winner_id': None,
                         }
                     )
                 else:
                     # One player joined - they win by default
                     await sync_to_async(update_game_completed)(self.game_id, winner_id, winner_name)
-                    await self.channel_layer.group_send(
+                    await group_send_json(
+                        self.channel_layer,
                         self.game_group_name,
                         {
-                            'type': 'game_over',
+                            'type': 'gameOver',
                             'winner': winner_name,
-                            'winner_id': winner_id
+                            'winner_id': winner_id,
                         }
                     )
                 # Close all client connections
@@ -538,17 +626,15 @@ class GameConsumer(AsyncWebsocketConsumer):
             
             await asyncio.sleep(1)  # Check every second
     
-    async def time_update(self, event):
-        """Send remaining time to client"""
-        await self.send(text_data=json.dumps({
-            'type': 'timeUpdate',
-            'remaining_time': event['remaining_time']
-        }))
-    
     async def close_connection(self, event):
         """Close the websocket connection"""
         await self.close(code=1008)
 
+    @database_sync_to_async
+    def get_rating(self, user_id):
+        rating = Player.objects.filter(user_id=user_id).values_list('elo_rating', flat=True).first()
+        return 1000 if rating is None else rating
+
     @database_sync_to_async
     def get_pending_invites_for_recipient(self, user_id):
         from chat.models import GameInvite
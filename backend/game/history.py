@@ -0,0 +1,152 @@
+"""Match history of a player, Pong and chess, with keyset (cursor) pagination.
+
+A page is read as "the next `limit` matches older than the cursor" rather
+than with OFFSET, so page 100 costs what page 1 does. A player's matches sit
+under two foreign keys (player1/player2, white/black). Each side is read with
+its own query on its (player, -timestamp, -id) index, limited to one page, and
+the two sorted runs are merged here. That is 2 queries per game type whatever
+the depth, and usernames come with the rows (no per-row user lookups).
+
+Cursors are opaque strings naming the last entry of a page. Entries are ordered
+by (timestamp, game type, id), newest first, so one cursor also works for the
+combined Pong + chess timeline.
+"""
+import base64
+import heapq
+from datetime import datetime
+from django.db.models import Q
+from chessgame.models import ChessMatch
+from .models import Match
+
+GAME_TYPES = ('pong', 'chess')  # tie-break order between game types at the same timestamp
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(entry):
+    raw = f"{entry['_timestamp'].isoformat()}|{entry['game_type']}|{entry['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, game_type, match_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        if game_type not in GAME_TYPES:
+            raise ValueError(game_type)
+        return datetime.fromisoformat(timestamp), game_type, int(match_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}") from e
+
+
+def _older_than(game_type, cursor):
+    """Filter for the rows of `game_type` that come after `cursor` in newest-first order"""
+    if cursor is None:
+        return Q()
+    timestamp, cursor_type, match_id = cursor
+    order, cursor_order = GAME_TYPES.index(game_type), GAME_TYPES.index(cursor_type)
+    if order < cursor_order:
+        return Q(timestamp__lte=timestamp)
+    if order > cursor_order:
+        return Q(timestamp__lt=timestamp)
+    return Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=match_id)
+
+
+def _sort_key(entry):
+    return (entry['_timestamp'], GAME_TYPES.index(entry['game_type']), entry['id'])
+
+
+def _page(querysets, game_type, cursor, limit, to_entry):
+    runs = []
+    for queryset in querysets:
+        rows = queryset.filter(_older_than(game_type, cursor)).order_by('-timestamp', '-id')[:limit]
+        runs.append([to_entry(row) for row in rows])
+    return heapq.merge(*runs, key=_sort_key, reverse=True)
+
+
+def _pong_entry(row):
+    player1, player2 = row['player1__user__username'], row['player2__user__username']
+    if row['winner_id'] is None:
+        winner = None
+    else:
+        winner = player1 if row['winner_id'] == row['player1_id'] else player2
+    return {
+        'game_type': 'pong',
+        'id': row['id'],
+        '_timestamp': row['timestamp'],
+        'timestamp': row['timestamp'].isoformat(),
+        'player1': player1,
+        'player2': player2,
+        'player1_score': row['player1_score'],
+        'player2_score': row['player2_score'],
+        'winner': winner,
+    }
+
+
+def _pong_matches(player, cursor, limit):
+    rows = Match.objects.values(
+        'id', 'timestamp', 'player1_id', 'player1_score', 'player2_score', 'winner_id',
+        'player1__user__username', 'player2__user__username',
+    )
+    return _page(
+        (rows.filter(player1=player), rows.filter(player2=player).exclude(player1=player)),
+        'pong', cursor, limit, _pong_entry,
+    )
+
+
+def _chess_matches(player, cursor, limit):
+    rows = ChessMatch.objects.values('id', 'timestamp', 'result', 'white_id', 'white__user__username', 'black__user__username')
+
+    def to_entry(row):
+        white = row['white__user__username'] or '?'
+        black = row['black__user__username'] or '?'
+        if row['result'] == '1-0':
+            winner = white
+        elif row['result'] == '0-1':
+            winner = black
+        else:
+            winner = None
+        return {
+            'game_type': 'chess',
+            'id': row['id'],
+            '_timestamp': row['timestamp'],
+            'timestamp': row['timestamp'].isoformat(),
+            'white': white,
+            'black': black,
+            'opponent': black if row['white_id'] == player.pk else white,
+            'result': row['result'],
+            'winner': winner,
+        }
+
+    return _page(
+        (rows.filter(white=player), rows.filter(black=player).exclude(white=player)),
+        'chess', cursor, limit, to_entry,
+    )
+
+
+def get_history(pong_player=None, chess_player=None, limit=10, cursor=None):
+    """One page of a player's matches, newest first: (entries, cursor of the next page or None).
+
+    Pass the Player and/or the ChessPlayer whose matches to list; with both,
+    the two histories are merged into one timeline.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    position = decode_cursor(cursor) if cursor else None
+    runs = []
+    if pong_player is not None:
+        runs.append(_pong_matches(pong_player, position, limit + 1))
+    if chess_player is not None:
+        runs.append(_chess_matches(chess_player, position, limit + 1))
+
+    entries = []
+    for entry in heapq.merge(*runs, key=_sort_key, reverse=True):
+        entries.append(entry)
+        if len(entries) > limit:
+            break
+    next_cursor = encode_cursor(entries[limit - 1]) if len(entries) > limit else None
+    entries = entries[:limit]
+    for entry in entries:
+        del entry['_timestamp']
+    return entries, next_cursor
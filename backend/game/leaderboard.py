@@ -0,0 +1,290 @@
+import hashlib
+import json
+import logging
+import time
+import uuid
+from bisect import bisect_left, insort
+from datetime import timedelta
+from threading import Lock
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import CacheInvalidation
+from .signals import match_settled
+
+logger = logging.getLogger(__name__)
+
+PROCESS_ID = uuid.uuid4().hex  # tells this process's own invalidations apart from other workers'
+POLL_INTERVAL = 1.0                  # seconds between two reads of the invalidation log
+LOG_OVERLAP = timedelta(seconds=5)   # re-read window, log rows can commit out of timestamp order
+LOG_RETENTION = timedelta(minutes=5)
+
+
+class Leaderboard:
+    """Ranking of every player of one game type, kept in process memory.
+
+    Loaded with one query and then kept sorted as matches settle (match_settled),
+    so reads never touch the database. Rows are ordered by a sort key that ends in
+    the player pk; a rank is a bisect into the sorted keys.
+
+    Other worker processes, and management commands, log their changes
+    (publish_invalidation); every read first applies what they logged since
+    the last poll (sync_invalidations), so a copy is at most about
+    POLL_INTERVAL seconds behind the database.
+    """
+
+    def __init__(self, name, model_path, fields, key):
+        self.name = name
+        self.model_path = model_path  # 'app_label.ModelName', resolved on first load
+        self.fields = fields          # row fields served besides the username
+        self.key = key                # row -> sort key, without the trailing pk
+        self._lock = Lock()
+        self.keys = None              # sorted (*key(row), pk); None until loaded or after an invalidation
+        self.rows = {}                # pk -> row dict as served
+        self.by_user = {}             # user id -> pk
+        self.version = 0
+        self.loads = 0
+        self.updates = 0
+        self._pages = {}              # n -> (version, etag, rows) of the top n
+
+    def _sort_key(self, pk, row):
+        return (*self.key(row), pk)
+
+    def _load(self):
+        from django.apps import apps
+
+        model = apps.get_model(self.model_path)
+        rows = {}
+        by_user = {}
+        for values in model.objects.values('pk', 'user_id', 'user__username', *self.fields).iterator(chunk_size=5000):
+            rows[values['pk']] = {'username': values['user__username'], **{f: values[f] for f in self.fields}}
+            by_user[values['user_id']] = values['pk']
+        self.rows = rows
+        self.by_user = by_user
+        self.keys = sorted(self._sort_key(pk, row) for pk, row in rows.items())
+        self.loads += 1
+        self.version += 1
+
+    def _ensure_loaded(self):
+        # caller holds _lock
+        if self.keys is None:
+            self._load()
+
+    def invalidate(self):
+        with self._lock:
+            self.keys = None
+
+    def update(self, pk, user_id, username=None, **values):
+        """Move one player to the position their new `values` earn"""
+        with self._lock:
+            if self.keys is None:
+                return
+            row = self.rows.get(pk)
+            if row is None:
+                if username is None:
+                    self.keys = None  # unknown player and no name to show: reload on next read
+                    return
+                row = self.rows[pk] = {'username': username, **{f: 0 for f in self.fields}}
+                self.by_user[user_id] = pk
+            else:
+                del self.keys[bisect_left(self.keys, self._sort_key(pk, row))]
+                if username is not None:
+                    row['username'] = username
+            row.update(values)
+            insort(self.keys, self._sort_key(pk, row))
+            self.version += 1
+            self.updates += 1
+
+    def rename(self, user_id, username):
+        with self._lock:
+            pk = self.by_user.get(user_id)
+            if self.keys is None or pk is None:
+                return
+            self.rows[pk]['username'] = username
+            self.version += 1
+
+    def remove(self, pk, user_id):
+        with self._lock:
+            if self.keys is None or pk not in self.rows:
+                return
+            del self.keys[bisect_left(self.keys, self._sort_key(pk, self.rows.pop(pk)))]
+            self.by_user.pop(user_id, None)
+            self.version += 1
+
+    def top(self, n):
+        """(etag, rows) of the first n players; the etag only changes when those rows do"""
+        sync_invalidations()
+        with self._lock:
+            self._ensure_loaded()
+            page = self._pages.get(n)
+            if page is None or page[0] != self.version:
+                rows = [dict(self.rows[key[-1]]) for key in self.keys[:n]]
+                etag = hashlib.md5(json.dumps(rows).encode()).hexdigest()
+                page = self._pages[n] = (self.version, etag, rows)
+            return page[1], page[2]
+
+    def around(self, user_id, n):
+        """A player's rank, the number of ranked players and the rows from n above to n below them.
+
+        Players with the same rating (and, for Pong, wins) share a rank, like in
+        1, 2, 2, 4. A rank is a bisect into the sorted keys, O(log n) no matter
+        how many players there are. Returns (None, total, []) for unknown players.
+        """
+        sync_invalidations()
+        with self._lock:
+            self._ensure_loaded()
+            keys = self.keys
+            pk = self.by_user.get(user_id)
+            if pk is None:
+                return None, len(keys), []
+            i = bisect_left(keys, self._sort_key(pk, self.rows[pk]))
+            window = keys[max(0, i - n):i + n + 1]
+            rows = [{'rank': bisect_left(keys, key[:-1]) + 1, **self.rows[key[-1]]} for key in window]
+            return bisect_left(keys, keys[i][:-1]) + 1, len(keys), rows
+
+    def get_stats(self):
+        return {
+            'loaded': self.keys is not None,
+            'players': len(self.rows),
+            'version': self.version,
+            'loads': self.loads,
+            'updates': self.updates,
+        }
+
+
+pong_leaderboard = Leaderboard(
+    'pong', 'game.Player',
+    fields=('elo_rating', 'total_wins', 'current_win_streak'),
+    key=lambda row: (-row['elo_rating'], -row['total_wins']),  # Player.Meta.ordering
+)
+chess_leaderboard = Leaderboard(
+    'chess', 'chessgame.ChessPlayer',
+    fields=('elo_rating', 'total_wins', 'total_games'),
+    key=lambda row: (-row['elo_rating'],),
+)
+LEADERBOARDS = {board.name: board for board in (pong_leaderboard, chess_leaderboard)}
+
+
+@receiver(match_settled)
+def update_leaderboard(sender, game_type, players, **kwargs):
+    board = LEADERBOARDS[game_type]
+    for player in players:
+        board.update(player.pk, player.user_id, **{f: getattr(player, f) for f in board.fields})
+    publish_invalidation(game_type, users=[player.user_id for player in players])
+
+
+def publish_invalidation(name, users=None, achievements=False):
+    """Tell the other worker processes that their copy of a leaderboard is stale.
+
+    `users` are the players whose cached profiles (game/profiles.py) are stale
+    too; None means every profile may be. `achievements` says the achievement
+    catalogue changed (game/achievements.py); `name` is None if no board did.
+    The invalidation is a row of the CacheInvalidation log, which works whatever
+    the channel layer and reaches management commands' changes too.
+    """
+    global _pruned_at
+    try:
+        CacheInvalidation.objects.create(board=name, users=users, achievements=achievements, origin=PROCESS_ID)
+        if time.monotonic() - _pruned_at > LOG_RETENTION.total_seconds():
+            _pruned_at = time.monotonic()
+            CacheInvalidation.objects.filter(timestamp__lt=timezone.now() - LOG_RETENTION).delete()
+    except Exception:
+        logger.exception(f"[leaderboard] could not publish the invalidation of {name}")
+
+
+_poll_lock = Lock()
+_polled_at = 0.0            # monotonic time of the last poll
+_polled_since = None        # log rows older than this (minus LOG_OVERLAP) were applied
+_seen = set()               # ids of the rows read by the last poll
+_pruned_at = 0.0
+
+
+def sync_invalidations():
+    """Apply the invalidations other processes logged since the last poll, at most once per POLL_INTERVAL"""
+    global _polled_at, _polled_since, _seen
+    if time.monotonic() - _polled_at < POLL_INTERVAL or not _poll_lock.acquire(blocking=False):
+        return
+    try:
+        started = timezone.now()
+        if _polled_since is None:
+            _polled_since = started  # nothing is cached yet
+        rows = list(
+            CacheInvalidation.objects.filter(timestamp__gte=_polled_since - LOG_OVERLAP)
+            .exclude(origin=PROCESS_ID)
+            .values_list('id', 'board', 'users', 'achievements')
+        )
+        _polled_since = started
+        fresh = [row for row in rows if row[0] not in _seen]
+        _seen = {row[0] for row in rows}
+        for _, board, users, achievements in fresh:
+            _apply_invalidation(board, users, achievements)
+    except Exception:
+        logger.exception("[leaderboard] could not read the invalidation log")
+    finally:
+        _polled_at = time.monotonic()
+        _poll_lock.release()
+
+
+def _apply_invalidation(name, users, achievements):
+    from .achievements import achievement_index
+    from .profiles import profile_cache
+
+    board = LEADERBOARDS.get(name)
+    if board is not None:
+        board.invalidate()
+    profile_cache.invalidate(users)
+    if achievements:
+        achievement_index.invalidate()
+
+
+def _on_player_saved(board, instance, created):
+    if not created:
+        return  # stats only change through settlement, which sends match_settled
+    user_cached = type(instance).user.is_cached(instance)
+    board.update(
+        instance.pk,
+        instance.user_id,
+        username=instance.user.username if user_cached else None,
+        **{f: getattr(instance, f) for f in board.fields},
+    )
+
+
+@receiver(post_save, sender='game.Player')
+def add_pong_player(sender, instance, created, **kwargs):
+    _on_player_saved(pong_leaderboard, instance, created)
+
+
+@receiver(post_save, sender='chessgame.ChessPlayer')
+def add_chess_player(sender, instance, created, **kwargs):
+    _on_player_saved(chess_leaderboard, instance, created)
+
+
+@receiver(post_delete, sender='game.Player')
+def remove_pong_player(sender, instance, **kwargs):
+    pong_leaderboard.remove(instance.pk, instance.user_id)
+
+
+@receiver(post_delete, sender='chessgame.ChessPlayer')
+def remove_chess_player(sender, instance, **kwargs):
+    chess_leaderboard.remove(instance.pk, instance.user_id)
+
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def remember_username(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Set instance._renamed_from to the username a save is about to change, or None"""
+    instance._renamed_from = None
+    if raw or instance.pk is None or (update_fields is not None and 'username' not in update_fields):
+        return
+    old = sender.objects.filter(pk=instance.pk).values_list('username', flat=True).first()
+    if old is not None and old != instance.username:
+        instance._renamed_from = old
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def rename_players(sender, instance, created, **kwargs):
+    if created or getattr(instance, '_renamed_from', None) is None:
+        return
+    for board in LEADERBOARDS.values():
+        board.rename(instance.pk, instance.username)
+        publish_invalidation(board.name, users=[instance.pk])
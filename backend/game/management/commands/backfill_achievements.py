@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from game.achievements import achievement_index, players_qualifying
+from game.leaderboard import publish_invalidation
+from game.models import PlayerAchievement
+
+
+class Command(BaseCommand):
+    help = "Award achievements to every player whose stats already meet them (run after adding achievements)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('achievement_ids', nargs='*', type=int, help='achievements to backfill (default: all)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='rows per INSERT')
+        parser.add_argument('--dry-run', action='store_true', help='only count what would be awarded')
+
+    def handle(self, *args, **options):
+        achievements = [
+            achievement
+            for requirement_type in achievement_index.thresholds()
+            for achievement in achievement_index.reached(requirement_type, float('inf'))
+        ]
+        if options['achievement_ids']:
+            wanted = set(options['achievement_ids'])
+            achievements = [a for a in achievements if a.pk in wanted]
+            missing = wanted - {a.pk for a in achievements}
+            if missing:
+                raise CommandError(f"Unknown achievements: {sorted(missing)}")
+
+        total = 0
+        for achievement in achievements:
+            player_ids = list(players_qualifying(achievement).values_list('pk', flat=True))
+            total += len(player_ids)
+            if player_ids and not options['dry_run']:
+                with transaction.atomic():
+                    PlayerAchievement.objects.bulk_create(
+                        [PlayerAchievement(player_id=pk, achievement=achievement) for pk in player_ids],
+                        batch_size=options['batch_size'],
+                        ignore_conflicts=True,
+                    )
+            self.stdout.write(f"{achievement.name}: {len(player_ids)} players")
+
+        if total and not options['dry_run']:
+            # bulk_create sends no post_save: tell the workers to drop their cached profiles
+            publish_invalidation(None)
+        verb = 'would be awarded' if options['dry_run'] else 'awarded'
+        self.stdout.write(f"{total} achievements {verb}")
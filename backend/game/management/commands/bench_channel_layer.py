@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from django_server.broadcast import encoded_event
+from django_server.layers import FanoutChannelLayer
+
+
+class Command(BaseCommand):
+    help = "Compare group fan-out cost of the stock in-memory channel layer and FanoutChannelLayer"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=200, help='channels in the group')
+        parser.add_argument('--messages', type=int, default=200, help='group_send calls per run')
+        parser.add_argument('--users', type=int, default=50, help='entries in the online-users payload')
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options['members'], options['messages'], options['users']))
+
+    async def run(self, members, messages, users):
+        # A raw event like the old online-users broadcast, and the same payload pre-encoded
+        payload = {
+            'type': 'online_users',
+            'users': {str(i): {'name': f'user{i}', 'blocked_by_me': False, 'in_game': False} for i in range(users)},
+            'blocked_me_ids': [],
+        }
+        raw = dict(payload, type='online.users')
+        encoded = encoded_event(payload)
+
+        self.stdout.write(f"{members} members, {messages} group sends, {len(encoded['text'])} byte payload")
+        for label, layer in (
+            ('InMemoryChannelLayer', InMemoryChannelLayer(capacity=messages)),
+            ('FanoutChannelLayer', FanoutChannelLayer(capacity=messages)),
+        ):
+            for kind, event in (('raw', raw), ('encoded', encoded)):
+                elapsed = await self.fan_out(layer, members, messages, event)
+                per_delivery = elapsed / (members * messages) * 1e6
+                self.stdout.write(f"  {label:22} {kind:8} {elapsed * 1000:9.1f} ms  {per_delivery:6.2f} us/delivery")
+                await layer.flush()
+
+        # Latest-value-wins: a socket that never drains keeps one pending frame per stream
+        layer = FanoutChannelLayer()
+        channel = await layer.new_channel()
+        await layer.group_add('game_bench_30', channel)
+        for tick in range(600):
+            await layer.group_send('game_bench_30', encoded_event({'tick': tick}, latest='game_bench_30'))
+        self.stdout.write(f"  600 frames to a stalled socket with latest-value-wins: {layer.get_stats()}")
+
+    async def fan_out(self, layer, members, messages, event):
+        channels = [await layer.new_channel() for _ in range(members)]
+        for channel in channels:
+            await layer.group_add('bench', channel)
+        start = time.perf_counter()
+        for _ in range(messages):
+            await layer.group_send('bench', event)
+        for channel in channels:
+            for _ in range(messages):
+                await layer.receive(channel)
+        return time.perf_counter() - start
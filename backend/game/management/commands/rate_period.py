@@ -0,0 +1,114 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+
+from chessgame.models import ChessPlayer
+from game import glicko2
+from game.achievements import achievement_index
+from game.glicko2 import np
+from game.leaderboard import LEADERBOARDS, publish_invalidation
+from game.models import GlickoRating, Player, PlayerAchievement, RatingResult
+
+
+class Command(BaseCommand):
+    help = "Close a Glicko-2 rating period: rate every pending game at once (RATING_ENGINE = 'glicko2'; run on a schedule)"
+
+    MODELS = {'pong': Player, 'chess': ChessPlayer}
+
+    def add_arguments(self, parser):
+        parser.add_argument('--game', choices=['all', *sorted(self.MODELS)], default='all')
+        parser.add_argument('--tau', type=float, default=glicko2.TAU, help='volatility constraint')
+        parser.add_argument('--batch-size', type=int, default=2000, help='rows per UPDATE/INSERT')
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError("rate_period needs numpy")
+        games = sorted(self.MODELS) if options['game'] == 'all' else [options['game']]
+        for game_type in games:
+            self.rate(game_type, options['tau'], options['batch_size'])
+
+    def rate(self, game_type, tau, batch_size):
+        started = time.perf_counter()
+        model = self.MODELS[game_type]
+        with transaction.atomic():
+            # the locks make an overlapping run wait, then find these games rated;
+            # games settled while the period is being rated wait for the next one
+            pending = list(
+                RatingResult.objects.select_for_update()
+                .filter(game_type=game_type, period__isnull=True)
+                .values_list('id', 'user_id', 'opponent_id', 'score')
+            )
+            if not pending:
+                self.stdout.write(f"{game_type}: no games to rate")
+                return
+            ids, user, opponent, score = (np.array(column) for column in zip(*pending))
+            period = (RatingResult.objects.filter(game_type=game_type).aggregate(last=Max('period'))['last'] or 0) + 1
+            ratings = {r.user_id: r for r in GlickoRating.objects.filter(game_type=game_type)}
+            players = {p.user_id: p for p in model.objects.select_for_update().filter(user_id__in=set(user.tolist()) | set(opponent.tolist()))}
+            new = []
+            for user_id, player in players.items():
+                if user_id not in ratings:
+                    # first rated period: start from the Elo rating the player already has
+                    ratings[user_id] = GlickoRating(
+                        game_type=game_type,
+                        user_id=user_id,
+                        rating=player.elo_rating,
+                        deviation=glicko2.DEFAULT_DEVIATION,
+                        volatility=glicko2.DEFAULT_VOLATILITY,
+                    )
+                    new.append(ratings[user_id])
+
+            user_ids = np.array(list(ratings), dtype=np.int64)
+            rows = list(ratings.values())
+            index = np.full(int(user_ids.max()) + 1, -1, dtype=np.int64)
+            index[user_ids] = np.arange(len(user_ids))
+            rating, deviation, volatility = glicko2.rate_period(
+                np.array([r.rating for r in rows]),
+                np.array([r.deviation for r in rows]),
+                np.array([r.volatility for r in rows]),
+                # every game once from each side
+                np.concatenate((index[user], index[opponent])),
+                np.concatenate((index[opponent], index[user])),
+                np.concatenate((score, 1 - score)),
+                tau=tau,
+            )
+            rated = time.perf_counter()
+
+            played = set(user.tolist()) | set(opponent.tolist())
+            for i, row in enumerate(rows):
+                row.rating, row.deviation, row.volatility = float(rating[i]), float(deviation[i]), float(volatility[i])
+                row.periods += row.user_id in played
+            GlickoRating.objects.bulk_update([r for r in rows if r.pk], ['rating', 'deviation', 'volatility', 'periods'], batch_size=batch_size)
+            GlickoRating.objects.bulk_create(new, batch_size=batch_size)
+            for i in range(0, len(ids), batch_size):
+                RatingResult.objects.filter(id__in=ids[i:i + batch_size].tolist()).update(period=period)
+
+            before = {}
+            for user_id, player in players.items():
+                before[player.pk] = player.elo_rating
+                player.elo_rating = round(ratings[user_id].rating)
+            model.objects.bulk_update(players.values(), ['elo_rating'], batch_size=batch_size)
+            awarded = self.award_elo_achievements(players.values(), before, batch_size) if model is Player else 0
+
+        LEADERBOARDS[game_type].invalidate()
+        # users=None: the workers drop every cached profile, the ratings and the
+        # bulk-inserted elo achievements (no post_save) of this period are in them
+        publish_invalidation(game_type, users=None)
+        self.stdout.write(
+            f"{game_type}: period {period} rated {len(user)} games of {len(players)} players "
+            f"({len(rows)} rated players) in {rated - started:.2f}s, saved in {time.perf_counter() - rated:.2f}s"
+            + (f"; {awarded} elo achievements awarded" if awarded else "")
+        )
+
+    def award_elo_achievements(self, players, before, batch_size):
+        """Settlement can't award elo achievements under Glicko-2, since ratings only move here"""
+        rows = [
+            PlayerAchievement(player_id=player.pk, achievement=achievement)
+            for player in players
+            for achievement in achievement_index.crossed('elo_rating', before[player.pk], player.elo_rating)
+        ]
+        # ignore_conflicts: elo can drop and rise again past an achievement the player already has
+        PlayerAchievement.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+        return len(rows)
@@ -0,0 +1,81 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+
+from chessgame.models import ChessMatch
+from game.models import HeadToHead, Match
+
+
+def _pong_pairs():
+    """(user1, user2, user1 wins, user2 wins, draws, user1 points, user2 points, games, last played) per player1/player2 pair"""
+    rows = Match.objects.values('player1__user_id', 'player2__user_id').annotate(
+        played=Count('id'),
+        wins1=Count('id', filter=Q(winner_id=F('player1_id'))),
+        wins2=Count('id', filter=Q(winner_id=F('player2_id'))),
+        points1=Sum('player1_score'),
+        points2=Sum('player2_score'),
+        last=Max('timestamp'),
+    ).order_by()
+    for row in rows:
+        yield (row['player1__user_id'], row['player2__user_id'], row['wins1'], row['wins2'], 0,
+               row['points1'], row['points2'], row['played'], row['last'])
+
+
+def _chess_pairs():
+    rows = ChessMatch.objects.filter(white__isnull=False, black__isnull=False).values(
+        'white__user_id', 'black__user_id'
+    ).annotate(
+        played=Count('id'),
+        wins1=Count('id', filter=Q(result='1-0')),
+        wins2=Count('id', filter=Q(result='0-1')),
+        draws=Count('id', filter=Q(result='1/2-1/2')),
+        last=Max('timestamp'),
+    ).order_by()
+    for row in rows:
+        yield (row['white__user_id'], row['black__user_id'], row['wins1'], row['wins2'], row['draws'],
+               0, 0, row['played'], row['last'])
+
+
+class Command(BaseCommand):
+    help = "Rebuild the head-to-head table from the full Pong and chess match history"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--game', choices=['pong', 'chess', 'all'], default='all')
+        parser.add_argument('--batch-size', type=int, default=2000, help='rows per INSERT')
+
+    def handle(self, *args, **options):
+        sources = {'pong': _pong_pairs, 'chess': _chess_pairs}
+        game_types = list(sources) if options['game'] == 'all' else [options['game']]
+        for game_type in game_types:
+            started = time.perf_counter()
+            # Fold the grouped (side 1, side 2) rows into both directions of each pair
+            records = {}
+            for user1, user2, wins1, wins2, draws, points1, points2, played, last in sources[game_type]():
+                if user1 == user2:
+                    continue
+                for user, opponent, wins, losses, points_for, points_against in (
+                    (user1, user2, wins1, wins2, points1, points2),
+                    (user2, user1, wins2, wins1, points2, points1),
+                ):
+                    record = records.get((user, opponent))
+                    if record is None:
+                        record = records[(user, opponent)] = HeadToHead(
+                            game_type=game_type, user_id=user, opponent_id=opponent, games=0, wins=0, losses=0,
+                            draws=0, points_for=0, points_against=0, last_played=last,
+                        )
+                    record.games += played
+                    record.wins += wins
+                    record.losses += losses
+                    record.draws += draws
+                    record.points_for += points_for or 0
+                    record.points_against += points_against or 0
+                    record.last_played = max(record.last_played, last)
+
+            with transaction.atomic():
+                HeadToHead.objects.filter(game_type=game_type).delete()
+                HeadToHead.objects.bulk_create(records.values(), batch_size=options['batch_size'])
+            self.stdout.write(
+                f"{game_type}: {len(records)} head-to-head rows in {time.perf_counter() - started:.2f}s"
+            )
@@ -0,0 +1,111 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from chessgame import services as chess_services
+from chessgame.models import ChessMatch, ChessPlayer
+from game import services as pong_services
+from game.leaderboard import LEADERBOARDS, publish_invalidation
+from game.models import Match, Player
+from game.ratings import EloReplay, np
+
+CHESS_SCORES = {'1-0': 1.0, '0-1': 0.0, '1/2-1/2': 0.5}
+
+
+def _pong_history(chunk_size):
+    """(side1, side2, side1 score) arrays of the Pong history, oldest first, chunk by chunk"""
+    rows = Match.objects.filter(winner__isnull=False, loser__isnull=False).order_by('timestamp', 'id')
+    yield from _chunks(rows.values_list('winner_id', 'loser_id').iterator(chunk_size=chunk_size), chunk_size, lambda row: 1.0)
+
+
+def _chess_history(chunk_size):
+    rows = ChessMatch.objects.filter(white__isnull=False, black__isnull=False, result__in=CHESS_SCORES).order_by('timestamp', 'id')
+    yield from _chunks(
+        rows.values_list('white_id', 'black_id', 'result').iterator(chunk_size=chunk_size),
+        chunk_size,
+        lambda row: CHESS_SCORES[row[2]],
+    )
+
+
+def _chunks(rows, chunk_size, score):
+    side1, side2, score1 = [], [], []
+    for row in rows:
+        side1.append(row[0])
+        side2.append(row[1])
+        score1.append(score(row))
+        if len(side1) == chunk_size:
+            yield np.array(side1, dtype=np.int64), np.array(side2, dtype=np.int64), np.array(score1)
+            side1, side2, score1 = [], [], []
+    if side1:
+        yield np.array(side1, dtype=np.int64), np.array(side2, dtype=np.int64), np.array(score1)
+
+
+class Command(BaseCommand):
+    help = "Replay the whole match history to recompute every rating (e.g. after changing the K factor)"
+
+    GAMES = {
+        # game: (player model, history, initial rating, default K, rounding)
+        'pong': (Player, _pong_history, 1000, pong_services.ELO_K, 'trunc'),
+        'chess': (ChessPlayer, _chess_history, 1200, chess_services.ELO_K, 'round'),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('game', choices=sorted(self.GAMES))
+        parser.add_argument('--k', type=float, help='K factor to replay with (default: the one settlement uses)')
+        parser.add_argument('--chunk-size', type=int, default=50000, help='matches read and replayed at a time')
+        parser.add_argument('--batch-size', type=int, default=2000, help='players per UPDATE')
+        parser.add_argument('--dry-run', action='store_true', help='only report the drift, write nothing')
+        parser.add_argument('--top', type=int, default=10, help='largest drifts to list')
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError("recompute_ratings needs numpy")
+        model, history, initial, default_k, rounding = self.GAMES[options['game']]
+        k = options['k'] if options['k'] is not None else default_k
+
+        started = time.perf_counter()
+        # settlement never changes the local-match placeholder's rating (services.settle_match)
+        fixed = dict(model.objects.filter(user__username=pong_services.LOCAL_OPPONENT).values_list('pk', 'elo_rating'))
+        replay = EloReplay(initial, k, np.trunc if rounding == 'trunc' else np.round, fixed)
+        for side1, side2, score1 in history(options['chunk_size']):
+            replay.apply(side1, side2, score1)
+        replayed_at = time.perf_counter()
+        self.stdout.write(
+            f"{options['game']}: replayed {replay.matches} matches in {replay.waves} waves "
+            f"with K={k:g} in {replayed_at - started:.2f}s"
+        )
+
+        # Drift against the stored ratings; players without matches go back to the initial rating
+        pks, current = [], []
+        for pk, elo in model.objects.values_list('pk', 'elo_rating').iterator(chunk_size=options['chunk_size']):
+            pks.append(pk)
+            current.append(elo)
+        if not pks:
+            self.stdout.write("no players")
+            return
+        pks = np.array(pks, dtype=np.int64)
+        current = np.array(current, dtype=np.int64)
+        replay._fit(int(pks.max()))
+        recomputed = replay.ratings[pks]
+        drift = recomputed - current
+        changed = np.flatnonzero(drift)
+        abs_drift = np.abs(drift)
+        self.stdout.write(
+            f"{len(changed)} of {len(pks)} ratings change; |drift| mean {abs_drift.mean():.2f}, "
+            f"p50 {np.percentile(abs_drift, 50):.0f}, p99 {np.percentile(abs_drift, 99):.0f}, max {abs_drift.max()}"
+        )
+        if len(changed) and options['top']:
+            worst = changed[np.argsort(-abs_drift[changed], kind='stable')[:options['top']]]
+            names = dict(model.objects.filter(pk__in=pks[worst].tolist()).values_list('pk', 'user__username'))
+            for i in worst:
+                self.stdout.write(f"  {names.get(int(pks[i]), pks[i])}: {current[i]} -> {recomputed[i]} ({drift[i]:+d})")
+
+        if options['dry_run'] or not len(changed):
+            return
+        updates = [model(pk=int(pks[i]), elo_rating=int(recomputed[i])) for i in changed]
+        with transaction.atomic():
+            model.objects.bulk_update(updates, ['elo_rating'], batch_size=options['batch_size'])
+        LEADERBOARDS[options['game']].invalidate()
+        publish_invalidation(options['game'])
+        self.stdout.write(f"updated {len(updates)} ratings in {time.perf_counter() - replayed_at:.2f}s")
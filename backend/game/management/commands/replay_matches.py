@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game.models import MatchReplay
+from game.replay import simulate
+
+
+class Command(BaseCommand):
+    help = "Re-simulate recorded Pong matches offline and check them against the stored results"
+
+    def add_arguments(self, parser):
+        parser.add_argument('match_ids', nargs='*', type=int, help='matches to replay (default: the most recent ones)')
+        parser.add_argument('--limit', type=int, default=100, help='how many recent matches to replay without ids')
+
+    def handle(self, *args, **options):
+        replays = MatchReplay.objects.select_related('match')
+        if options['match_ids']:
+            replays = replays.filter(match_id__in=options['match_ids'])
+        else:
+            replays = replays.order_by('-match_id')[:options['limit']]
+        replays = list(replays)
+        if not replays:
+            raise CommandError("No recorded matches found")
+
+        mismatches = 0
+        ticks = 0
+        game_seconds = 0.0
+        started = time.perf_counter()
+        for replay in replays:
+            game = simulate(replay.seed, replay.tick_rate, replay.inputs, max_ticks=replay.ticks)
+            match = replay.match
+            score = (game.state.score_p1, game.state.score_p2)
+            ticks += game.state.tick
+            game_seconds += game.state.tick / replay.tick_rate
+            if game.state.tick != replay.ticks:
+                status = 'MISMATCH'
+            elif score == (match.player1_score, match.player2_score):
+                status = 'ok'
+            elif game.status == 'active':
+                status = 'abandoned'  # a disconnect ended it; the stored score was forced
+            else:
+                status = 'MISMATCH'
+            mismatches += status == 'MISMATCH'
+            if options['verbosity'] > 1 or status == 'MISMATCH':
+                self.stdout.write(
+                    f"match {match.id}: {status} simulated {score[0]}-{score[1]} in {game.state.tick} ticks, "
+                    f"recorded {match.player1_score}-{match.player2_score} in {replay.ticks}"
+                )
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{len(replays)} matches, {ticks} ticks in {elapsed:.3f}s "
+            f"({ticks / elapsed:,.0f} ticks/s, {game_seconds / elapsed:,.0f}x real time), {mismatches} mismatches"
+        )
+        if mismatches:
+            raise CommandError(f"{mismatches} replays diverged from their recorded result")
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from threading import RLock
+
+logger = logging.getLogger(__name__)
+
+
+class MatchmakingQueue:
+    """Index of the sessions of one game type that are waiting for players.
+
+    join_pong / join_chess used to walk the whole session registry under its
+    lock to find a session with one free seat. Open sessions are indexed here
+    instead (which user waits in which one), so a join is a dict lookup;
+    pairing the waiting players is RatingMatchmaker's job.
+
+    Entries are not updated when a session starts, finishes or is abandoned:
+    open_game_of() checks the candidate with the caller's `is_open` test and
+    drops it if it fails, and delete_game() removes the session outright.
+    Invite-only sessions are never added. Not thread-safe on its own: callers
+    hold the session lock.
+    """
+
+    def __init__(self):
+        self.waiting = {}  # game_id -> user id of the player waiting in it
+        self.owners = {}   # user id -> game_id of the open session they wait in
+
+    def add_open(self, game_id, owner_id):
+        self.waiting[game_id] = owner_id
+        self.owners[owner_id] = game_id
+
+    def discard(self, game_id):
+        owner_id = self.waiting.pop(game_id, None)
+        if owner_id is not None and self.owners.get(owner_id) == game_id:
+            del self.owners[owner_id]
+
+    def open_game_of(self, owner_id, is_open):
+        """The open session `owner_id` is already waiting in, if it is still open"""
+        game_id = self.owners.get(owner_id)
+        if game_id is None:
+            return None
+        if not is_open(game_id):
+            self.discard(game_id)
+            return None
+        return game_id
+
+    def get_stats(self):
+        return {'open': len(self.waiting)}
+
+
+class Ticket:
+    """A player waiting in their own open session for an opponent"""
+
+    __slots__ = ('user_id', 'game_id', 'rating', 'since', 'bucket')
+
+    def __init__(self, user_id, game_id, rating, since):
+        self.user_id = user_id
+        self.game_id = game_id
+        self.rating = rating
+        self.since = since
+        self.bucket = int(rating // RatingMatchmaker.BUCKET_WIDTH)
+
+
+def _percentiles(values):
+    if not values:
+        return {'p50': 0, 'p90': 0, 'p99': 0}
+    values = sorted(values)
+    last = len(values) - 1
+    return {f'p{p}': round(values[last * p // 100], 1) for p in (50, 90, 99)}
+
+
+class RatingMatchmaker:
+    """Pairs the waiting players of one game type by rating.
+
+    Waiting players are kept in rating buckets. Every PASS_INTERVAL seconds one
+    pass walks the buckets in rating order and pairs neighbours whose rating gap
+    fits the window of the one that waited less; that window starts at
+    BASE_WINDOW and widens by WINDOW_GROWTH per second of waiting (up to
+    MAX_WINDOW), so nobody waits forever for a perfect opponent.
+
+    The rating order, and the earliest moment any two neighbours become
+    pairable, are cached until someone joins or leaves the queue, so a pass over
+    thousands of players that cannot be paired yet is a single comparison.
+
+    For every pair, `on_match(host, guest)` is awaited: the host is the one who
+    waited longer and the guest is moved into the host's session. The task runs
+    only while someone is waiting, like the Pong tick scheduler.
+
+    A player joining over HTTP is seated right away with claim() when someone
+    already waiting fits them, instead of waiting for a socket and a pass.
+    The queue is shared with those request threads, hence the lock.
+    """
+
+    BUCKET_WIDTH = 50
+    BASE_WINDOW = 50      # rating gap accepted right away
+    WINDOW_GROWTH = 25    # extra gap accepted per second of waiting
+    MAX_WINDOW = 1000
+    PASS_INTERVAL = 0.5   # seconds between match passes
+
+    def __init__(self, name, on_match):
+        self.name = name
+        self.on_match = on_match
+        self.tickets = {}  # user_id -> Ticket
+        self.buckets = {}  # rating // BUCKET_WIDTH -> {user_id: Ticket}
+        self._task = None
+        self._order = None           # tickets in rating order; None after a change
+        self._next_pairable = 0.0    # earliest time two neighbours in _order fit each other's window
+        self.passes = 0
+        self.matched = 0
+        self.last_pass_ms = 0.0
+        self.max_pass_ms = 0.0
+        self.recent_waits = deque(maxlen=1000)  # seconds waited by recently matched players
+        self._lock = RLock()
+
+    def enqueue(self, user_id, game_id, rating, since=None):
+        """Start (or restart) looking for an opponent for `user_id`, who waits in `game_id`"""
+        with self._lock:
+            self.remove(user_id)
+            ticket = Ticket(user_id, game_id, rating, time.monotonic() if since is None else since)
+            self.tickets[user_id] = ticket
+            self.buckets.setdefault(ticket.bucket, {})[user_id] = ticket
+            self._order = None
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def remove(self, user_id, game_id=None):
+        """Stop looking for `user_id`; with `game_id`, only if they still wait in that session"""
+        with self._lock:
+            ticket = self.tickets.get(user_id)
+            if ticket is None or (game_id is not None and ticket.game_id != game_id):
+                return
+            del self.tickets[user_id]
+            self._order = None
+            bucket = self.buckets[ticket.bucket]
+            del bucket[user_id]
+            if not bucket:
+                del self.buckets[ticket.bucket]
+
+    def claim(self, user_id, rating, now=None):
+        """The waiting ticket `user_id` can join right now, taken off the queue, or None.
+
+        The newcomer has not waited yet, so the gap has to fit BASE_WINDOW (the
+        window of the one that waited less, as in match_pass); among those, the
+        closest rating wins, then the longest wait.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            best = None
+            first = int((rating - self.BASE_WINDOW) // self.BUCKET_WIDTH)
+            last = int((rating + self.BASE_WINDOW) // self.BUCKET_WIDTH)
+            for key in range(first, last + 1):
+                for ticket in self.buckets.get(key, {}).values():
+                    gap = abs(ticket.rating - rating)
+                    if ticket.user_id == user_id or gap > self.BASE_WINDOW:
+                        continue
+                    if best is None or (gap, ticket.since) < (abs(best.rating - rating), best.since):
+                        best = ticket
+            if best is not None:
+                self.remove(best.user_id)
+                self.recent_waits.append(now - best.since)
+                self.recent_waits.append(0.0)
+                self.matched += 2
+            return best
+
+    def _rebuild(self):
+        order = []
+        for key in sorted(self.buckets):
+            bucket = self.buckets[key]
+            if len(bucket) == 1:
+                order.extend(bucket.values())
+            else:
+                order.extend(sorted(bucket.values(), key=lambda t: t.rating))
+        # A gap fits once the newer of the two has waited (gap - BASE_WINDOW) / WINDOW_GROWTH
+        next_pairable = float('inf')
+        for a, b in zip(order, order[1:]):
+            gap = b.rating - a.rating
+            if gap <= self.MAX_WINDOW:
+                at = max(a.since, b.since) + max(0.0, gap - self.BASE_WINDOW) / self.WINDOW_GROWTH
+                if at < next_pairable:
+                    next_pairable = at
+        self._order = order
+        self._next_pairable = next_pairable
+
+    def match_pass(self, now=None):
+        """Pair everyone who can be paired right now; returns [(host, guest), ...] and dequeues them"""
+        with self._lock:
+            return self._match_pass(now)
+
+    def _match_pass(self, now):
+        started = time.perf_counter()
+        now = time.monotonic() if now is None else now
+        if self._order is None:
+            self._rebuild()
+        self.passes += 1
+        if now < self._next_pairable:
+            self.last_pass_ms = (time.perf_counter() - started) * 1000
+            return []
+
+        order = self._order
+        pairs = []
+        base, growth, cap = self.BASE_WINDOW, self.WINDOW_GROWTH, self.MAX_WINDOW
+        i, last = 0, len(order) - 1
+        while i < last:
+            a, b = order[i], order[i + 1]
+            if a.since <= b.since:
+                host, guest = a, b
+            else:
+                host, guest = b, a
+            allowed = base + growth * (now - guest.since)
+            if b.rating - a.rating <= (allowed if allowed < cap else cap):
+                pairs.append((host, guest))
+                i += 2
+            else:
+                i += 1
+
+        for host, guest in pairs:
+            self.remove(host.user_id)
+            self.remove(guest.user_id)
+            self.recent_waits.append(now - host.since)
+            self.recent_waits.append(now - guest.since)
+        self.matched += 2 * len(pairs)
+        self.last_pass_ms = (time.perf_counter() - started) * 1000
+        self.max_pass_ms = max(self.max_pass_ms, self.last_pass_ms)
+        return pairs
+
+    def get_stats(self):
+        now = time.monotonic()
+        with self._lock:
+            waiting = [now - t.since for t in self.tickets.values()]
+        return {
+            'queued': len(self.tickets),
+            'passes': self.passes,
+            'matched': self.matched,
+            'last_pass_ms': round(self.last_pass_ms, 3),
+            'max_pass_ms': round(self.max_pass_ms, 3),
+            'waiting_s': _percentiles(waiting),
+            'matched_wait_s': _percentiles(list(self.recent_waits)),
+        }
+
+    async def _run(self):
+        try:
+            while self.tickets:
+                await asyncio.sleep(self.PASS_INTERVAL)
+                for host, guest in self.match_pass():
+                    try:
+                        await self.on_match(host, guest)
+                    except Exception:
+                        logger.exception(f"[{self.name} matchmaking] pairing {host.user_id} with {guest.user_id} failed")
+        finally:
+            self._task = None
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0003_playerachievement_match'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchReplay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seed', models.BigIntegerField()),
+                ('tick_rate', models.IntegerField()),
+                ('ticks', models.IntegerField()),
+                ('inputs', models.BinaryField()),
+                ('match', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='replay', to='game.match')),
+            ],
+            options={
+                'db_table': 'stats_match_replays',
+            },
+        ),
+    ]
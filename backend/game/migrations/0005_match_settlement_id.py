@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0004_matchreplay'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='match',
+            name='settlement_id',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0005_match_settlement_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['player1', '-timestamp', '-id'], name='match_player1_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['player2', '-timestamp', '-id'], name='match_player2_history_idx'),
+        ),
+    ]
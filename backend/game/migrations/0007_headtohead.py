@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0006_match_match_player1_history_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeadToHead',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('game_type', models.CharField(choices=[('pong', 'Pong'), ('chess', 'Chess')], max_length=10)),
+                ('games', models.IntegerField(default=0)),
+                ('wins', models.IntegerField(default=0)),
+                ('losses', models.IntegerField(default=0)),
+                ('draws', models.IntegerField(default=0)),
+                ('points_for', models.IntegerField(default=0)),
+                ('points_against', models.IntegerField(default=0)),
+                ('last_played', models.DateTimeField()),
+                ('opponent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='head_to_head', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'stats_head_to_head',
+                'constraints': [models.UniqueConstraint(fields=('game_type', 'user', 'opponent'), name='head_to_head_pair_unique')],
+            },
+        ),
+    ]
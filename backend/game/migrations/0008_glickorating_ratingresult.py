@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0007_headtohead'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GlickoRating',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('game_type', models.CharField(choices=[('pong', 'Pong'), ('chess', 'Chess')], max_length=10)),
+                ('rating', models.FloatField()),
+                ('deviation', models.FloatField()),
+                ('volatility', models.FloatField()),
+                ('periods', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='glicko_ratings', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'stats_glicko_ratings',
+                'constraints': [models.UniqueConstraint(fields=('game_type', 'user'), name='glicko_rating_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RatingResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('game_type', models.CharField(choices=[('pong', 'Pong'), ('chess', 'Chess')], max_length=10)),
+                ('score', models.FloatField()),
+                ('played_at', models.DateTimeField(auto_now_add=True)),
+                ('period', models.IntegerField(blank=True, null=True)),
+                ('opponent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'stats_rating_results',
+                'indexes': [models.Index(fields=['game_type', 'period'], name='rating_result_period_idx')],
+            },
+        ),
+    ]
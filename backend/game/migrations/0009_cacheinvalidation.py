@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0008_glickorating_ratingresult'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheInvalidation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.CharField(blank=True, max_length=10, null=True)),
+                ('users', models.JSONField(blank=True, null=True)),
+                ('achievements', models.BooleanField(default=False)),
+                ('origin', models.CharField(max_length=32)),
+                ('timestamp', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'db_table': 'stats_cache_invalidations',
+            },
+        ),
+    ]
@@ -1,11 +1,16 @@
 import uuid
 import time
+import random
 from datetime import datetime
 from threading import Lock
 from django.db import models
 from django.conf import settings
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from .state import PongState, TickResult
+from .replay import ReplayRecorder
+from .matchmaking import MatchmakingQueue
+from .protocol import parse_paddle_move
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,18 +20,23 @@ class GameSession:
     
     _games = {}
     _lock = Lock()
+    matchmaking = MatchmakingQueue()  # waiting sessions for join_pong, guarded by _lock
     
     SPEED_LIMIT = 10
     JOIN_TIMEOUT = 10  # Maximum time in seconds to wait for both players to join
-    
-    def __init__(self, game_id=None):
+
+    __slots__ = (
+        'id', 'state', 'isTournamentGame', 'players', 'players_ids', 'clients',
+        'status', 'last_tick', 'created_at', 'timeout_handled', 'invitee_id',
+        'batch', 'batch_slot', '_result', 'streams',
+        'pending_left', 'pending_right', 'deferred_left', 'deferred_right',
+        'inputs_coalesced', 'inputs_deferred', 'inputs_dropped',
+        'seed', 'rng_state', 'replay',
+    )
+    
+    def __init__(self, game_id=None, seed=None):
         self.id = game_id or str(uuid.uuid4())
-        self.state = {
-            'ball': {'x': 0, 'y': 0, 'vx': 3, 'vy': 1},
-            'paddles': {'left': 0, 'right': 0},
-            'score': {'p1': 0, 'p2': 0},
-            'winningScore': 5
-        }
+        self.state = PongState(winning_score=5)
         self.isTournamentGame = False
         self.players = {'left': None, 'right': None}
         self.players_ids = {'left': None, 'right': None}
@@ -35,6 +45,22 @@ class GameSession:
         self.last_tick = time.time()
         self.created_at = time.time()  # Track when game was created
         self.timeout_handled = False  # Flag to prevent timeout from being handled twice
+        self.invitee_id = None  # set for invite-only sessions
+        self.batch = None  # BatchPhysics engine owning this session's state while it is stepped there
+        self.batch_slot = None
+        self._result = TickResult()  # reused by every tick()
+        self.streams = {}  # snapshot rate (Hz) -> DeltaEncoder for that rate's group
+        self.pending_left = None  # latest paddle position received since the last tick, per side
+        self.pending_right = None
+        self.deferred_left = None  # newest raw message over the consumers' rate limit, parsed at the next tick
+        self.deferred_right = None
+        self.inputs_coalesced = 0  # paddle moves overwritten before a tick applied them
+        self.inputs_deferred = 0   # messages over the rate limit, left unparsed until the tick
+        self.inputs_dropped = 0    # of those, the ones a newer message replaced before the tick
+        # Serves come from a per-session generator, so seed + inputs reproduce the match (see replay.py)
+        self.seed = random.getrandbits(63) if seed is None else seed
+        self.rng_state = self.seed
+        self.replay = ReplayRecorder()
 
     def get_players(self):
         """Return current players"""
@@ -67,6 +93,7 @@ class GameSession:
         with cls._lock:
             if game_id in cls._games:
                 del cls._games[game_id]
+            cls.matchmaking.discard(game_id)
     
     def add_player(self, name, id, role=None):
         """Add a player or spectator to the game"""
@@ -111,6 +138,13 @@ class GameSession:
         if len(self.clients) == 0:
             self.cleanup()
     
+    def is_open(self):
+        """Open matchmaking session that still waits for its second player"""
+        if self.status != 'waiting' or self.isTournamentGame or self.invitee_id is not None:
+            return False
+        #exactly one slot is filled
+        return (self.players['left'] is None) != (self.players['right'] is None)
+
     def can_start(self):
         """Check if the game can start"""
         return (self.players['left'] and self.players['right'] and 
@@ -166,90 +200,151 @@ class GameSession:
             return True
         return False
     
-    def tick(self):
-        """Update game state"""
-        import random
-        
+    def tick(self, dt=None):
+        """Update game state.
+
+        `dt` is the fixed step handed in by the tick scheduler; when omitted the
+        elapsed wall-clock time since the previous tick is used. Returns this
+        session's TickResult, overwritten in place on every call.
+        """
+        if self.batch is not None:
+            # The batch engine was already stepped for every session; just read our slot.
+            return self.batch.view(self)
+
         if self.status != 'active':
             return None
+        self.apply_inputs()
         
         current_time = time.time()
-        dt = current_time - self.last_tick
+        if dt is None:
+            dt = current_time - self.last_tick
         self.last_tick = current_time
         
         state = self.state
+        state.tick += 1
         
         # Integrate ball
-        state['ball']['x'] += state['ball']['vx'] * dt
-        state['ball']['y'] += state['ball']['vy'] * dt
+        state.ball_x += state.ball_vx * dt
+        state.ball_y += state.ball_vy * dt
         
         # Top/bottom bounce
-        if state['ball']['y'] > 4 or state['ball']['y'] < -4:
-            state['ball']['vy'] *= -1
-        # logger.info(f"state['ball']['x']: {state['ball']['x']}")
+        if state.ball_y > 4 or state.ball_y < -4:
+            state.ball_vy *= -1
 
         hit_paddle = False
         # Left paddle collision
-        if state['ball']['x'] < -3.5:
-            if abs(state['ball']['y'] - state['paddles']['left']) < 1.2:
+        if state.ball_x < -3.5:
+            if abs(state.ball_y - state.paddle_left) < 1.2:
                 hit_paddle = True
-                state['ball']['vx'] = abs(state['ball']['vx'])
-                # logger.info(f"0 state['ball']['vx']: {state['ball']['vx']}")
-                if abs(state['ball']['vx']) < self.SPEED_LIMIT:
-                    state['ball']['vx'] *= 1.105
-                    state['ball']['vy'] *= 1.105
-
-                # logger.info(f"1 state['ball']['vx']: {state['ball']['vx']}")
+                state.ball_vx = abs(state.ball_vx)
+                if abs(state.ball_vx) < self.SPEED_LIMIT:
+                    state.ball_vx *= 1.105
+                    state.ball_vy *= 1.105
         
         # Right paddle collision
-        if state['ball']['x'] > 3.5:
-            if abs(state['ball']['y'] - state['paddles']['right']) < 1.2:
+        if state.ball_x > 3.5:
+            if abs(state.ball_y - state.paddle_right) < 1.2:
                 hit_paddle = True
-                state['ball']['vx'] = -abs(state['ball']['vx'])
-                # logger.info(f"0 state['ball']['vx']: {state['ball']['vx']}")
-                if abs(state['ball']['vx']) < self.SPEED_LIMIT:
-                    state['ball']['vx'] *= 1.105
-                    state['ball']['vy'] *= 1.105
-                # logger.info(f"1 state['ball']['vx']: {state['ball']['vx']}")
+                state.ball_vx = -abs(state.ball_vx)
+                if abs(state.ball_vx) < self.SPEED_LIMIT:
+                    state.ball_vx *= 1.105
+                    state.ball_vy *= 1.105
         
         # Scoring
         winner = None
-        if state['ball']['x'] < -6 and hit_paddle == False:
-            state['score']['p2'] += 1
+        if state.ball_x < -6 and hit_paddle == False:
+            state.score_p2 += 1
             self.reset_ball()
-        if state['ball']['x'] > 6 and hit_paddle == False:
-            state['score']['p1'] += 1
+        if state.ball_x > 6 and hit_paddle == False:
+            state.score_p1 += 1
             self.reset_ball()
         
         # Check win condition
-        if state['score']['p1'] >= state['winningScore']:
+        if state.score_p1 >= state.winning_score:
             winner = 'left'
             self.status = 'finished'
-        elif state['score']['p2'] >= state['winningScore']:
+        elif state.score_p2 >= state.winning_score:
             winner = 'right'
             self.status = 'finished'
         
-        return {
-            'ball': {'x': state['ball']['x'], 'y': state['ball']['y']},
-            'paddles': state['paddles'],
-            'score': state['score'],
-            'winner': winner,
-        }
-    
+        return self._result.fill(state, winner)
+    
+    def random(self):
+        """Next float in [0, 1) from the session's seeded generator (splitmix64)"""
+        self.rng_state = (self.rng_state + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        z = self.rng_state
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        return ((z ^ (z >> 31)) >> 11) / 9007199254740992  # top 53 bits / 2**53
+
+    def serve_velocity(self):
+        """Random serve direction for a ball put back in the center"""
+        direction = 1 if self.random() > 0.5 else -1
+        return 3 * direction, (self.random() - 0.5) * 2.5
+
     def reset_ball(self):
         """Reset ball to center with random direction"""
-        import random
-        self.state['ball']['x'] = 0
-        self.state['ball']['y'] = 0
-        direction = 1 if random.random() > 0.5 else -1
-        self.state['ball']['vx'] = 3 * direction
-        self.state['ball']['vy'] = (random.random() - 0.5) * 2.5
+        self.state.ball_x = 0
+        self.state.ball_y = 0
+        self.state.ball_vx, self.state.ball_vy = self.serve_velocity()
     
     def handle_paddle_move(self, role, y):
-        """Update paddle position"""
+        """Buffer a paddle position; only the latest one per tick is applied (see apply_inputs)"""
         y_pos = y * 4 if isinstance(y, (int, float)) else 0
-        if role in ['left', 'right']:
-            self.state['paddles'][role] = y_pos
+        if role == 'left':
+            if self.pending_left is not None:
+                self.inputs_coalesced += 1
+            if self.deferred_left is not None:
+                self.inputs_dropped += 1  # older than this move
+                self.deferred_left = None
+            self.pending_left = y_pos
+        elif role == 'right':
+            if self.pending_right is not None:
+                self.inputs_coalesced += 1
+            if self.deferred_right is not None:
+                self.inputs_dropped += 1
+                self.deferred_right = None
+            self.pending_right = y_pos
+
+    def defer_input(self, role, raw):
+        """Keep a raw message that came over the rate limit; only the newest one per tick is parsed"""
+        self.inputs_deferred += 1
+        if role == 'left':
+            if self.deferred_left is not None:
+                self.inputs_dropped += 1
+            self.deferred_left = raw
+        elif role == 'right':
+            if self.deferred_right is not None:
+                self.inputs_dropped += 1
+            self.deferred_right = raw
+
+    def apply_inputs(self):
+        """Move the paddles to the positions buffered since the previous tick"""
+        state = self.state
+        if self.deferred_left is not None:
+            y = parse_paddle_move(self.deferred_left)
+            self.deferred_left = None
+            if y is not None:
+                self.handle_paddle_move('left', y)
+        if self.deferred_right is not None:
+            y = parse_paddle_move(self.deferred_right)
+            self.deferred_right = None
+            if y is not None:
+                self.handle_paddle_move('right', y)
+        if self.pending_left is not None:
+            if self.pending_left != state.paddle_left:
+                self.replay.record(state.tick, 'left', self.pending_left)
+            state.paddle_left = self.pending_left
+            if self.batch is not None:
+                self.batch.set_paddle(self, 'left', self.pending_left)
+            self.pending_left = None
+        if self.pending_right is not None:
+            if self.pending_right != state.paddle_right:
+                self.replay.record(state.tick, 'right', self.pending_right)
+            state.paddle_right = self.pending_right
+            if self.batch is not None:
+                self.batch.set_paddle(self, 'right', self.pending_right)
+            self.pending_right = None
     
     def cleanup(self):
         """Clean up the game session"""
@@ -288,61 +383,37 @@ class Player(models.Model):
             return 0
         return self.total_win_points * 100 / (self.total_win_points + self.total_loss_points)
     
-    def player_wins(self, win_point, opponent_elo):
-        self.total_games += 1
-        self.total_wins += 1
-        
-        k = 10 #k factor can be changed
-        self.elo_rating += 10 * (1 - 1 / (1 + 10 ** ((opponent_elo - self.elo_rating) / 400)))
-        
-        self.total_win_points += win_point
-        
-        self.current_win_streak += 1
-        self.current_loss_streak = 0
-        
-        if self.current_win_streak > self.best_win_streak:
-            self.best_win_streak = self.current_win_streak
-        
-        self.save()
-    
-    def player_loses(self, loss_point, opponent_elo):
-        self.total_games += 1
-        self.total_losses += 1
-        
-        k = 10
-        self.elo_rating += k * (0 - 1 / (1 + 10 ** ((opponent_elo - self.elo_rating) / 400)))
-        
-        self.total_loss_points += loss_point
-        
-        self.current_loss_streak += 1
-        self.current_win_streak = 0
-        
-        self.save()
+    # requirement_type -> Player field it is checked against
+    ACHIEVEMENT_STATS = {
+        'total_games': 'total_games',
+        'total_wins': 'total_wins',
+        'win_streak': 'best_win_streak',
+        'best_win_streak': 'best_win_streak',
+        'elo_rating': 'elo_rating',
+    }
+
+    def achievement_stat(self, requirement_type):
+        """Value of the stat an achievement requirement is checked against (-1 for unknown types)"""
+        field = self.ACHIEVEMENT_STATS.get(requirement_type)
+        return getattr(self, field) if field is not None else -1
 
     def check_new_achievements(self):
         """Check if the player has unlocked any new achievements after a match.
         
         Returns a list of newly earned Achievement objects.
         """
-        stat_map = {
-            'total_games': self.total_games,
-            'total_wins': self.total_wins,
-            'win_streak': self.best_win_streak,
-            'best_win_streak': self.best_win_streak,
-            'elo_rating': self.elo_rating,
-        }
+        from .achievements import achievement_index
 
+        reached = achievement_index.reached_by(self)
+        if not reached:
+            return []
         already_earned = set(
-            self.achievements.values_list('achievement_id', flat=True)
+            self.achievements.filter(achievement__in=reached).values_list('achievement_id', flat=True)
+        )
+        newly_earned = [a for a in reached if a.pk not in already_earned]
+        PlayerAchievement.objects.bulk_create(
+            [PlayerAchievement(player=self, achievement=a) for a in newly_earned]
         )
-
-        newly_earned = []
-        for achievement in Achievement.objects.exclude(pk__in=already_earned):
-            stat_value = stat_map.get(achievement.requirement_type)
-            if stat_value is not None and stat_value >= achievement.requirement_value:
-                PlayerAchievement.objects.create(player=self, achievement=achievement)
-                newly_earned.append(achievement)
-
         return newly_earned
 
     # The method receives the class (cls) as its first argument, not an instance (self). 
@@ -375,12 +446,156 @@ class Match(models.Model):
     
     # auto_now_add=True automatically sets the field to the current date/time when the object is first created, and never updates it after that.
     timestamp = models.DateTimeField(auto_now_add=True)
+
+    # id of the result event this match was recorded from (game/results.py), so a replayed event is applied once
+    settlement_id = models.UUIDField(unique=True, null=True, blank=True, editable=False)
     
     def __str__(self):
         return f"Match: {self.player1.user.username} vs {self.player2.user.username} - Winner: {self.winner.user.username if self.winner else 'TBD'}"
     
     class Meta:
         db_table = 'stats_matches'
+        # a player's history is read newest first from each side (game/history.py)
+        indexes = [
+            models.Index(fields=['player1', '-timestamp', '-id'], name='match_player1_history_idx'),
+            models.Index(fields=['player2', '-timestamp', '-id'], name='match_player2_history_idx'),
+        ]
+
+class MatchReplay(models.Model):
+    """What it takes to re-simulate a match: serve seed, step rate and the input log (game/replay.py)"""
+    match = models.OneToOneField(Match, on_delete=models.CASCADE, related_name='replay')
+    seed = models.BigIntegerField()
+    tick_rate = models.IntegerField()
+    ticks = models.IntegerField()  # steps simulated before the match ended
+    inputs = models.BinaryField()
+
+    def __str__(self):
+        return f"Replay of match {self.match_id} ({self.ticks} ticks)"
+
+    class Meta:
+        db_table = 'stats_match_replays'
+
+class HeadToHead(models.Model):
+    """One player's record against one opponent in one game type, kept up to date by settlement.
+
+    There is a row per direction (A vs B and B vs A), so "my record vs X" is a
+    single lookup on the unique (game_type, user, opponent) index. Points are
+    rally points for Pong; chess games have none.
+    """
+    GAME_TYPES = [
+        ('pong', 'Pong'),
+        ('chess', 'Chess'),
+    ]
+    game_type = models.CharField(max_length=10, choices=GAME_TYPES)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='head_to_head')
+    opponent = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+
+    games = models.IntegerField(default=0)
+    wins = models.IntegerField(default=0)
+    losses = models.IntegerField(default=0)
+    draws = models.IntegerField(default=0)
+    points_for = models.IntegerField(default=0)
+    points_against = models.IntegerField(default=0)
+    last_played = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user_id} vs {self.opponent_id} ({self.game_type}): {self.wins}-{self.losses}-{self.draws}"
+
+    @classmethod
+    def record(cls, game_type, user1_id, user2_id, outcome, points1=0, points2=0, when=None):
+        """Add one game to both directions of a pair; outcome is 1 if user1 won, 0 if user2 won, None for a draw.
+
+        Meant to run inside settlement, which holds the row locks of both players,
+        so the update-then-create below cannot race another game of the same pair.
+        """
+        cls.record_games(game_type, user1_id, user2_id, int(outcome == 1), int(outcome == 0), int(outcome is None), points1, points2, when)
+
+    @classmethod
+    def record_games(cls, game_type, user1_id, user2_id, won1, won2, drawn=0, points1=0, points2=0, when=None):
+        """Add won1 + won2 + drawn games of a pair at once (see record)"""
+        from django.db.models import Case, F, Q, Value, When
+        from django.utils import timezone
+
+        when = when or timezone.now()
+
+        def per_side(value1, value2):
+            return Case(When(user_id=user1_id, then=Value(value1)), default=Value(value2), output_field=models.IntegerField())
+
+        games = won1 + won2 + drawn
+        pair = Q(user_id=user1_id, opponent_id=user2_id) | Q(user_id=user2_id, opponent_id=user1_id)
+        updated = cls.objects.filter(pair, game_type=game_type).update(
+            games=F('games') + games,
+            wins=F('wins') + per_side(won1, won2),
+            losses=F('losses') + per_side(won2, won1),
+            draws=F('draws') + drawn,
+            points_for=F('points_for') + per_side(points1, points2),
+            points_against=F('points_against') + per_side(points2, points1),
+            last_played=when,
+        )
+        if updated < 2:
+            #first game of this pair (or of one direction after a partial rebuild)
+            existing = set(cls.objects.filter(pair, game_type=game_type).values_list('user_id', flat=True))
+            cls.objects.bulk_create([
+                cls(game_type=game_type, user_id=user_id, opponent_id=opponent_id, games=games, wins=wins, losses=losses,
+                    draws=drawn, points_for=points_for, points_against=points_against, last_played=when)
+                for user_id, opponent_id, wins, losses, points_for, points_against in (
+                    (user1_id, user2_id, won1, won2, points1, points2),
+                    (user2_id, user1_id, won2, won1, points2, points1),
+                )
+                if user_id not in existing
+            ])
+
+    class Meta:
+        db_table = 'stats_head_to_head'
+        constraints = [
+            models.UniqueConstraint(fields=['game_type', 'user', 'opponent'], name='head_to_head_pair_unique'),
+        ]
+
+class GlickoRating(models.Model):
+    """Glicko-2 rating of one player in one game type (RATING_ENGINE = 'glicko2', see game/glicko2.py)"""
+    game_type = models.CharField(max_length=10, choices=HeadToHead.GAME_TYPES)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='glicko_ratings')
+    rating = models.FloatField()
+    deviation = models.FloatField()
+    volatility = models.FloatField()
+    periods = models.IntegerField(default=0)  # rating periods this player was rated in
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id} ({self.game_type}): {self.rating:.0f} ± {2 * self.deviation:.0f}"
+
+    class Meta:
+        db_table = 'stats_glicko_ratings'
+        constraints = [
+            models.UniqueConstraint(fields=['game_type', 'user'], name='glicko_rating_unique'),
+        ]
+
+class RatingResult(models.Model):
+    """A game waiting to be rated in the next Glicko-2 rating period; settlement only appends these"""
+    game_type = models.CharField(max_length=10, choices=HeadToHead.GAME_TYPES)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    opponent = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()  # user's result: 1 win, 0.5 draw, 0 loss
+    played_at = models.DateTimeField(auto_now_add=True)
+    period = models.IntegerField(null=True, blank=True)  # rating period it was rated in; NULL while pending
+
+    class Meta:
+        db_table = 'stats_rating_results'
+        indexes = [
+            models.Index(fields=['game_type', 'period'], name='rating_result_period_idx'),
+        ]
+
+class CacheInvalidation(models.Model):
+    """One entry of the log worker processes poll to drop stale in-memory caches (game/leaderboard.py)"""
+    board = models.CharField(max_length=10, null=True, blank=True)  # leaderboard to reload, if any
+    users = models.JSONField(null=True, blank=True)                 # user ids whose profiles are stale; NULL for all
+    achievements = models.BooleanField(default=False)               # the achievement catalog changed
+    origin = models.CharField(max_length=32)                        # process that wrote it
+    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = 'stats_cache_invalidations'
+
 class Achievement(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField()
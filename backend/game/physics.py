@@ -0,0 +1,190 @@
+import logging
+
+try:
+    import numpy as np
+except ImportError:  # the batched engine is optional; GameSession.tick() works without it
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Field bounds and tuning shared with the scalar path in GameSession.tick()
+WALL_Y = 4
+PADDLE_X = 3.5
+PADDLE_REACH = 1.2
+GOAL_X = 6
+SPEED_UP = 1.105
+
+
+class BatchPhysics:
+    """Struct-of-arrays Pong engine that advances every attached session in one step.
+
+    Each attached GameSession owns one slot in the arrays below. Slots are kept
+    densely packed (detaching moves the last slot into the hole), so a step is a
+    handful of NumPy operations over arrays[:size] with no per-session Python work
+    except for the rare serve after a goal.
+
+    While attached, the arrays are the source of truth: GameSession.tick() only
+    copies its slot out into the session's PongState and TickResult, and
+    handle_paddle_move() writes into it.
+    """
+
+    def __init__(self, capacity=64, speed_limit=10):
+        if np is None:
+            raise RuntimeError("BatchPhysics requires numpy")
+        self.speed_limit = speed_limit
+        self.size = 0
+        self.sessions = []
+        self._rows = None  # per-step list copies of the arrays, built lazily by sync()
+        self._alloc(capacity)
+
+    def _alloc(self, capacity):
+        old = getattr(self, 'x', None)
+        fields = {
+            'x': np.float64, 'y': np.float64, 'vx': np.float64, 'vy': np.float64,
+            'paddle_left': np.float64, 'paddle_right': np.float64,
+            'score_p1': np.int32, 'score_p2': np.int32, 'winning_score': np.int32,
+            'winner': np.int8,  # 0 none, 1 left, 2 right (result of the last step)
+            'tick': np.int64,
+        }
+        for name, dtype in fields.items():
+            arr = np.zeros(capacity, dtype=dtype)
+            if old is not None:
+                arr[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, arr)
+        self.capacity = capacity
+
+    def attach(self, session):
+        """Copy a session's state into a free slot and bind the session to it."""
+        if self.size == self.capacity:
+            self._alloc(self.capacity * 2)
+        i = self.size
+        state = session.state
+        self.x[i] = state.ball_x
+        self.y[i] = state.ball_y
+        self.vx[i] = state.ball_vx
+        self.vy[i] = state.ball_vy
+        self.paddle_left[i] = state.paddle_left
+        self.paddle_right[i] = state.paddle_right
+        self.score_p1[i] = state.score_p1
+        self.score_p2[i] = state.score_p2
+        self.winning_score[i] = state.winning_score
+        self.tick[i] = state.tick
+        self.winner[i] = 0
+        self.sessions.append(session)
+        self.size += 1
+        self._rows = None
+        session.batch = self
+        session.batch_slot = i
+
+    def detach(self, session):
+        """Write a session's slot back into its state and release the slot."""
+        if session.batch is not self:
+            return
+        i = session.batch_slot
+        self._rows = None  # pick up paddle moves made since the last step
+        self.sync(session)
+        last = self.size - 1
+        if i != last:
+            for name in ('x', 'y', 'vx', 'vy', 'paddle_left', 'paddle_right',
+                         'score_p1', 'score_p2', 'winning_score', 'winner', 'tick'):
+                arr = getattr(self, name)
+                arr[i] = arr[last]
+            moved = self.sessions[last]
+            self.sessions[i] = moved
+            moved.batch_slot = i
+        self.sessions.pop()
+        self.size -= 1
+        self._rows = None
+        session.batch = None
+        session.batch_slot = None
+
+    def set_paddle(self, session, role, y):
+        if role == 'left':
+            self.paddle_left[session.batch_slot] = y
+        elif role == 'right':
+            self.paddle_right[session.batch_slot] = y
+
+    def _snapshot(self):
+        # One tolist() per array is far cheaper than thousands of numpy scalar reads.
+        if self._rows is None:
+            n = self.size
+            self._rows = tuple(
+                getattr(self, name)[:n].tolist()
+                for name in ('x', 'y', 'vx', 'vy', 'paddle_left', 'paddle_right',
+                             'score_p1', 'score_p2', 'tick', 'winner')
+            )
+        return self._rows
+
+    def sync(self, session):
+        """Copy a session's slot into its PongState (ball, paddles and score)."""
+        i = session.batch_slot
+        x, y, vx, vy, paddle_left, paddle_right, score_p1, score_p2, tick, _ = self._snapshot()
+        state = session.state
+        state.ball_x = x[i]
+        state.ball_y = y[i]
+        state.ball_vx = vx[i]
+        state.ball_vy = vy[i]
+        state.paddle_left = paddle_left[i]
+        state.paddle_right = paddle_right[i]
+        state.score_p1 = score_p1[i]
+        state.score_p2 = score_p2[i]
+        state.tick = tick[i]
+
+    def step(self, dt):
+        """Advance every attached session by dt; mirrors GameSession.tick() rule for rule."""
+        n = self.size
+        self._rows = None
+        if n == 0:
+            return
+        x, y = self.x[:n], self.y[:n]
+        vx, vy = self.vx[:n], self.vy[:n]
+        self.tick[:n] += 1
+
+        # Integrate ball
+        x += vx * dt
+        y += vy * dt
+
+        # Top/bottom bounce
+        bounce = (y > WALL_Y) | (y < -WALL_Y)
+        np.negative(vy, out=vy, where=bounce)
+
+        # Left paddle collision
+        hit_left = (x < -PADDLE_X) & (np.abs(y - self.paddle_left[:n]) < PADDLE_REACH)
+        np.abs(vx, out=vx, where=hit_left)
+        fast = hit_left & (np.abs(vx) < self.speed_limit)
+        np.multiply(vx, SPEED_UP, out=vx, where=fast)
+        np.multiply(vy, SPEED_UP, out=vy, where=fast)
+
+        # Right paddle collision
+        hit_right = (x > PADDLE_X) & (np.abs(y - self.paddle_right[:n]) < PADDLE_REACH)
+        np.copyto(vx, -np.abs(vx), where=hit_right)
+        fast = hit_right & (np.abs(vx) < self.speed_limit)
+        np.multiply(vx, SPEED_UP, out=vx, where=fast)
+        np.multiply(vy, SPEED_UP, out=vy, where=fast)
+
+        # Scoring
+        missed = ~(hit_left | hit_right)
+        goal_p2 = (x < -GOAL_X) & missed
+        goal_p1 = (x > GOAL_X) & missed
+        self.score_p2[:n] += goal_p2
+        self.score_p1[:n] += goal_p1
+        for i in np.flatnonzero(goal_p1 | goal_p2):
+            self.x[i] = 0
+            self.y[i] = 0
+            self.vx[i], self.vy[i] = self.sessions[i].serve_velocity()
+
+        # Check win condition
+        winner = self.winner[:n]
+        winner[:] = 0
+        winner[self.score_p1[:n] >= self.winning_score[:n]] = 1
+        winner[(winner == 0) & (self.score_p2[:n] >= self.winning_score[:n])] = 2
+        for i in np.flatnonzero(winner):
+            self.sessions[i].status = 'finished'
+
+    def view(self, session):
+        """Tick result for one session after the last step, written into its TickResult."""
+        self.sync(session)
+        winner = self._rows[-1][session.batch_slot]
+        return session._result.fill(
+            session.state, 'left' if winner == 1 else 'right' if winner == 2 else None
+        )
@@ -0,0 +1,170 @@
+"""Player profiles (Pong and chess stats, recent achievements and matches) as one cached document.
+
+A profile is built with one query for the user and both stat rows, one for the
+recent achievements and the history queries of game/history.py, then kept in
+process memory. Opening a profile again is a dictionary lookup.
+
+A profile is dropped when its player's match settles or their achievements
+change, in this process directly and in the other worker processes and
+management commands through the leaderboard invalidation log (see
+leaderboard.publish_invalidation). MAX_AGE bounds what no one publishes.
+"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from threading import Lock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from chessgame.models import ChessPlayer
+from .history import get_history
+from .leaderboard import sync_invalidations
+from .models import Player, PlayerAchievement
+from .signals import match_settled
+
+RECENT_ACHIEVEMENTS = 5
+RECENT_MATCHES = 10
+STAT_FIELDS = ('total_wins', 'total_losses', 'elo_rating', 'total_games')
+
+
+def _stats(row, prefix, default_elo):
+    if row[f'{prefix}__id'] is None:
+        return {'wins': 0, 'losses': 0, 'elo': default_elo, 'total_games': 0}
+    return {
+        'wins': row[f'{prefix}__total_wins'],
+        'losses': row[f'{prefix}__total_losses'],
+        'elo': row[f'{prefix}__elo_rating'],
+        'total_games': row[f'{prefix}__total_games'],
+    }
+
+
+def build_profile(username):
+    """(user id, profile) of `username`, or (None, None) if there is no such user"""
+    row = get_user_model().objects.filter(username=username).values(
+        'id', 'username', 'player__id', 'chess_player__id',
+        *(f'player__{f}' for f in STAT_FIELDS),
+        *(f'chess_player__{f}' for f in STAT_FIELDS),
+    ).first()
+    if row is None:
+        return None, None
+
+    achievements = []
+    if row['player__id'] is not None:
+        recent = PlayerAchievement.objects.filter(player_id=row['player__id']).order_by('-timestamp').values(
+            'timestamp', 'achievement__name', 'achievement__description',
+            'achievement__requirement_type', 'achievement__requirement_value',
+        )[:RECENT_ACHIEVEMENTS]
+        achievements = [
+            {
+                'name': pa['achievement__name'],
+                'description': pa['achievement__description'],
+                'requirement_type': pa['achievement__requirement_type'],
+                'requirement_value': pa['achievement__requirement_value'],
+                'timestamp': pa['timestamp'].isoformat(),
+            }
+            for pa in recent
+        ]
+
+    matches = []
+    if row['player__id'] is not None or row['chess_player__id'] is not None:
+        matches, _ = get_history(
+            Player(pk=row['player__id']) if row['player__id'] is not None else None,
+            ChessPlayer(pk=row['chess_player__id']) if row['chess_player__id'] is not None else None,
+            limit=RECENT_MATCHES,
+        )
+
+    return row['id'], {
+        'username': row['username'],
+        'pong': _stats(row, 'player', 1000),
+        'chess': _stats(row, 'chess_player', 1200),
+        'achievements': achievements,
+        'recent_matches': matches,
+    }
+
+
+class ProfileCache:
+    """The most recently opened profiles, by username (least recently used ones are evicted)"""
+
+    CAPACITY = 5000
+    MAX_AGE = 60
+
+    def __init__(self):
+        self._lock = Lock()
+        self._entries = OrderedDict()  # username -> (stored_at, user id, etag, profile)
+        self._usernames = {}           # user id -> username
+        self.version = 0               # bumped by every invalidation, so builds racing one aren't stored
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username):
+        """(etag, profile) of `username`, or (None, None) if there is no such user"""
+        sync_invalidations()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and time.monotonic() - entry[0] <= self.MAX_AGE:
+                self._entries.move_to_end(username)
+                self.hits += 1
+                return entry[2], entry[3]
+            self.misses += 1
+            version = self.version
+
+        user_id, profile = build_profile(username)
+        if profile is None:
+            return None, None
+        etag = hashlib.md5(json.dumps(profile).encode()).hexdigest()
+        with self._lock:
+            if version == self.version:
+                self._entries[username] = (time.monotonic(), user_id, etag, profile)
+                self._entries.move_to_end(username)
+                self._usernames[user_id] = username
+                while len(self._entries) > self.CAPACITY:
+                    _, (_, evicted, _, _) = self._entries.popitem(last=False)
+                    self._usernames.pop(evicted, None)
+        return etag, profile
+
+    def invalidate(self, user_ids=None):
+        """Drop the profiles of `user_ids`, or every profile"""
+        with self._lock:
+            self.version += 1
+            if user_ids is None:
+                self._entries.clear()
+                self._usernames.clear()
+                return
+            for user_id in user_ids:
+                username = self._usernames.pop(user_id, None)
+                if username is not None:
+                    self._entries.pop(username, None)
+
+    def get_stats(self):
+        return {
+            'cached': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+profile_cache = ProfileCache()
+
+
+@receiver(match_settled)
+def drop_settled_profiles(sender, game_type, players, **kwargs):
+    profile_cache.invalidate([player.user_id for player in players])
+
+
+@receiver(post_save, sender=PlayerAchievement)
+@receiver(post_delete, sender=PlayerAchievement)
+def drop_achiever_profile(sender, instance, **kwargs):
+    if PlayerAchievement.player.is_cached(instance):
+        user_id = instance.player.user_id
+    else:
+        user_id = Player.objects.filter(pk=instance.player_id).values_list('user_id', flat=True).first()
+    profile_cache.invalidate([user_id])
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def drop_renamed_profile(sender, instance, created, **kwargs):
+    # _renamed_from is set by leaderboard.remember_username
+    if not created and getattr(instance, '_renamed_from', None) is not None:
+        profile_cache.invalidate([instance.pk])
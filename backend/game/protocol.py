@@ -0,0 +1,159 @@
+"""Binary wire format for the Pong hot path.
+
+A client opts in by offering BINARY_SUBPROTOCOL in Sec-WebSocket-Protocol. On
+such a connection every state frame is sent as one fixed-layout binary message
+and paddle moves may be sent as binary too; all other messages (assign,
+gameStart, gameOver, timeUpdate) stay JSON text frames. Clients that do not
+offer the subprotocol keep getting the JSON protocol.
+
+All fields are little-endian. Positions are fixed-point: value * POSITION_SCALE
+rounded to int16, which covers the whole field (|x| < 8) at 1/1000 precision.
+
+State frame (16 bytes):
+    u8  type        MSG_STATE
+    u32 tick        simulation step number
+    i16 ball_x, ball_y, paddle_left, paddle_right
+    u8  score_p1, score_p2
+    u8  winner      0 none, 1 left, 2 right
+
+Paddle move (5 bytes):
+    u8  type        MSG_PADDLE_MOVE
+    f32 y           same normalised [-1, 1] value the JSON paddleMove carries
+"""
+import json
+import struct
+
+BINARY_SUBPROTOCOL = 'pong.bin.v1'
+
+MSG_STATE = 1
+MSG_PADDLE_MOVE = 2
+
+POSITION_SCALE = 1000
+
+STATE_FRAME = struct.Struct('<BIhhhhBBB')
+INPUT_FRAME = struct.Struct('<Bf')
+
+_WINNER_CODES = {None: 0, 'left': 1, 'right': 2}
+
+
+def _fixed(value):
+    return max(-32768, min(32767, round(value * POSITION_SCALE)))
+
+
+def pack_state(result):
+    """Pack a TickResult into a binary state frame"""
+    return STATE_FRAME.pack(
+        MSG_STATE,
+        result.tick & 0xFFFFFFFF,
+        _fixed(result.ball_x),
+        _fixed(result.ball_y),
+        _fixed(result.paddle_left),
+        _fixed(result.paddle_right),
+        min(result.score_p1, 255),
+        min(result.score_p2, 255),
+        _WINNER_CODES.get(result.winner, 0),
+    )
+
+
+def unpack_input(data):
+    """Decode a binary client message; returns the paddle y or None if it is not a valid move"""
+    if len(data) != INPUT_FRAME.size:
+        return None
+    msg_type, y = INPUT_FRAME.unpack(data)
+    if msg_type != MSG_PADDLE_MOVE or y != y:  # y != y filters NaN
+        return None
+    return y
+
+
+def parse_paddle_move(data):
+    """Paddle y of a raw client message (binary frame or JSON text), or None if it is not a paddle move"""
+    if isinstance(data, bytes):
+        return unpack_input(data)
+    try:
+        message = json.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(message, dict) or message.get('type') != 'paddleMove':
+        return None
+    return message.get('y', 0)
+
+
+def select_subprotocol(header_value):
+    """Pick the subprotocol to echo back from a raw Sec-WebSocket-Protocol header.
+
+    Returns (subprotocol, is_binary). Without the binary protocol on offer the
+    first entry is echoed as before (the frontend may put its JWT there).
+    """
+    if not header_value:
+        return None, False
+    offered = [p.strip() for p in header_value.decode().split(',') if p.strip()]
+    if BINARY_SUBPROTOCOL in offered:
+        return BINARY_SUBPROTOCOL, True
+    return (offered[0] if offered else None), False
+
+
+class DeltaEncoder:
+    """Per-game JSON state stream that only sends what changed since the previous frame.
+
+    Every frame gets a sequence number. Full frames ('state', the original JSON
+    shape plus 'seq') go out every KEYFRAME_INTERVAL frames; the ones in between
+    are 'delta' messages that carry tick and ball, and paddles / score / winner
+    only when they changed. A delta applies to the frame numbered seq - 1; a
+    client that sees a gap asks for 'resync' and gets keyframe() for the last
+    frame sent, after which the following deltas apply again. A socket that
+    skipped frames (channel layer conflation) gets a full frame instead of the
+    next delta, so it does not have to resync. Positions are rounded to the
+    same 1/1000 precision the binary frame uses, and every frame carries the
+    server time 't' (ms) so the client can interpolate between them.
+    """
+
+    KEYFRAME_INTERVAL = 60
+
+    __slots__ = ('seq', '_last')
+
+    def __init__(self):
+        self.seq = 0
+        self._last = None  # (tick, t, ball, paddles, score, winner) of the last frame sent
+
+    def encode(self, result, server_time):
+        """Next message of the stream for a TickResult sampled at server_time (ms)"""
+        self.seq += 1
+        ball = (round(result.ball_x, 3), round(result.ball_y, 3))
+        paddles = (round(result.paddle_left, 3), round(result.paddle_right, 3))
+        score = (result.score_p1, result.score_p2)
+        last = self._last
+        self._last = (result.tick, server_time, ball, paddles, score, result.winner)
+
+        if last is None or self.seq % self.KEYFRAME_INTERVAL == 0:
+            return self.keyframe()
+
+        message = {
+            'type': 'delta',
+            'seq': self.seq,
+            'tick': result.tick,
+            't': server_time,
+            'ball': {'x': ball[0], 'y': ball[1]},
+        }
+        if paddles != last[3]:
+            message['paddles'] = {'left': paddles[0], 'right': paddles[1]}
+        if score != last[4]:
+            message['score'] = {'p1': score[0], 'p2': score[1]}
+        if result.winner is not None:
+            message['winner'] = result.winner
+        return message
+
+    def keyframe(self):
+        """Full frame for the last message sent, or None before the first one"""
+        if self._last is None:
+            return None
+        tick, server_time, ball, paddles, score, winner = self._last
+        return {
+            'type': 'state',
+            'seq': self.seq,
+            'tick': tick,
+            't': server_time,
+            'ball': {'x': ball[0], 'y': ball[1]},
+            'paddles': {'left': paddles[0], 'right': paddles[1]},
+            'score': {'p1': score[0], 'p2': score[1]},
+            'winner': winner,
+        }
@@ -0,0 +1,91 @@
+"""Vectorized replay of Elo updates over a whole match history (recompute_ratings).
+
+Elo is sequential: every update depends on both players' ratings right before
+the match. Matches are therefore grouped into waves in which no player appears
+twice, and every player's matches stay in their original order across waves.
+All matches of a wave are independent and are computed with a handful of NumPy
+operations; the result is the same as applying them one by one.
+
+Fixed players (the "Local opponent" placeholder of local Pong matches, see
+services.local_opponent) keep their rating, so they do not order the waves:
+otherwise every local match of every user would need a wave of its own.
+"""
+try:
+    import numpy as np
+except ImportError:  # only the offline recomputation needs it
+    np = None
+
+
+def assign_waves(side1, side2, fixed=frozenset()):
+    """Wave of every match: one after the latest wave either player (unless fixed) already appeared in"""
+    last = {}
+    waves = np.empty(len(side1), dtype=np.int64)
+    for i, (a, b) in enumerate(zip(side1.tolist(), side2.tolist())):
+        wave = max(last.get(a, -1), last.get(b, -1)) + 1
+        if a not in fixed:
+            last[a] = wave
+        if b not in fixed:
+            last[b] = wave
+        waves[i] = wave
+    return waves
+
+
+class EloReplay:
+    """Ratings of every player (indexed by Player / ChessPlayer pk) while a history is replayed.
+
+    `rounding` is how a new rating becomes an integer, as settlement does it:
+    np.trunc for Pong (int() in services.elo_after truncates toward zero) and
+    np.round for chess (round() in chessgame/services.elo_after; both round
+    half to even).
+    `fixed` maps the pks of players whose rating never changes to that rating.
+    """
+
+    def __init__(self, initial, k, rounding, fixed=None):
+        self.initial = initial
+        self.k = k
+        self.rounding = rounding
+        self.fixed = dict(fixed or {})
+        self.fixed_pks = np.array(sorted(self.fixed), dtype=np.int64)
+        self.ratings = np.full(1024, initial, dtype=np.int64)
+        self.played = np.zeros(1024, dtype=bool)
+        self.matches = 0
+        self.waves = 0
+        self._fit(max(self.fixed, default=0))
+        for pk, rating in self.fixed.items():
+            self.ratings[pk] = rating
+
+    def _fit(self, top):
+        if top < len(self.ratings):
+            return
+        size = max(top + 1, 2 * len(self.ratings))
+        ratings = np.full(size, self.initial, dtype=np.int64)
+        ratings[:len(self.ratings)] = self.ratings
+        played = np.zeros(size, dtype=bool)
+        played[:len(self.played)] = self.played
+        self.ratings, self.played = ratings, played
+
+    def apply(self, side1, side2, score1):
+        """Replay a chunk of matches in history order; score1 is side1's result (1, 0.5 or 0)"""
+        if not len(side1):
+            return
+        self._fit(int(max(side1.max(), side2.max())))
+        self.played[side1] = True
+        self.played[side2] = True
+        waves = assign_waves(side1, side2, self.fixed)
+        order = np.argsort(waves, kind='stable')
+        bounds = np.flatnonzero(np.diff(waves[order])) + 1
+        # a fixed player can appear many times in one wave; its rating is never written
+        rated1 = ~np.isin(side1, self.fixed_pks)
+        rated2 = ~np.isin(side2, self.fixed_pks)
+        ratings, k, rounding = self.ratings, self.k, self.rounding
+        for wave in np.split(order, bounds):
+            a, b, s = side1[wave], side2[wave], score1[wave]
+            ra, rb = ratings[a], ratings[b]
+            expected_a = 1 / (1 + 10 ** ((rb - ra) / 400))
+            expected_b = 1 / (1 + 10 ** ((ra - rb) / 400))
+            new_a = rounding(ra + k * (s - expected_a))
+            new_b = rounding(rb + k * ((1 - s) - expected_b))
+            ratings[a[rated1[wave]]] = new_a[rated1[wave]]
+            ratings[b[rated2[wave]]] = new_b[rated2[wave]]
+        self.matches += len(side1)
+        self.waves += len(bounds) + 1
@@ -0,0 +1,64 @@
+"""Compact input log of a Pong match, and offline re-simulation from it.
+
+A match is fully determined by its serve seed (GameSession.seed), the fixed
+step length (1 / tick_rate) and the paddle positions applied before each step,
+so that is all a replay stores. The input log is append-only: one record per
+paddle position actually applied (coalesced inputs never make it in).
+
+Record (13 bytes, little-endian):
+    u32 tick    number of steps completed when the position was applied
+    u8  side    0 left, 1 right
+    f64 y       paddle position in field units (exact, so re-simulation is bit-identical)
+"""
+import struct
+
+INPUT_RECORD = struct.Struct('<IBd')
+
+SIDES = ('left', 'right')
+_SIDE_CODES = {'left': 0, 'right': 1}
+
+
+class ReplayRecorder:
+    """Append-only input log of one live session"""
+
+    __slots__ = ('data',)
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def record(self, tick, side, y):
+        self.data += INPUT_RECORD.pack(tick, _SIDE_CODES[side], y)
+
+    def __len__(self):
+        return len(self.data) // INPUT_RECORD.size
+
+
+def iter_inputs(data):
+    """(tick, side, y) for every record of an input log"""
+    for tick, side, y in INPUT_RECORD.iter_unpack(bytes(data)):
+        yield tick, SIDES[side], y
+
+
+def simulate(seed, tick_rate, inputs, max_ticks=None):
+    """Re-run a match from its replay data; returns the finished GameSession.
+
+    Steps until a side reaches the winning score, or until max_ticks steps for
+    matches that ended early (abandoned). Runs as fast as the CPU allows.
+    """
+    from .models import GameSession
+
+    game = GameSession(seed=seed)
+    game.status = 'active'
+    dt = 1 / tick_rate
+    records = iter_inputs(inputs)
+    pending = next(records, None)
+    while game.status == 'active' and (max_ticks is None or game.state.tick < max_ticks):
+        while pending is not None and pending[0] == game.state.tick:
+            _, side, y = pending
+            if side == 'left':
+                game.state.paddle_left = y
+            else:
+                game.state.paddle_right = y
+            pending = next(records, None)
+        game.tick(dt)
+    return game
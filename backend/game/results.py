@@ -0,0 +1,338 @@
+"""Write-behind pipeline for the results of finished matches.
+
+Consumers used to await the tournament update and the match settlement before
+announcing a game over, so every millisecond of database latency showed up as
+end-of-game lag. They now submit a result event and notify the players right
+away; one background worker per process applies the events in batches.
+
+Durability: every event is appended to a local journal file before it is queued,
+and marked done once its batch has committed. Each process has its own journal;
+events still pending when a process stops are picked up by the next process
+that starts. The journal is flushed to the OS on every append (enough to
+survive a crashed process) and fsynced once per batch, before that batch is
+applied. Matches remember the id of the event they were recorded from, and a
+tournament game is only completed once, so an event applied just before a
+crash, but not yet marked done, is skipped when it is replayed.
+
+Journal records (one JSON object per line):
+    {"id": ..., "kind": "pong" | "chess", ...}   a submitted event
+    {"done": id}                                 the event was applied (or given up on)
+"""
+import asyncio
+import base64
+import fcntl
+import glob
+import json
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, transaction
+from django_server.broadcast import group_send_json
+from .matchmaking import _percentiles
+
+logger = logging.getLogger(__name__)
+
+
+class ResultJournal:
+    """Append-only file of submitted result events and of the ones that are done.
+
+    Each process writes its own file next to `path` (result_journal.<pid>.jsonl)
+    and holds an exclusive lock on it while it runs, so no process ever truncates
+    events of another. A journal nobody holds the lock of was left by a process
+    that stopped: open() takes its pending events over and removes it.
+    """
+
+    def __init__(self, path):
+        self.base = path
+        self.path = None  # set by open(), in the process that will write it
+        self._file = None
+        self.unsynced = False
+
+    @staticmethod
+    def _read(f):
+        """(pending events by id, last byte) of an open journal file"""
+        pending = {}
+        tail = b'\n'
+        for line in f:
+            tail = line[-1:]
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # torn last line of a crashed run
+            if 'done' in record:
+                pending.pop(record['done'], None)
+            else:
+                pending[record['id']] = record
+        return pending, tail
+
+    def _adopt(self, path):
+        """Pending events of another process's journal if that process is gone, else None"""
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        with f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None  # its process is running
+            try:
+                if os.fstat(f.fileno()).st_ino != os.stat(path).st_ino:
+                    return None  # another process adopted and removed it while we waited
+            except FileNotFoundError:
+                return None
+            pending, _ = self._read(f)
+            for record in pending.values():
+                self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            os.unlink(path)
+            return pending
+
+    def open(self):
+        """Open this process's journal for appending; returns the events stopped processes left pending, oldest first"""
+        root, ext = os.path.splitext(self.base)
+        os.makedirs(os.path.dirname(self.base) or '.', exist_ok=True)
+        self.path = f'{root}.{os.getpid()}{ext}'
+        self._file = open(self.path, 'a+', encoding='utf-8')
+        fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # a journal under our pid was left by an earlier process (pids repeat across container restarts)
+        with open(self.path, 'rb') as f:
+            pending, tail = self._read(f)
+        if tail != b'\n':
+            self._file.write('\n')
+
+        others = sorted(set(glob.glob(f'{glob.escape(root)}.*{ext}')) - {self.path})
+        if os.path.exists(self.base):
+            others.append(self.base)  # single shared journal of older versions
+        for path in others:
+            adopted = self._adopt(path)
+            if adopted:
+                logger.info(f"[results] took over {len(adopted)} result events from {path}")
+                pending.update(adopted)
+        return list(pending.values())
+
+    def append(self, record):
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._file.flush()
+        self.unsynced = True
+
+    def sync(self):
+        if self.unsynced:
+            self.unsynced = False
+            os.fsync(self._file.fileno())
+
+    def truncate(self):
+        """Drop everything; only valid while none of this process's events is pending"""
+        self._file.truncate(0)
+        self.unsynced = False
+
+
+class ResultPipeline:
+    """Queue of result events in front of the database, drained by one worker task.
+
+    The worker takes up to BATCH_SIZE events at a time and applies them in one
+    transaction (each in its own savepoint). If the database is unreachable the
+    whole batch is retried with exponential backoff; an event that fails on its
+    own is retried in a later batch, up to MAX_ATTEMPTS times. Like the tick
+    scheduler, the task only runs while there is something to apply.
+    """
+
+    BATCH_SIZE = 50
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = 0.5      # seconds before the first retry of a failed batch
+    MAX_RETRY_DELAY = 30.0
+
+    def __init__(self, journal_path=None):
+        self.journal = ResultJournal(journal_path or settings.RESULT_JOURNAL_PATH)
+        self.queue = deque()
+        self.attempts = {}  # event id -> failed attempts so far
+        self._opened = False
+        self._task = None
+        self.submitted = 0
+        self.applied = 0
+        self.failed = 0
+        self.retries = 0
+        self.batches = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.recent_lags = deque(maxlen=1000)  # seconds from submission to commit of recently applied events
+
+    def start(self):
+        """Load what a previous run left in the journal and start the worker if there is work"""
+        if not self._opened:
+            self._opened = True
+            recovered = self.journal.open()
+            if recovered:
+                logger.info(f"[results] {len(recovered)} result events recovered from {self.journal.path}")
+            self.queue.extend(recovered)
+        if self.queue and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def submit(self, kind, **data):
+        """Journal and queue a result event; returns its id. Must be called from the event loop."""
+        event = {'id': str(uuid.uuid4()), 'kind': kind, 'submitted_at': time.time(), **data}
+        if not self._opened:
+            self.start()
+        self.journal.append(event)
+        self.queue.append(event)
+        self.submitted += 1
+        self.start()
+        return event['id']
+
+    def get_stats(self):
+        now = time.time()
+        return {
+            'queued': len(self.queue),
+            'oldest_s': round(now - self.queue[0]['submitted_at'], 3) if self.queue else 0,
+            'submitted': self.submitted,
+            'applied': self.applied,
+            'failed': self.failed,
+            'retries': self.retries,
+            'batches': self.batches,
+            'last_flush_ms': round(self.last_flush_ms, 3),
+            'max_flush_ms': round(self.max_flush_ms, 3),
+            'lag_ms': _percentiles([lag * 1000 for lag in self.recent_lags]),
+        }
+
+    async def _run(self):
+        delay = self.RETRY_DELAY
+        try:
+            while self.queue:
+                batch = [self.queue[i] for i in range(min(len(self.queue), self.BATCH_SIZE))]
+                started = time.perf_counter()
+                try:
+                    outcomes = await database_sync_to_async(self._apply)(batch)
+                except (OperationalError, InterfaceError):
+                    self.retries += 1
+                    logger.exception(f"[results] applying {len(batch)} result events failed, retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.MAX_RETRY_DELAY)
+                    continue
+                delay = self.RETRY_DELAY
+                self.batches += 1
+                self.last_flush_ms = (time.perf_counter() - started) * 1000
+                self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+
+                committed_at = time.time()
+                for event in batch:
+                    self.queue.popleft()
+                for event in batch:
+                    await self._settled(event, outcomes[event['id']], committed_at)
+                if not self.queue:
+                    self.journal.truncate()
+        finally:
+            self._task = None
+
+    async def _settled(self, event, outcome, committed_at):
+        if isinstance(outcome, Exception):
+            attempts = self.attempts.get(event['id'], 0) + 1
+            if attempts < self.MAX_ATTEMPTS:
+                self.attempts[event['id']] = attempts
+                self.queue.append(event)
+                return
+            self.attempts.pop(event['id'], None)
+            self.failed += 1
+            logger.error(f"[results] giving up on {event['kind']} result {event['id']} after {attempts} attempts: {outcome!r}")
+            self.journal.append({'done': event['id'], 'failed': True})
+            return
+
+        self.attempts.pop(event['id'], None)
+        self.applied += 1
+        self.recent_lags.append(committed_at - event['submitted_at'])
+        self.journal.append({'done': event['id']})
+        # Unlocked achievements reach every open tab through the chat socket's personal group
+        for user_id, achievements in (outcome or {}).items():
+            if achievements:
+                await group_send_json(get_channel_layer(), f'user_{user_id}', {
+                    'type': 'achievements_unlocked',
+                    'achievements': achievements,
+                })
+
+    def _apply(self, batch):
+        """Apply a batch in one transaction; returns {event id: new achievements by user id, or the exception}"""
+        from chessgame.models import ChessMatch
+        from .models import Match
+
+        self.journal.sync()
+        outcomes = {}
+        ids = [event['id'] for event in batch]
+        with transaction.atomic():
+            applied = {str(i) for i in Match.objects.filter(settlement_id__in=ids).values_list('settlement_id', flat=True)}
+            applied.update(str(i) for i in ChessMatch.objects.filter(settlement_id__in=ids).values_list('settlement_id', flat=True))
+            for event in batch:
+                if event['id'] in applied:
+                    outcomes[event['id']] = None
+                    continue
+                try:
+                    with transaction.atomic():
+                        outcomes[event['id']] = APPLIERS[event['kind']](event)
+                except (OperationalError, InterfaceError):
+                    raise
+                except Exception as e:
+                    logger.exception(f"[results] {event['kind']} result {event['id']} failed")
+                    outcomes[event['id']] = e
+        return outcomes
+
+
+def apply_pong_result(event):
+    from tournament.models import TournamentGame
+    from .consumers import update_game_completed
+    from .services import settle_match
+
+    # Tournament bookkeeping first, as the consumer used to do it. A completed tournament
+    # game is its own marker: a replayed event must not award the winner's points twice.
+    if not TournamentGame.objects.filter(game_id=event['game_id'], status='completed').exists():
+        update_game_completed(event['game_id'], event['winner_id'], event['winner_name'])
+    if event['left_id'] is None or event['right_id'] is None:
+        return {}
+    replay = event['replay']
+    result = settle_match(
+        event['left_id'],
+        event['right_id'],
+        event['score_p1'],
+        event['score_p2'],
+        replay={**replay, 'inputs': base64.b64decode(replay['inputs'])},
+        settlement_id=event['id'],
+    )
+    return result['new_achievements']
+
+
+def apply_chess_result(event):
+    from chessgame.services import settle_chess_match
+
+    settle_chess_match(event['white_id'], event['black_id'], event['winner'], settlement_id=event['id'])
+    return {}
+
+
+APPLIERS = {
+    'pong': apply_pong_result,
+    'chess': apply_chess_result,
+}
+
+
+def submit_pong_result(game, left, right, winner_id, winner_name):
+    """Queue the settlement of a finished Pong game; `left`/`right` are the users who played it"""
+    from .services import replay_fields
+
+    replay = replay_fields(game)
+    replay['inputs'] = base64.b64encode(replay['inputs']).decode('ascii')
+    return result_pipeline.submit(
+        'pong',
+        game_id=game.id,
+        winner_id=winner_id,
+        winner_name=winner_name,
+        left_id=getattr(left, 'id', None),
+        right_id=getattr(right, 'id', None),
+        score_p1=game.state.score_p1,
+        score_p2=game.state.score_p2,
+        replay=replay,
+    )
+
+
+result_pipeline = ResultPipeline()
@@ -0,0 +1,133 @@
+import asyncio
+import time
+import logging
+from django.conf import settings
+from .physics import BatchPhysics, np
+
+logger = logging.getLogger(__name__)
+
+
+class TickScheduler:
+    """Process-wide fixed-timestep clock that steps every registered GameSession.
+
+    One asyncio task drives all live matches instead of one sleeping loop per
+    match. Each wakeup runs as many fixed steps as the wall clock asks for (up to
+    MAX_CATCH_UP_STEPS); if the process fell further behind than that, the
+    backlog is dropped so a stall never turns into a burst of hundreds of steps.
+    """
+
+    MAX_CATCH_UP_STEPS = 5
+    OVERRUN_LOG_INTERVAL = 5.0  # seconds between "tick over budget" warnings
+
+    def __init__(self, tick_rate=None):
+        self.tick_rate = tick_rate or getattr(settings, 'PONG_TICK_RATE', 60)
+        self.dt = 1 / self.tick_rate
+        self._sessions = {}  # game_id -> (GameSession, async callback(result))
+        self._task = None
+        self.batch = self._make_batch()
+        self._last_overrun_log = 0.0
+        self.tick_count = 0
+        self.overruns = 0      # steps that took longer than dt
+        self.skipped = 0       # steps dropped because we fell too far behind
+        self.last_step_ms = 0.0
+        self.max_step_ms = 0.0
+
+    @staticmethod
+    def _make_batch():
+        if getattr(settings, 'PONG_PHYSICS_ENGINE', 'python') != 'numpy':
+            return None
+        if np is None:
+            logger.warning("PONG_PHYSICS_ENGINE is 'numpy' but numpy is not installed; using per-session physics")
+            return None
+        from .models import GameSession
+        return BatchPhysics(speed_limit=GameSession.SPEED_LIMIT)
+
+    def register(self, game, on_result):
+        """Start stepping `game`; `on_result` is awaited with every non-empty tick result."""
+        self._sessions[game.id] = (game, on_result)
+        if self.batch is not None and game.batch is None:
+            self.batch.attach(game)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def unregister(self, game_id):
+        entry = self._sessions.pop(game_id, None)
+        if entry and entry[0].batch is not None:
+            entry[0].batch.detach(entry[0])
+
+    def is_registered(self, game_id):
+        return game_id in self._sessions
+
+    def get_stats(self):
+        return {
+            'sessions': len(self._sessions),
+            'engine': 'numpy' if self.batch is not None else 'python',
+            'tick_rate': self.tick_rate,
+            'ticks': self.tick_count,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'last_step_ms': round(self.last_step_ms, 3),
+            'max_step_ms': round(self.max_step_ms, 3),
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        try:
+            while self._sessions:
+                now = loop.time()
+                if now < next_tick:
+                    await asyncio.sleep(next_tick - now)
+                    continue
+
+                steps = 0
+                while now >= next_tick and steps < self.MAX_CATCH_UP_STEPS:
+                    await self._step()
+                    next_tick += self.dt
+                    steps += 1
+                    now = loop.time()
+
+                # Still behind after catching up: skip the backlog instead of bursting.
+                if now >= next_tick:
+                    missed = int((now - next_tick) / self.dt) + 1
+                    self.skipped += missed
+                    next_tick += missed * self.dt
+        except Exception:
+            logger.exception("Tick scheduler crashed")
+        finally:
+            self._task = None
+
+    async def _step(self):
+        started = time.perf_counter()
+        for game_id, (game, _) in list(self._sessions.items()):
+            if game.status != 'active':
+                self.unregister(game_id)
+            elif game.batch is not None:
+                game.apply_inputs()  # before the batch step; scalar sessions do it in tick()
+        if self.batch is not None:
+            self.batch.step(self.dt)
+        for game_id, (game, on_result) in list(self._sessions.items()):
+            result = game.tick(self.dt)
+            if result is not None:
+                try:
+                    await on_result(result)
+                except Exception:
+                    logger.exception(f"Tick handler failed for game {game_id}")
+                    self.unregister(game_id)
+        self.tick_count += 1
+
+        elapsed = time.perf_counter() - started
+        self.last_step_ms = elapsed * 1000
+        self.max_step_ms = max(self.max_step_ms, self.last_step_ms)
+        if elapsed > self.dt:
+            self.overruns += 1
+            if started - self._last_overrun_log > self.OVERRUN_LOG_INTERVAL:
+                self._last_overrun_log = started
+                logger.warning(
+                    f"Tick over budget: {self.last_step_ms:.2f}ms for {len(self._sessions)} sessions "
+                    f"(budget {self.dt * 1000:.2f}ms, {self.overruns} overruns so far)"
+                )
+
+
+# Shared by every GameConsumer in this process.
+scheduler = TickScheduler()
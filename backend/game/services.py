@@ -1,65 +1,319 @@
 # services file for business logic
 
-from .models import Match, Player
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+from .models import HeadToHead, Match, MatchReplay, Player, PlayerAchievement, RatingResult
+from .achievements import achievement_index
+from .profiles import profile_cache
+from .signals import match_settled
+from .scheduler import scheduler
+
+ELO_K = 10
 
 
 def _resolve_player(entity):
     if isinstance(entity, Player):
         return entity
-    player, _ = Player.objects.get_or_create(user=entity)
+    if isinstance(entity, int):
+        player, _ = Player.objects.get_or_create(user_id=entity)
+    else:
+        player, _ = Player.objects.get_or_create(user=entity)
     return player
 
-def match_ends(game_session, p1, p2):
-    
-    # game_session.state 
-    # 'ball': {'x': 0, 'y': 0, 'vx': 3, 'vy': 1},
-    # 'paddles': {'left': 0, 'right': 0},
-    # 'score': {'p1': 0, 'p2': 0},
-    # 'winningScore': 5
-    
-    p1 = _resolve_player(p1)
-    p2 = _resolve_player(p2)
+def elo_after(rating, opponent_rating, score):
+    """New rating after one game (score 1 win, 0 loss), truncated like IntegerField storage"""
+    return int(rating + ELO_K * (score - 1 / (1 + 10 ** ((opponent_rating - rating) / 400))))
+
+def _by_player(winner_id, winner_value, loser_value):
+    return Case(
+        When(pk=winner_id, then=Value(winner_value)),
+        default=Value(loser_value),
+        output_field=IntegerField(),
+    )
+
+def settle_match(p1, p2, p1_score, p2_score, replay=None, award=None, settlement_id=None):
+    """Record a finished match and update both players in one transaction.
+
+    The player rows are locked with a single SELECT ... FOR UPDATE, so
+    concurrent settlements involving the same player are serialized and every
+    Elo change is computed from the ratings the match was actually played at.
+    The counters of both players are updated by one UPDATE with database-side
+    expressions and earned achievements are inserted with one bulk INSERT.
+
+    `replay` is a dict with the MatchReplay fields (seed, tick_rate, ticks,
+    inputs), or None. `award` limits achievements to the players of the given user
+    ids (both by default). `settlement_id` is stored on the Match so a result
+    event is never applied twice (game/results.py). Returns the Match and the new_achievements payload keyed
+    by user id.
+
+    The "Local opponent" placeholder (local_opponent) is neither locked nor
+    updated: it plays every local match of every user, and a lock on its row
+    would serialize all of them. Its rating stays fixed, so local matches rate
+    the real player against a constant.
+    """
+    with transaction.atomic():
+        p1, p2 = _lock_players(p1, p2)
 
-    p1_score = game_session.state['score']['p1']
-    p2_score = game_session.state['score']['p2']
+        if p1_score > p2_score:
+            w, l = p1, p2
+            winner_score, loser_score = p1_score, p2_score
+        else:
+            w, l = p2, p1
+            winner_score, loser_score = p2_score, p1_score
 
-    if p1_score > p2_score:
-        w, l = p1, p2
-        winner_score, loser_score = p1_score, p2_score
+        match = Match.objects.create(
+            player1 = p1,
+            player2 = p2,
+            player1_score = p1_score,
+            player2_score = p2_score,
+            winner = w,
+            loser = l,
+            settlement_id = settlement_id,
+        )
+        if replay is not None:
+            MatchReplay.objects.create(match = match, **replay)
+        HeadToHead.record('pong', p1.user_id, p2.user_id, int(w is p1), p1_score, p2_score, when = match.timestamp)
+
+        if settings.RATING_ENGINE == 'glicko2':
+            #ratings move when the rating period closes (game/glicko2.py); settlement only records the game
+            w_elo, l_elo = w.elo_rating, l.elo_rating
+            RatingResult.objects.create(game_type = 'pong', user_id = w.user_id, opponent_id = l.user_id, score = 1)
+        else:
+            w_elo = elo_after(w.elo_rating, l.elo_rating, 1)
+            l_elo = elo_after(l.elo_rating, w.elo_rating, 0)
+        Player.objects.filter(pk__in=[p.pk for p in (w, l) if not _is_placeholder(p)]).update(
+            total_games = F('total_games') + 1,
+            total_wins = F('total_wins') + _by_player(w.pk, 1, 0),
+            total_losses = F('total_losses') + _by_player(w.pk, 0, 1),
+            elo_rating = F('elo_rating') + _by_player(w.pk, w_elo - w.elo_rating, l_elo - l.elo_rating),
+            total_win_points = F('total_win_points') + _by_player(w.pk, winner_score, 0),
+            total_loss_points = F('total_loss_points') + _by_player(w.pk, 0, loser_score),
+            current_win_streak = Case(
+                When(pk=w.pk, then=F('current_win_streak') + 1),
+                default=Value(0),
+                output_field=IntegerField(),
+            ),
+            current_loss_streak = Case(
+                When(pk=w.pk, then=Value(0)),
+                default=F('current_loss_streak') + 1,
+                output_field=IntegerField(),
+            ),
+            best_win_streak = Case(
+                When(pk=w.pk, then=Greatest(F('best_win_streak'), F('current_win_streak') + 1)),
+                default=F('best_win_streak'),
+                output_field=IntegerField(),
+            ),
+        )
+
+        #mirror the update on the locked instances, achievements are checked against these
+        before = {player.pk: achievement_index.stat_snapshot(player) for player in (w, l)}
+        for player, won, points, elo in ((w, True, winner_score, w_elo), (l, False, loser_score, l_elo)):
+            if not _is_placeholder(player):
+                _count_game(player, won, points, elo)
+
+        awarded = [p for p in (w, l) if award is None or p.user_id in award]
+        earned = {p.pk: [] for p in (w, l)}
+        earned.update(_award_achievements(awarded, before, match))
+        transaction.on_commit(lambda: match_settled.send(sender=Match, game_type='pong', players=(w, l)))
+
+    new_achievements = {
+        str(player.user_id): [{'name': a.name, 'description': a.description} for a in earned[player.pk]]
+        for player in (w, l)
+    }
+    return {'match': match, 'new_achievements': new_achievements}
+
+def _count_game(player, won, points, elo):
+    """Apply one game to a Player instance, like the UPDATE in settle_match does to its row"""
+    player.total_games += 1
+    player.elo_rating = elo
+    if won:
+        player.total_wins += 1
+        player.total_win_points += points
+        player.current_win_streak += 1
+        player.current_loss_streak = 0
+        player.best_win_streak = max(player.best_win_streak, player.current_win_streak)
     else:
-        w, l = p2, p1
-        winner_score, loser_score = p2_score, p1_score
-
-    match = Match.objects.create(
-        player1 = p1,
-        player2 = p2,
-        player1_score = p1_score,
-        player2_score = p2_score,
-        winner = w,
-        loser = l,
-    )
+        player.total_losses += 1
+        player.total_loss_points += points
+        player.current_loss_streak += 1
+        player.current_win_streak = 0
 
-    w.player_wins(win_point = winner_score, opponent_elo = l.elo_rating)
-    l.player_loses(loss_point = loser_score, opponent_elo = w.elo_rating)
+SETTLED_FIELDS = [
+    'total_games', 'total_wins', 'total_losses', 'elo_rating', 'total_win_points', 'total_loss_points',
+    'current_win_streak', 'current_loss_streak', 'best_win_streak',
+]
 
-    w_new = w.check_new_achievements()
-    l_new = l.check_new_achievements()
+def settle_matches(p1, p2, scores, award=None):
+    """Record several finished matches between the same two players in one transaction.
+
+    `scores` is a list of (p1_score, p2_score), oldest first. The matches are
+    played through in memory on the locked players, exactly as settle_match
+    would one by one, then written with one bulk INSERT of matches, one UPDATE
+    of the two players, one head-to-head update and one bulk INSERT of
+    achievements (each linked to the match that earned it). Returns the
+    Matches and the new_achievements payload keyed by user id, as settle_match does.
+    """
+    with transaction.atomic():
+        p1, p2 = _lock_players(p1, p2)
+        glicko = settings.RATING_ENGINE == 'glicko2'
+        awarded = [p for p in (p1, p2) if award is None or p.user_id in award]
+        matches, results, crossed = [], [], []
+        wins1 = points1 = points2 = 0
+        for p1_score, p2_score in scores:
+            if p1_score > p2_score:
+                w, l, winner_score, loser_score = p1, p2, p1_score, p2_score
+            else:
+                w, l, winner_score, loser_score = p2, p1, p2_score, p1_score
+            match = Match(player1 = p1, player2 = p2, player1_score = p1_score, player2_score = p2_score, winner = w, loser = l)
+            matches.append(match)
+            wins1 += int(w is p1)
+            points1 += p1_score
+            points2 += p2_score
+
+            if glicko:
+                w_elo, l_elo = w.elo_rating, l.elo_rating
+                results.append(RatingResult(game_type = 'pong', user_id = w.user_id, opponent_id = l.user_id, score = 1))
+            else:
+                w_elo = elo_after(w.elo_rating, l.elo_rating, 1)
+                l_elo = elo_after(l.elo_rating, w.elo_rating, 0)
+            before = {player.pk: achievement_index.stat_snapshot(player) for player in awarded}
+            for player, won, points, elo in ((w, True, winner_score, w_elo), (l, False, loser_score, l_elo)):
+                if not _is_placeholder(player):
+                    _count_game(player, won, points, elo)
+            for player in awarded:
+                certainly_new, maybe_earned = achievement_index.crossed_by(player, before[player.pk])
+                crossed.extend((player, achievement, match) for achievement in certainly_new + maybe_earned)
+
+        Match.objects.bulk_create(matches)
+        RatingResult.objects.bulk_create(results)
+        Player.objects.bulk_update([p for p in (p1, p2) if not _is_placeholder(p)], SETTLED_FIELDS)
+        HeadToHead.record_games('pong', p1.user_id, p2.user_id, wins1, len(matches) - wins1, 0, points1, points2, when = matches[-1].timestamp)
+
+        #elo achievements can be crossed more than once, in this batch or before it
+        already_earned = set()
+        if any(achievement.requirement_type not in achievement_index.MONOTONIC for _, achievement, _ in crossed):
+            already_earned = set(
+                PlayerAchievement.objects.filter(
+                    player_id__in=[p.pk for p in awarded],
+                    achievement_id__in={achievement.pk for _, achievement, _ in crossed},
+                ).values_list('player_id', 'achievement_id')
+            )
+        earned = {p.pk: [] for p in (p1, p2)}
+        rows = []
+        for player, achievement, match in crossed:
+            if (player.pk, achievement.pk) not in already_earned:
+                already_earned.add((player.pk, achievement.pk))
+                earned[player.pk].append(achievement)
+                rows.append(PlayerAchievement(player = player, achievement = achievement, match = match))
+        PlayerAchievement.objects.bulk_create(rows)
+        if rows:
+            #bulk_create sends no post_save, so drop_achiever_profile does not see these
+            achievers = [p.user_id for p in (p1, p2) if earned[p.pk]]
+            transaction.on_commit(lambda: profile_cache.invalidate(achievers))
+        transaction.on_commit(lambda: match_settled.send(sender=Match, game_type='pong', players=(p1, p2)))
 
     new_achievements = {
-        str(w.user_id): [{'name': a.name, 'description': a.description} for a in w_new],
-        str(l.user_id): [{'name': a.name, 'description': a.description} for a in l_new],
+        str(player.user_id): [{'name': a.name, 'description': a.description} for a in earned[player.pk]]
+        for player in (p1, p2)
     }
+    return {'matches': matches, 'new_achievements': new_achievements}
 
-    return {'match': match, 'new_achievements': new_achievements}
+LOCAL_OPPONENT = 'Local opponent'
+_local_opponent_id = None
+
+def local_opponent():
+    """User id of the inactive placeholder user that plays the other side of every local match"""
+    global _local_opponent_id
+    if _local_opponent_id is None:
+        User = get_user_model()
+        user, _ = User.objects.get_or_create(username = LOCAL_OPPONENT, defaults = {'is_active': False})
+        Player.objects.get_or_create(user = user)
+        _local_opponent_id = user.pk
+    return _local_opponent_id
+
+def _is_placeholder(player):
+    return player.user_id == local_opponent()
+
+def _lock_players(*entities):
+    """Lock the Player rows of `entities` (Players, users or user ids) in one query, in the same order.
+
+    The local-match placeholder is read without a lock (see settle_match).
+    """
+    user_ids = [
+        e.user_id if isinstance(e, Player) else e if isinstance(e, int) else e.pk
+        for e in entities
+    ]
 
+    placeholder_id = local_opponent()
 
-def get_match_history(player: Player, limit: int = 10) -> list:
-    """Return the most recent matches for a player."""
-    return Match.objects.filter(
-        player1=player
-    ).union(
-        Match.objects.filter(player2=player)
-    ).order_by('-timestamp')[:limit]
+    def load():
+        players = Player.objects.filter(user_id__in=user_ids)
+        if placeholder_id in user_ids:
+            placeholder = list(players.filter(user_id=placeholder_id))
+            players = players.exclude(user_id=placeholder_id)
+        else:
+            placeholder = []
+        return {p.user_id: p for p in [*players.select_for_update(), *placeholder]}
+
+    locked = load()
+    if len(locked) < len(set(user_ids)):
+        #players created before the post_save signal existed have no row yet
+        for entity in entities:
+            _resolve_player(entity)
+        locked = load()
+    return [locked[user_id] for user_id in user_ids]
+
+def _award_achievements(players, before, match):
+    """Insert the achievements `players` crossed since their `before` stats; returns {player pk: [Achievement]}.
+
+    Only thresholds crossed by this match are candidates (see AchievementIndex),
+    so most settlements need no achievement query at all and the rest one INSERT.
+    Achievements added later are handed out by the backfill_achievements command.
+    """
+    earned = {}
+    maybe_earned = {}
+    for player in players:
+        earned[player.pk], maybe_earned[player.pk] = achievement_index.crossed_by(player, before[player.pk])
+
+    if any(maybe_earned.values()):
+        #elo can drop and rise again past the same threshold
+        already_earned = set(
+            PlayerAchievement.objects.filter(
+                player_id__in=[pk for pk, achievements in maybe_earned.items() if achievements],
+                achievement_id__in={a.pk for achievements in maybe_earned.values() for a in achievements},
+            ).values_list('player_id', 'achievement_id')
+        )
+        for player_id, achievements in maybe_earned.items():
+            earned[player_id] += [a for a in achievements if (player_id, a.pk) not in already_earned]
+
+    rows = [
+        PlayerAchievement(player_id=player_id, achievement=achievement, match=match)
+        for player_id, achievements in earned.items()
+        for achievement in achievements
+    ]
+    if rows:
+        PlayerAchievement.objects.bulk_create(rows)
+        #bulk_create sends no post_save, so drop_achiever_profile does not see these
+        achievers = [p.user_id for p in players if earned[p.pk]]
+        transaction.on_commit(lambda: profile_cache.invalidate(achievers))
+    return earned
+
+def replay_fields(game_session):
+    """MatchReplay fields of a finished GameSession, for settle_match(replay=...)"""
+    
+    # game_session.state is a PongState:
+    # ball_x, ball_y, ball_vx, ball_vy, paddle_left, paddle_right,
+    # score_p1, score_p2, winning_score
+    
+    return {
+        'seed': game_session.seed,
+        'tick_rate': scheduler.tick_rate,
+        'ticks': game_session.state.tick,
+        'inputs': bytes(game_session.replay.data),
+    }
 
 
 def get_leaderboard(top_n: int = 10) -> list:
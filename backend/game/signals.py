@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# Sent once a finished match has been committed (game/services.py, chessgame/services.py).
+# Arguments: game_type ('pong' or 'chess') and players, the Player / ChessPlayer
+# instances of both sides holding their updated stats.
+match_settled = Signal()
@@ -0,0 +1,72 @@
+class PongState:
+    """Flat per-match simulation state (ball, paddles, score).
+
+    __slots__ keeps every session to one small object of plain floats and ints
+    instead of three nested dicts.
+    """
+
+    __slots__ = (
+        'ball_x', 'ball_y', 'ball_vx', 'ball_vy',
+        'paddle_left', 'paddle_right',
+        'score_p1', 'score_p2', 'winning_score', 'tick',
+    )
+
+    def __init__(self, winning_score=5):
+        self.ball_x = 0.0
+        self.ball_y = 0.0
+        self.ball_vx = 3.0
+        self.ball_vy = 1.0
+        self.paddle_left = 0.0
+        self.paddle_right = 0.0
+        self.score_p1 = 0
+        self.score_p2 = 0
+        self.winning_score = winning_score
+        self.tick = 0  # number of simulation steps taken
+
+    def score_dict(self):
+        return {'p1': self.score_p1, 'p2': self.score_p2}
+
+
+class TickResult:
+    """Output record of one simulation step.
+
+    Every session owns exactly one of these and tick() overwrites it in place, so
+    the 60 Hz hot path allocates nothing. Callers that need to keep a frame past
+    the next tick must copy it (as_dict()).
+    """
+
+    __slots__ = (
+        'tick', 'ball_x', 'ball_y', 'paddle_left', 'paddle_right',
+        'score_p1', 'score_p2', 'winner',
+    )
+
+    def __init__(self):
+        self.tick = 0
+        self.ball_x = 0.0
+        self.ball_y = 0.0
+        self.paddle_left = 0.0
+        self.paddle_right = 0.0
+        self.score_p1 = 0
+        self.score_p2 = 0
+        self.winner = None
+
+    def fill(self, state, winner):
+        self.tick = state.tick
+        self.ball_x = state.ball_x
+        self.ball_y = state.ball_y
+        self.paddle_left = state.paddle_left
+        self.paddle_right = state.paddle_right
+        self.score_p1 = state.score_p1
+        self.score_p2 = state.score_p2
+        self.winner = winner
+        return self
+
+    def as_dict(self):
+        """The JSON 'state' frame shape the frontend renders"""
+        return {
+            'tick': self.tick,
+            'ball': {'x': self.ball_x, 'y': self.ball_y},
+            'paddles': {'left': self.paddle_left, 'right': self.paddle_right},
+            'score': {'p1': self.score_p1, 'p2': self.score_p2},
+            'winner': self.winner,
+        }
@@ -0,0 +1,422 @@
+import asyncio
+import json
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import skipIf
+
+import jwt
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from chessgame import services as chess_services
+from chessgame.consumers import chess_matchmaker, pair_chess_players
+from chessgame.models import ChessMatch, ChessPlayer, ChessSession
+from django_server.broadcast import encoded_event
+from django_server.layers import FanoutChannelLayer
+from . import glicko2, leaderboard, services
+from .consumers import GameConsumer, pair_pong_players, pong_matchmaker
+from .glicko2 import np
+from .history import encode_cursor, get_history
+from .matchmaking import RatingMatchmaker, Ticket, _percentiles
+from .models import CacheInvalidation, GameSession, Match, Player
+from .protocol import INPUT_FRAME, MSG_PADDLE_MOVE, DeltaEncoder
+from .ratings import EloReplay
+from .state import TickResult
+
+
+class MatchHistoryTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='pw')
+        self.bob = User.objects.create_user('bob', password='pw')
+        self.pong = Player.objects.get(user=self.alice)
+        self.pong_opponent = Player.objects.get(user=self.bob)
+        self.chess, _ = ChessPlayer.objects.get_or_create(user=self.alice)
+        self.chess_opponent, _ = ChessPlayer.objects.get_or_create(user=self.bob)
+        self.now = timezone.now()
+
+    def pong_match(self, minutes_ago, alice_first=True):
+        p1, p2 = (self.pong, self.pong_opponent) if alice_first else (self.pong_opponent, self.pong)
+        match = Match.objects.create(player1=p1, player2=p2, player1_score=5, player2_score=3, winner=p1, loser=p2)
+        Match.objects.filter(pk=match.pk).update(timestamp=self.now - timedelta(minutes=minutes_ago))
+        return ('pong', match.pk)
+
+    def chess_match(self, minutes_ago, alice_white=True):
+        white, black = (self.chess, self.chess_opponent) if alice_white else (self.chess_opponent, self.chess)
+        match = ChessMatch.objects.create(white=white, black=black, result='1-0', white_elo_before=1200, black_elo_before=1200)
+        ChessMatch.objects.filter(pk=match.pk).update(timestamp=self.now - timedelta(minutes=minutes_ago))
+        return ('chess', match.pk)
+
+    def read_all(self, limit):
+        seen = []
+        cursor = None
+        while True:
+            entries, cursor = get_history(self.pong, self.chess, limit=limit, cursor=cursor)
+            self.assertLessEqual(len(entries), limit)
+            seen += [(entry['game_type'], entry['id']) for entry in entries]
+            if cursor is None:
+                return seen
+
+    def test_small_pages_return_the_whole_timeline_once(self):
+        expected = []
+        for minutes in range(12):
+            expected.append(self.pong_match(minutes * 2, alice_first=minutes % 3 != 0))
+            expected.append(self.chess_match(minutes * 2 + 1, alice_white=minutes % 2 == 0))
+
+        for limit in (1, 2, 3, 5):
+            seen = self.read_all(limit)
+            self.assertEqual(seen, expected)
+            self.assertEqual(len(set(seen)), len(seen))
+
+    def test_equal_timestamps_across_game_types(self):
+        games = [self.pong_match(5, alice_first=i % 2 == 0) for i in range(4)]
+        games += [self.chess_match(5, alice_white=i % 2 == 0) for i in range(4)]
+        games.append(self.pong_match(1))
+        games.append(self.chess_match(9))
+
+        full, cursor = get_history(self.pong, self.chess, limit=100)
+        self.assertIsNone(cursor)
+        self.assertEqual(sorted((e['game_type'], e['id']) for e in full), sorted(games))
+        for limit in (1, 2, 3):
+            self.assertEqual(self.read_all(limit), [(e['game_type'], e['id']) for e in full])
+
+    def test_bad_cursor_returns_400(self):
+        self.pong_match(1)
+        bad_game_type = encode_cursor({'_timestamp': self.now, 'game_type': 'tennis', 'id': 1})
+        for cursor in ('garbage', '%%%', bad_game_type):
+            response = self.client.get('/api/match-history/alice', {'games': 'pong,chess', 'cursor': cursor})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+
+@skipIf(np is None, "glicko2 needs numpy")
+class Glicko2Tests(SimpleTestCase):
+    def test_glickman_example(self):
+        # the worked example of Glickman's "Example of the Glicko-2 system":
+        # a 1500/200 player beats a 1400/30 one and loses to 1550/100 and 1700/300
+        rating, deviation, volatility = glicko2.rate_period(
+            np.array([1500.0, 1400.0, 1550.0, 1700.0]),
+            np.array([200.0, 30.0, 100.0, 300.0]),
+            np.array([0.06, 0.06, 0.06, 0.06]),
+            np.array([0, 0, 0]),
+            np.array([1, 2, 3]),
+            np.array([1.0, 0.0, 0.0]),
+            tau=0.5,
+        )
+        # the paper rounds its intermediate steps, hence the 0.01 tolerance
+        self.assertAlmostEqual(rating[0], 1464.06, delta=0.01)
+        self.assertAlmostEqual(deviation[0], 151.52, delta=0.01)
+        self.assertAlmostEqual(volatility[0], 0.05999, delta=0.00001)
+
+    def test_players_without_games_only_lose_certainty(self):
+        rating, deviation, volatility = glicko2.rate_period(
+            np.array([1500.0, 1600.0, 1500.0]),
+            np.array([200.0, 50.0, 200.0]),
+            np.array([0.06, 0.06, 0.06]),
+            np.array([0, 2]),
+            np.array([2, 0]),
+            np.array([1.0, 0.0]),
+        )
+        self.assertEqual(rating[1], 1600.0)
+        self.assertAlmostEqual(deviation[1], np.sqrt(50.0 ** 2 + (0.06 * glicko2.SCALE) ** 2))
+        self.assertEqual(volatility[1], 0.06)
+
+
+class InputThrottleTests(SimpleTestCase):
+    def test_newest_message_over_the_limit_is_applied(self):
+        game = GameSession()
+        game.handle_paddle_move('left', 0.1)
+        game.defer_input('left', json.dumps({'type': 'paddleMove', 'y': 0.2}))
+        game.defer_input('left', json.dumps({'type': 'paddleMove', 'y': 0.3}))
+        game.defer_input('right', INPUT_FRAME.pack(MSG_PADDLE_MOVE, -0.5))
+        game.apply_inputs()
+        self.assertAlmostEqual(game.state.paddle_left, 0.3 * 4)
+        self.assertEqual(game.state.paddle_right, -0.5 * 4)
+        self.assertEqual((game.inputs_deferred, game.inputs_dropped, game.inputs_coalesced), (3, 1, 1))
+
+    def test_parsed_move_replaces_an_older_deferred_one(self):
+        game = GameSession()
+        game.defer_input('left', json.dumps({'type': 'paddleMove', 'y': 0.9}))
+        game.handle_paddle_move('left', -0.25)
+        game.apply_inputs()
+        self.assertEqual(game.state.paddle_left, -1.0)
+        self.assertEqual(game.inputs_dropped, 1)
+
+
+class ConflatedStreamTests(SimpleTestCase):
+    def test_slow_socket_gets_a_keyframe_not_a_delta(self):
+        game = GameSession()
+        stream = game.streams[30] = DeltaEncoder()
+        layer = FanoutChannelLayer()
+        consumer = GameConsumer()
+        consumer.game, consumer.snapshot_rate, consumer.binary = game, 30, False
+        sent = []
+
+        async def send(text_data=None, bytes_data=None):
+            sent.append(json.loads(text_data))
+        consumer.send = send
+
+        async def run():
+            channel = await layer.new_channel()
+            await layer.group_add('frames', channel)
+            for tick in range(1, 5):
+                result = TickResult()
+                result.tick = tick
+                await layer.group_send('frames', encoded_event(stream.encode(result, tick), latest='frames'))
+            await consumer.send_encoded(await layer.receive(channel))
+            result = TickResult()
+            result.tick = 5
+            await layer.group_send('frames', encoded_event(stream.encode(result, 5), latest='frames'))
+            await consumer.send_encoded(await layer.receive(channel))
+
+        async_to_sync(run)()
+        self.assertEqual([(m['type'], m['seq']) for m in sent], [('state', 4), ('delta', 5)])
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        # (rating, wins): bob and carol tie, so the ranks are 1, 2, 2, 4, 5
+        for name, rating, wins in [('alice', 1100, 5), ('bob', 1050, 3), ('carol', 1050, 3), ('dave', 1000, 4), ('erin', 950, 0)]:
+            user = User.objects.create_user(name, password='pw')
+            Player.objects.filter(user=user).update(elo_rating=rating, total_wins=wins)
+            setattr(self, name, user)
+        self.board = leaderboard.pong_leaderboard
+        self.board.invalidate()
+        leaderboard._polled_at = 0.0
+
+    def around(self, user, n):
+        rank, total, rows = self.board.around(user.pk, n)
+        return rank, total, [(row['rank'], row['username']) for row in rows]
+
+    def test_tied_players_share_a_rank(self):
+        self.assertEqual(self.around(self.dave, 5), (4, 5, [
+            (1, 'alice'), (2, 'bob'), (2, 'carol'), (4, 'dave'), (5, 'erin'),
+        ]))
+        self.assertEqual(self.around(self.carol, 0), (2, 5, [(2, 'carol')]))
+
+    def test_unknown_player(self):
+        self.assertEqual(self.board.around(10 ** 6, 2), (None, 5, []))
+
+    def test_window_is_cut_at_the_edges(self):
+        self.assertEqual(self.around(self.alice, 2)[2], [(1, 'alice'), (2, 'bob'), (2, 'carol')])
+        self.assertEqual(self.around(self.erin, 2)[2], [(2, 'carol'), (4, 'dave'), (5, 'erin')])
+
+    def test_update_moves_the_player(self):
+        self.board.top(1)  # loaded
+        erin = Player.objects.get(user=self.erin)
+        self.board.update(erin.pk, self.erin.pk, elo_rating=1200, total_wins=1, current_win_streak=1)
+        self.assertEqual(self.around(self.erin, 1), (1, 5, [(1, 'erin'), (2, 'alice')]))
+        self.assertEqual(self.around(self.dave, 0)[0], 5)
+
+        # dropping into a tie ranks them with it
+        self.board.update(erin.pk, self.erin.pk, elo_rating=1050, total_wins=3, current_win_streak=0)
+        self.assertEqual(self.around(self.erin, 0)[0], 2)
+        self.assertEqual(self.around(self.dave, 0)[0], 5)
+
+
+class InvalidationLogTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='pw')
+        leaderboard.pong_leaderboard.invalidate()
+        leaderboard._polled_at = 0.0
+
+    def test_other_process_invalidation_is_applied_on_read(self):
+        _, rows = leaderboard.pong_leaderboard.top(10)
+        self.assertEqual(rows[0]['elo_rating'], 1000)
+
+        # another process changed the rating and logged it
+        Player.objects.filter(user=self.alice).update(elo_rating=1234)
+        CacheInvalidation.objects.create(board='pong', users=[self.alice.pk], origin='another-process')
+        _, rows = leaderboard.pong_leaderboard.top(10)
+        self.assertEqual(rows[0]['elo_rating'], 1000)  # polled at most once per POLL_INTERVAL
+
+        leaderboard._polled_at = 0.0
+        _, rows = leaderboard.pong_leaderboard.top(10)
+        self.assertEqual(rows[0]['elo_rating'], 1234)
+
+    def test_own_invalidations_are_skipped(self):
+        leaderboard.pong_leaderboard.top(10)
+        loads = leaderboard.pong_leaderboard.loads
+        leaderboard.publish_invalidation('pong', users=[self.alice.pk])
+        leaderboard._polled_at = 0.0
+        leaderboard.pong_leaderboard.top(10)
+        self.assertEqual(leaderboard.pong_leaderboard.loads, loads)
+
+
+def _enqueue(matchmaker, *tickets):
+    """Queue (user_id, game_id, rating, since) tickets; enqueue needs a running loop for its pass task"""
+    async def run():
+        for ticket in tickets:
+            matchmaker.enqueue(*ticket)
+        matchmaker._task.cancel()
+        await asyncio.sleep(0)
+    async_to_sync(run)()
+
+
+class RatingMatchmakerTests(SimpleTestCase):
+    def setUp(self):
+        self.matchmaker = RatingMatchmaker('test', on_match=None)
+
+    def test_window_widens_with_waiting(self):
+        _enqueue(self.matchmaker, (1, 'a', 1000, 0.0), (2, 'b', 1200, 0.0))
+        # a gap of 200 fits once both waited (200 - BASE_WINDOW) / WINDOW_GROWTH = 6 s
+        self.assertEqual(self.matchmaker.match_pass(now=5.9), [])
+        pairs = self.matchmaker.match_pass(now=6.0)
+        self.assertEqual([(host.user_id, guest.user_id) for host, guest in pairs], [(1, 2)])
+        self.assertEqual(self.matchmaker.tickets, {})
+
+    def test_window_uses_the_newer_wait_and_stops_at_max_window(self):
+        _enqueue(self.matchmaker, (1, 'a', 1000, 0.0), (2, 'b', 1100, 10.0), (3, 'c', 2500, 0.0))
+        self.assertEqual(self.matchmaker.match_pass(now=11.0), [])
+        pairs = self.matchmaker.match_pass(now=12.0)
+        self.assertEqual([(host.user_id, guest.user_id) for host, guest in pairs], [(1, 2)])
+        self.assertEqual(self.matchmaker.match_pass(now=10 ** 6), [])
+        self.assertEqual(list(self.matchmaker.tickets), [3])
+
+    def test_claim_takes_the_closest_fitting_ticket(self):
+        _enqueue(self.matchmaker, (1, 'a', 1000, 0.0), (2, 'b', 1030, 0.0), (3, 'c', 1200, 0.0))
+        self.assertEqual(self.matchmaker.claim(4, 1040, now=5.0).user_id, 2)
+        self.assertEqual(self.matchmaker.claim(4, 1040, now=5.0).user_id, 1)
+        self.assertIsNone(self.matchmaker.claim(4, 1040, now=5.0))  # 1200 is outside BASE_WINDOW
+        self.assertIsNone(self.matchmaker.claim(3, 1200, now=5.0))  # not against themselves
+        self.assertEqual(self.matchmaker.matched, 4)
+
+    def test_percentiles(self):
+        self.assertEqual(_percentiles([]), {'p50': 0, 'p90': 0, 'p99': 0})
+        self.assertEqual(_percentiles(list(range(100, 0, -1))), {'p50': 50, 'p90': 90, 'p99': 99})
+        _enqueue(self.matchmaker, (1, 'a', 1000, 0.0), (2, 'b', 1000, 4.0))
+        self.matchmaker.match_pass(now=10.0)
+        stats = self.matchmaker.get_stats()
+        self.assertEqual((stats['queued'], stats['matched']), (0, 2))
+        self.assertEqual(stats['matched_wait_s']['p50'], 6.0)
+
+
+class PairPlayersTests(SimpleTestCase):
+    def tearDown(self):
+        for matchmaker in (pong_matchmaker, chess_matchmaker):
+            for user_id in list(matchmaker.tickets):
+                matchmaker.remove(user_id)
+        GameSession._games.clear()
+        ChessSession._games.clear()
+
+    def pair(self, pair_players, matchmaker, host, guest):
+        async def run():
+            await pair_players(host, guest)
+            if matchmaker._task is not None:
+                matchmaker._task.cancel()
+                await asyncio.sleep(0)
+        async_to_sync(run)()
+
+    def pong_session(self, user_id):
+        game = GameSession()
+        game.players['left'] = SimpleNamespace(id=user_id)
+        GameSession._games[game.id] = game
+        return game
+
+    def chess_session(self, user_id):
+        game = ChessSession()
+        game.players['black'] = SimpleNamespace(id=user_id)
+        ChessSession._games[game.id] = game
+        return game
+
+    def test_pong_pair_seats_the_guest_with_the_host(self):
+        host_game, guest_game = self.pong_session(1), self.pong_session(2)
+        self.pair(pair_pong_players, pong_matchmaker, Ticket(1, host_game.id, 1000, 0.0), Ticket(2, guest_game.id, 1000, 1.0))
+        self.assertEqual(host_game.players['right'].id, 2)
+        self.assertIsNone(guest_game.players['left'])
+
+    def test_pong_pair_requeues_the_side_still_waiting(self):
+        host_game = self.pong_session(1)
+        self.pair(pair_pong_players, pong_matchmaker, Ticket(1, host_game.id, 1000, 3.0), Ticket(2, 'gone', 1000, 4.0))
+        self.assertEqual(list(pong_matchmaker.tickets), [1])
+        self.assertEqual(pong_matchmaker.tickets[1].since, 3.0)  # keeps their place
+        self.assertIsNone(host_game.players['right'])
+
+    def test_chess_pair_requeues_the_side_still_waiting(self):
+        guest_game = self.chess_session(2)
+        self.pair(pair_chess_players, chess_matchmaker, Ticket(1, 'gone', 1200, 0.0), Ticket(2, guest_game.id, 1200, 5.0))
+        self.assertEqual(list(chess_matchmaker.tickets), [2])
+        self.assertEqual(chess_matchmaker.tickets[2].since, 5.0)
+
+
+class JoinTests(TestCase):
+    def tearDown(self):
+        for user_id in list(pong_matchmaker.tickets):
+            pong_matchmaker.remove(user_id)
+        GameSession._games.clear()
+        GameSession.matchmaking.waiting.clear()
+        GameSession.matchmaking.owners.clear()
+
+    def join(self, user):
+        token = jwt.encode({'type': 'access', 'user_id': user.pk}, settings.SECRET_KEY, algorithm='HS256')
+        self.client.cookies['access_token'] = token
+        return self.client.post('/api/game/join').json()['gameId']
+
+    def test_join_is_seated_with_a_waiting_player(self):
+        alice = User.objects.create_user('alice', password='pw')
+        bob = User.objects.create_user('bob', password='pw')
+        carol = User.objects.create_user('carol', password='pw')
+        Player.objects.filter(user=carol).update(elo_rating=1500)
+
+        game_id = self.join(alice)
+        self.assertEqual(self.join(alice), game_id)  # still waiting: same session
+        _enqueue(pong_matchmaker, (alice.pk, game_id, 1000, 0.0))  # alice's socket connected
+
+        self.assertNotEqual(self.join(carol), game_id)  # rating too far off
+        self.assertEqual(self.join(bob), game_id)
+        game = GameSession.get_game(game_id)
+        self.assertEqual({game.players['left'], game.players['right']}, {alice, bob})
+        self.assertNotIn(alice.pk, pong_matchmaker.tickets)
+        self.assertTrue(game.can_start())
+
+
+class LocalOpponentTests(TestCase):
+    def test_placeholder_is_recognised_before_local_opponent_ran_here(self):
+        alice = User.objects.create_user('alice', password='pw')
+        placeholder = User.objects.create_user(services.LOCAL_OPPONENT, password='pw', is_active=False)
+        services._local_opponent_id = None  # e.g. a worker process that never served a local match
+        self.addCleanup(setattr, services, '_local_opponent_id', None)
+
+        services.settle_match(alice.pk, placeholder.pk, 5, 0)
+        self.assertEqual(Player.objects.get(user=placeholder).total_games, 0)
+        self.assertEqual(Player.objects.get(user=alice).total_wins, 1)
+
+
+@skipIf(np is None, 'numpy is not installed')
+class EloReplayTests(SimpleTestCase):
+    PLACEHOLDER = 7
+
+    def history(self, scores):
+        rng = np.random.default_rng(3)
+        side1 = rng.integers(1, 7, 600)
+        side2 = (side1 + rng.integers(1, 6, 600)) % 6 + 1  # never side1
+        # every third match is a local one against the placeholder
+        side2[::3] = self.PLACEHOLDER
+        return side1, side2, rng.choice(scores, 600)
+
+    def sequential(self, side1, side2, score1, initial, elo_after):
+        ratings = {self.PLACEHOLDER: initial}
+        for a, b, s in zip(side1.tolist(), side2.tolist(), score1.tolist()):
+            ra, rb = ratings.get(a, initial), ratings.get(b, initial)
+            if a != self.PLACEHOLDER:
+                ratings[a] = elo_after(ra, rb, s)
+            if b != self.PLACEHOLDER:
+                ratings[b] = elo_after(rb, ra, 1 - s)
+        return ratings
+
+    def check(self, scores, initial, k, rounding, elo_after):
+        side1, side2, score1 = self.history(scores)
+        replay = EloReplay(initial, k, rounding, fixed={self.PLACEHOLDER: initial})
+        for start in range(0, 600, 250):  # chunked like recompute_ratings
+            replay.apply(side1[start:start + 250], side2[start:start + 250], score1[start:start + 250])
+        expected = self.sequential(side1, side2, score1, initial, elo_after)
+        self.assertEqual({pk: int(replay.ratings[pk]) for pk in expected}, expected)
+        self.assertLess(replay.waves, len(side1))
+
+    def test_pong_matches_one_by_one_settlement(self):
+        self.check([1.0, 0.0], 1000, services.ELO_K, np.trunc, services.elo_after)
+
+    def test_chess_matches_one_by_one_settlement(self):
+        self.check([1.0, 0.5, 0.0], 1200, chess_services.ELO_K, np.round, chess_services.elo_after)
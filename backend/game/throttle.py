@@ -0,0 +1,28 @@
+import time
+
+
+class TokenBucket:
+    """Inbound message budget of one connection.
+
+    Holds up to `burst` tokens and refills at `rate` tokens per second; every
+    accepted message takes one. A client sending faster than `rate` does not
+    get the excess parsed and applied one by one (see GameConsumer.receive).
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def allow(self):
+        """Take a token if one is available; False means drop the message"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
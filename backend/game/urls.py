@@ -4,14 +4,19 @@ from . import views
 urlpatterns = [
     path('game/create', views.create_game, name='create_game'),
     path('game/record-local-match/', views.record_local_match, name='record_local_match'),
+    path('game/record-local-matches/', views.record_local_matches, name='record_local_matches'),
     path('game/join', views.join_pong, name='join_pong'),
     path('game/<str:game_id>', views.get_game, name='get_game'),
     path('games', views.list_games, name='list_games'),
+    path('matchmaking/stats', views.matchmaking_stats, name='matchmaking_stats'),
+    path('results/stats', views.result_stats, name='result_stats'),
     path('leaderboard', views.get_leaderboard, name='get_leaderboard'),
+    path('leaderboard/rank', views.leaderboard_rank, name='leaderboard_rank'),
     path('match-history', views.match_history, name='match_history'),
     path('match-history/<str:username>', views.player_match_history, name='player_match_history'),
     path('player/me/stats', views.my_stats, name='my_stats'),
     path('player/<str:username>/profile', views.player_profile, name='player_profile'),
     path('player/<str:username>/achievements', views.player_achievements, name='get_player_achievements'),
+    path('player/<str:username>/head-to-head', views.head_to_head, name='head_to_head'),
     path('achievements', views.all_achievements, name='get_all_achievements'),
 ]
\ No newline at end of file
@@ -1,18 +1,25 @@
 from django.http import JsonResponse
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import condition, require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from django.contrib.auth import get_user_model
 import json
 import jwt
-from .models import GameSession, Player, Match, PlayerAchievement
-from chessgame.models import ChessPlayer
-from .services import get_match_history
+from .models import GameSession, HeadToHead, Player, PlayerAchievement
+from chessgame.models import ChessPlayer, ChessSession
+from .services import local_opponent, settle_match, settle_matches
+from .history import GAME_TYPES, InvalidCursor, get_history
+from .leaderboard import pong_leaderboard
+from .profiles import profile_cache
 import logging
 import random
 
 logger = logging.getLogger(__name__)
 
+LEADERBOARD_SIZE = 10
+MAX_RANK_WINDOW = 50  # players listed above and below at most
+MAX_LOCAL_BATCH = 100  # matches per record-local-matches request
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def create_game(request):
@@ -54,7 +61,12 @@ def get_game(request, game_id):
             'left': 'connected' if game.players['left'] else 'empty',
             'right': 'connected' if game.players['right'] else 'empty'
         },
-        'score': game.state['score']
+        'score': game.state.score_dict(),
+        'inputs': {
+            'coalesced': game.inputs_coalesced,
+            'deferred': game.inputs_deferred,
+            'dropped': game.inputs_dropped,
+        }
     })
 
 @require_http_methods(["GET"])
@@ -72,22 +84,55 @@ def list_games(request):
         ]
     })
 
-# a plain HTTP GET endpoint to return the current leaderboard
 @require_http_methods(["GET"])
-def get_leaderboard(request):
-    leaderboard = Player.get_leaderboard()
+def matchmaking_stats(request):
+    """Queue length, pass timings and wait-time percentiles of the rating matchmakers"""
+    from .consumers import pong_matchmaker
+    from chessgame.consumers import chess_matchmaker
     return JsonResponse({
-        'leaderboard': [
-            {
-                'username': player.user.username,
-                'elo_rating': player.elo_rating,
-                'total_wins': player.total_wins,
-                'current_win_streak': player.current_win_streak
-            }
-            for player in leaderboard
-        ]
+        'pong': {**pong_matchmaker.get_stats(), 'sessions': GameSession.matchmaking.get_stats()},
+        'chess': {**chess_matchmaker.get_stats(), 'sessions': ChessSession.matchmaking.get_stats()},
     })
 
+@require_http_methods(["GET"])
+def result_stats(request):
+    """Depth and flush timings of the write-behind result pipeline"""
+    from .results import result_pipeline
+    return JsonResponse(result_pipeline.get_stats())
+
+# a plain HTTP GET endpoint to return the current leaderboard
+# served from memory (game/leaderboard.py); unchanged boards answer a conditional GET with 304
+@require_http_methods(["GET"])
+@condition(etag_func=lambda request: pong_leaderboard.top(LEADERBOARD_SIZE)[0])
+def get_leaderboard(request):
+    _, leaderboard = pong_leaderboard.top(LEADERBOARD_SIZE)
+    response = JsonResponse({'leaderboard': leaderboard})
+    response['Cache-Control'] = 'no-cache'  # let browsers keep it, but revalidate every poll
+    return response
+
+# rank of a player (?username=..., the caller by default) with ?around=N players above and below
+@require_http_methods(["GET"])
+def leaderboard_rank(request):
+    username = request.GET.get('username')
+    if username:
+        user_id = get_user_model().objects.filter(username=username).values_list('pk', flat=True).first()
+        if user_id is None:
+            return JsonResponse({'error': 'User not found'}, status=404)
+    else:
+        user, error = get_authenticated_user(request)
+        if error:
+            return error
+        user_id = user.id
+    try:
+        around = min(max(int(request.GET.get('around', 5)), 0), MAX_RANK_WINDOW)
+    except ValueError:
+        return JsonResponse({'error': 'around must be a number'}, status=400)
+
+    rank, total, rows = pong_leaderboard.around(user_id, around)
+    if rank is None:
+        return JsonResponse({'error': 'Player not found'}, status=404)
+    return JsonResponse({'rank': rank, 'total_players': total, 'leaderboard': rows})
+
 def get_authenticated_user(request):
     access_token = request.COOKIES.get('access_token')
     if not access_token:
@@ -111,29 +156,43 @@ def join_pong(request):
     user,error = get_authenticated_user(request)
     if error:
         return error
+    # A player waiting for a close enough rating is joined right away; otherwise this
+    # player waits in their own session, and once their socket is connected the rating
+    # matchmaker (game/consumers.py) pairs them and moves one into the other's session.
+    from .consumers import pong_matchmaker
+    rating = Player.objects.filter(user=user).values_list('elo_rating', flat=True).first()
     with GameSession._lock:
-        for game in GameSession._games.values():
-            if game.status == 'waiting' and not game.isTournamentGame and game.invitee_id is not None:
-                logger.debug(f"[join_pong] skipping invite-only session {game.id} for open matchmaking user={user}")
-                continue
-            if game.status == 'waiting' and not game.isTournamentGame and game.invitee_id is None:
-                left_id = getattr(game.players['left'], 'id', None)
-                right_id = getattr(game.players['right'], 'id', None)
-                #if exactly one slot is filled
-                if (left_id is None) != (right_id is None):
-                    if (user.id not in (left_id, right_id)):
-                        if game.players['left'] is None:
-                            game.players['left'] = user
-                        else:
-                            game.players['right'] = user
-                    return JsonResponse({'gameId': game.id})
-    
-    #if no game with empty slot exists, create a new one and allocate a random left or right position to the player
-    game = GameSession.create_game()
-    game.isTournamentGame = False
-    side = random.choice(['left', 'right'])
-    game.players[side] = user
-    return JsonResponse({'gameId': game.id})    
+        queue = GameSession.matchmaking
+        #a player who is already waiting gets their own session back
+        game_id = queue.open_game_of(user.id, _is_open_pong_game)
+        if game_id is not None:
+            return JsonResponse({'gameId': game_id})
+
+        while True:
+            ticket = pong_matchmaker.claim(user.id, 1000 if rating is None else rating)
+            if ticket is None:
+                break
+            game = GameSession._games.get(ticket.game_id)
+            if game is not None and game.is_open():
+                game.players['left' if game.players['left'] is None else 'right'] = user
+                queue.discard(game.id)
+                logger.info(f"[pong matchmaking] {user.id} joins {ticket.user_id} in {game.id} over HTTP")
+                return JsonResponse({'gameId': game.id})
+
+        #otherwise create a new one and allocate a random left or right position to the player
+        game = GameSession()
+        game.isTournamentGame = False
+        side = random.choice(['left', 'right'])
+        game.players[side] = user
+        GameSession._games[game.id] = game
+        queue.add_open(game.id, user.id)
+    return JsonResponse({'gameId': game.id})
+
+
+def _is_open_pong_game(game_id):
+    """Whether a queued session can still take a second player"""
+    game = GameSession._games.get(game_id)
+    return game is not None and game.is_open()
 
 
 
@@ -146,47 +205,43 @@ def record_local_match(request):
     real_user, err = get_authenticated_user(request)
     if err:
         return err
-    game_player = Player.objects.get(user=real_user)
-
-    # Use a dedicated inactive system user as the local-game placeholder opponent
-    User = get_user_model()
-    opponent_user, _ = User.objects.get_or_create(
-        username='Local opponent',
-        defaults={'is_active': False}
-    )
-    opponent_player, _ = Player.objects.get_or_create(user=opponent_user)
 
     data = json.loads(request.body.decode())
     player_score = data.get('player_score')
     opponent_score = data.get('opponent_score')
 
-    if player_score > opponent_score:
-        w, l = game_player, opponent_player
-        winner_score, loser_score = player_score, opponent_score
-    else:
-        w, l = opponent_player, game_player
-        winner_score, loser_score = opponent_score, player_score
-
-    Match.objects.create(
-        player1=game_player,
-        player2=opponent_player,
-        player1_score=player_score,
-        player2_score=opponent_score,
-        winner=w,
-        loser=l,
-    )
+    #the placeholder opponent (a dedicated inactive user) plays every local match, only the real player collects achievements
+    result = settle_match(real_user.id, local_opponent(), player_score, opponent_score, award={real_user.id})
+    newly_earned = result['new_achievements'][str(real_user.id)]
 
-    w.player_wins(win_point=winner_score, opponent_elo=l.elo_rating)
-    l.player_loses(loss_point=loser_score, opponent_elo=w.elo_rating)
+    return JsonResponse({
+        'status': 'recorded',
+        'new_achievements': newly_earned
+    })
 
-    newly_earned = game_player.check_new_achievements()
+# several local / AI results at once: {"matches": [{"player_score": ..., "opponent_score": ...}, ...]}, oldest first
+# all of them are settled in one transaction; the response lists every achievement they unlocked
+@csrf_exempt
+@require_http_methods(["POST"])
+def record_local_matches(request):
+    real_user, err = get_authenticated_user(request)
+    if err:
+        return err
+    try:
+        matches = json.loads(request.body.decode())['matches']
+        scores = [(int(m['player_score']), int(m['opponent_score'])) for m in matches]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'matches must be a list of {player_score, opponent_score}'}, status=400)
+    if not scores or len(scores) > MAX_LOCAL_BATCH:
+        return JsonResponse({'error': f'between 1 and {MAX_LOCAL_BATCH} matches per request'}, status=400)
+    if any(score < 0 for pair in scores for score in pair):
+        return JsonResponse({'error': 'scores cannot be negative'}, status=400)
 
+    result = settle_matches(real_user.id, local_opponent(), scores, award={real_user.id})
     return JsonResponse({
         'status': 'recorded',
-        'new_achievements': [
-            {'name': a.name, 'description': a.description}
-            for a in newly_earned
-        ]
+        'recorded': len(result['matches']),
+        'new_achievements': result['new_achievements'][str(real_user.id)],
     })
 
 @require_http_methods(["GET"])
@@ -194,46 +249,53 @@ def match_history(request):
     user, err = get_authenticated_user(request)
     if err:
         return err
-    try:
-        player = Player.objects.get(user=user)
-    except Player.DoesNotExist:
-        return JsonResponse({'error': 'Player profile not found'}, status=404)
-
-    matches = get_match_history(player)
-    return JsonResponse({
-        'matches': [
-            {
-                'timestamp': m.timestamp.isoformat(),
-                'player1': m.player1.user.username,
-                'player2': m.player2.user.username,
-                'player1_score': m.player1_score,
-                'player2_score': m.player2_score,
-                'winner': m.winner.user.username if m.winner else None,
-            }
-            for m in matches
-        ]
-    })
+    return _match_history_response(request, user)
     
 @require_http_methods(["GET"])
 def player_match_history(request, username):
-    try:
-        player = Player.objects.get(user__username=username)
-    except Player.DoesNotExist:
+    user = get_user_model().objects.filter(username=username).first()
+    if user is None:
         return JsonResponse({'error': 'Player not found'}, status=404)
-    matches = get_match_history(player)
-    return JsonResponse({
-        'matches': [
-            {
-                'timestamp': m.timestamp.isoformat(),
-                'player1': m.player1.user.username,
-                'player2': m.player2.user.username,
-                'player1_score': m.player1_score,
-                'player2_score': m.player2_score,
-                'winner': m.winner.user.username if m.winner else None,
-            }
-            for m in matches
-        ]
-    })
+    return _match_history_response(request, user)
+
+def _match_history_response(request, user):
+    """A page of the user's history: ?limit=, ?cursor= (next_cursor of the previous page), ?games=pong,chess"""
+    games = set(request.GET.get('games', 'pong').split(','))
+    if not games or not games <= set(GAME_TYPES):
+        return JsonResponse({'error': f"games must be a comma separated list of {', '.join(GAME_TYPES)}"}, status=400)
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a number'}, status=400)
+
+    pong_player = Player.objects.filter(user=user).first() if 'pong' in games else None
+    chess_player = ChessPlayer.objects.filter(user=user).first() if 'chess' in games else None
+    if pong_player is None and chess_player is None:
+        return JsonResponse({'error': 'Player profile not found'}, status=404)
+    try:
+        matches, next_cursor = get_history(pong_player, chess_player, limit=limit, cursor=request.GET.get('cursor'))
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'matches': matches, 'next_cursor': next_cursor})
+
+# record of <username> against ?opponent=<username> in ?game=pong|chess, from the head-to-head table
+@require_http_methods(["GET"])
+def head_to_head(request, username):
+    opponent = request.GET.get('opponent')
+    game_type = request.GET.get('game', 'pong')
+    if not opponent:
+        return JsonResponse({'error': 'opponent is required'}, status=400)
+    if game_type not in dict(HeadToHead.GAME_TYPES):
+        return JsonResponse({'error': 'game must be pong or chess'}, status=400)
+
+    record = HeadToHead.objects.filter(
+        game_type=game_type, user__username=username, opponent__username=opponent
+    ).values('games', 'wins', 'losses', 'draws', 'points_for', 'points_against', 'last_played').first()
+    if record is None:
+        record = {'games': 0, 'wins': 0, 'losses': 0, 'draws': 0, 'points_for': 0, 'points_against': 0, 'last_played': None}
+    elif record['last_played']:
+        record['last_played'] = record['last_played'].isoformat()
+    return JsonResponse({'player': username, 'opponent': opponent, 'game': game_type, **record})
 
 @require_http_methods(["GET"])
 def player_achievements(request, username):
@@ -291,56 +353,18 @@ def my_stats(request):
         'current_win_streak': player.current_win_streak,
     })
 
+def _profile_etag(request, username):
+    # the profile is looked up once per request, the view reuses it
+    etag, request.profile = profile_cache.get(username)
+    return etag
+
+# stats, recent achievements and recent matches of a player in one response, from game/profiles.py
 @require_http_methods(["GET"])
+@condition(etag_func=_profile_etag)
 def player_profile(request, username):
-    User = get_user_model()
-    try:
-        user = User.objects.get(username=username)
-    except User.DoesNotExist:
+    profile = request.profile
+    if profile is None:
         return JsonResponse({'error': 'User not found'}, status=404)
-
-    try:
-        pong = Player.objects.get(user=user)
-        pong_data = {
-            'wins': pong.total_wins,
-            'losses': pong.total_losses,
-            'elo': pong.elo_rating,
-            'total_games': pong.total_games,
-        }
-    except Player.DoesNotExist:
-        pong_data = {'wins': 0, 'losses': 0, 'elo': 1000, 'total_games': 0}
-    
-    try:
-        pongAchievements = PlayerAchievement.objects.filter(player__user=user).select_related('achievement').order_by('-timestamp')[:5]
-        pong_achievements_data = {
-            'achievements': [
-                {
-                    'name': pa.achievement.name,
-                    'description': pa.achievement.description,
-                    'requirement_type': pa.achievement.requirement_type,
-                    'requirement_value': pa.achievement.requirement_value,
-                    'timestamp': pa.timestamp.isoformat()
-                }
-                for pa in pongAchievements
-            ]
-        }
-    except PlayerAchievement.DoesNotExist:
-        pong_achievements_data = {'achievements': []}
-
-    try:
-        chess = ChessPlayer.objects.get(user=user)
-        chess_data = {
-            'wins': chess.total_wins,
-            'losses': chess.total_losses,
-            'elo': chess.elo_rating,
-            'total_games': chess.total_games,
-        }
-    except ChessPlayer.DoesNotExist:
-        chess_data = {'wins': 0, 'losses': 0, 'elo': 1200, 'total_games': 0}
-
-    return JsonResponse({
-        'username': user.username,
-        'pong': pong_data,
-        # 'pong_achievements': pong_achievements_data['achievements'],
-        'chess': chess_data,
-    })
+    response = JsonResponse(profile)
+    response['Cache-Control'] = 'no-cache'
+    return response
@@ -192,6 +192,13 @@ export function initChat() {
 				}));
 				break;
 
+			// Achievements are settled after the game over, so they arrive here a moment later
+			case "achievements_unlocked":
+				window.dispatchEvent(new CustomEvent("achievementsUnlocked", {
+					detail: { achievements: data.achievements }
+				}));
+				break;
+
 			case "typing": {
 				const channelId = data.target ? data.user : "global";
 				window.dispatchEvent(new CustomEvent("typingStarted", {
@@ -92,6 +92,7 @@ export async function initOnlineChessGame(gameId = null){
 	let selected  = null;
 	let myTurn    = false;
 	let gameActive = false;
+	let movedTo   = null; //table the matchmaker paired us into
 
 	//if no gameId was passed in, ask the server for one (normal matchmaking flow)
 	   if (!gameId) {
@@ -128,6 +129,13 @@ export async function initOnlineChessGame(gameId = null){
 	ws.onmessage = (event) => {
 		const data = JSON.parse(event.data);
 
+		   if (data.type === 'matchFound') {
+			   //paired with an opponent waiting at another table: reconnect there
+			   movedTo = data.gameId;
+			   ws.close();
+			   return;
+		   }
+
 		   if (data.type === 'assign') {
 			   myColor = data.color;
 			   if (statusEl) statusEl.textContent = t('CHESS_WAITING_FOR_OPPONENT', { color: myColor });
@@ -182,6 +190,7 @@ export async function initOnlineChessGame(gameId = null){
 		window.dispatchEvent(new CustomEvent("chessGameLeft"));
 		window.removeEventListener('beforeunload', browserExitHandler);
    		window.removeEventListener('pagehide',     browserExitHandler);
+		if (movedTo) initOnlineChessGame(movedTo);
 	};
 
 	boardEl.addEventListener('click', (e) => {
@@ -31,6 +31,8 @@ function showAchievements(achievements) {
     setTimeout(() => overlay.remove(), 6000);
 }
 
+window.addEventListener("achievementsUnlocked", (e) => showAchievements(e.detail.achievements));
+
 function showPongResultModal({ winnerId, winnerName, currentUserId }) {
   const didWin = winnerId != null && Number(winnerId) === currentUserId;
   const title = didWin ? t('GAME_YOU_WON') : t('GAME_YOU_LOST');
@@ -146,9 +148,56 @@ export function joinOnlineGame(gameId, IsTournament) {
   let keyUpHandler = null;
   let resizeHandler = null;
   let gameEnded = false;
+  let movedTo = null; // session the matchmaker paired us into
+
+  // Latest full state, kept up to date from keyframes ("state") and deltas ("delta")
+  let frame = null;
+  let lastSeq = 0;
+  let resyncRequested = false;
+
+  // The server sends snapshots slower than it simulates; we render a little in the
+  // past and interpolate between the two snapshots around that moment.
+  let snapshotRate = 30;
+  let snapshots = [];
+  let serverOffset = null; // estimate of server clock - local clock, in ms
+
+  const pushSnapshot = (data) => {
+    // Best (least delayed) sample wins, so network jitter doesn't shake the clock
+    const offset = data.t - Date.now();
+    if (serverOffset === null || offset > serverOffset) serverOffset = offset;
+    // Ball is re-served after a goal: don't slide it across the field
+    const last = snapshots[snapshots.length - 1];
+    if (last && (last.score.p1 !== frame.score.p1 || last.score.p2 !== frame.score.p2)) snapshots = [];
+    snapshots.push({ t: data.t, ball: frame.ball, paddles: frame.paddles, score: frame.score });
+    if (snapshots.length > 10) snapshots.shift();
+
+    const scoreP1 = document.getElementById("scoreP1");
+    const scoreP2 = document.getElementById("scoreP2");
+    if (scoreP1) scoreP1.textContent = String(frame.score.p1);
+    if (scoreP2) scoreP2.textContent = String(frame.score.p2);
+  };
+
+  const lerp = (a, b, alpha) => a + (b - a) * alpha;
+
+  const interpolate = () => {
+    if (!window.gameObjects || snapshots.length === 0) return;
+    const renderTime = Date.now() + serverOffset - 2 * (1000 / snapshotRate);
+    let i = snapshots.length - 1;
+    while (i > 0 && snapshots[i - 1].t > renderTime) i--;
+    const to = snapshots[i];
+    const from = i > 0 ? snapshots[i - 1] : to;
+    const span = to.t - from.t;
+    const alpha = span > 0 ? Math.min(1, Math.max(0, (renderTime - from.t) / span)) : 1;
+    window.gameObjects.ball.position.x = lerp(from.ball.x, to.ball.x, alpha);
+    window.gameObjects.ball.position.y = lerp(from.ball.y, to.ball.y, alpha);
+    window.gameObjects.paddleLeft.position.y = lerp(from.paddles.left, to.paddles.left, alpha);
+    window.gameObjects.paddleRight.position.y = lerp(from.paddles.right, to.paddles.right, alpha);
+  };
 
+  // Ask for fewer snapshots on slow links
+  const slowLink = ['slow-2g', '2g', '3g'].includes(navigator.connection?.effectiveType);
   const proto = location.protocol === "https:" ? "wss:" : "ws:";
-  ws = new WebSocket(`${proto}//${location.host}/ws/${gameId}`);
+  ws = new WebSocket(`${proto}//${location.host}/ws/${gameId}${slowLink ? '?rate=20' : ''}`);
   ws.onopen = () => {
     console.log("WS connected to game:", gameId);
     isGameActive = true;
@@ -200,6 +249,13 @@ export function joinOnlineGame(gameId, IsTournament) {
       const data = JSON.parse(ev.data);
       console.log("WS message", data);
 
+      if (data.type === "matchFound") {
+        // Paired with an opponent waiting in another session: reconnect there
+        movedTo = data.gameId;
+        ws?.close();
+        return;
+      }
+
       if (data.type === "gameStart") {
         const appRoot = document.getElementById("app-root");
 
@@ -221,7 +277,10 @@ export function joinOnlineGame(gameId, IsTournament) {
 
         window.gameObjects = initGameScene(scene, canvas, 2);
 
-        engine.runRenderLoop(() => scene.render());
+        engine.runRenderLoop(() => {
+          interpolate();
+          scene.render();
+        });
 
         resizeHandler = () => engine.resize();
         window.addEventListener("resize", resizeHandler);
@@ -253,21 +312,33 @@ export function joinOnlineGame(gameId, IsTournament) {
       }
 
       if (data.type === "state") {
-        const { ball, paddles, score } = data;
-        if (window.gameObjects) {
-          window.gameObjects.ball.position.x = ball.x;
-          window.gameObjects.ball.position.y = ball.y;
-          window.gameObjects.paddleLeft.position.y = paddles.left;
-          window.gameObjects.paddleRight.position.y = paddles.right;
+        // Full frame (keyframe): replaces everything we had
+        frame = { ball: data.ball, paddles: data.paddles, score: data.score };
+        lastSeq = data.seq ?? lastSeq;
+        resyncRequested = false;
+        pushSnapshot(data);
+      }
+
+      if (data.type === "delta") {
+        // Delta frame: only applies on top of the frame right before it
+        if (data.seq <= lastSeq) return;
+        if (!frame || data.seq !== lastSeq + 1) {
+          if (!resyncRequested) {
+            resyncRequested = true;
+            ws?.send(JSON.stringify({ type: "resync" }));
+          }
+          return;
         }
-        const scoreP1 = document.getElementById("scoreP1");
-        const scoreP2 = document.getElementById("scoreP2");
-        if (scoreP1) scoreP1.textContent = String(score.p1);
-        if (scoreP2) scoreP2.textContent = String(score.p2);
+        frame.ball = data.ball;
+        if (data.paddles) frame.paddles = data.paddles;
+        if (data.score) frame.score = data.score;
+        lastSeq = data.seq;
+        pushSnapshot(data);
       }
 
       if (data.type === "assign") {
         console.log("Assigned role:", data.role);
+        if (data.snapshot_rate) snapshotRate = data.snapshot_rate;
         const parsedAssignedId = Number(data.user_id);
         if (Number.isFinite(parsedAssignedId)) {
           assignedUserId = parsedAssignedId;
@@ -300,9 +371,6 @@ export function joinOnlineGame(gameId, IsTournament) {
           winnerName: data.winner,
           currentUserId,
         });
-        const userId = String(Number.isFinite(currentUserId) ? currentUserId : '');
-        const myAchievements = (data.new_achievements || {})[userId] || [];
-        showAchievements(myAchievements);
         // Clean up event listeners and intervals
         clearInterval(keyboardInterval);
         window.removeEventListener("pointermove", pointerHandler);
@@ -346,6 +414,10 @@ export function joinOnlineGame(gameId, IsTournament) {
 
     }
     canvas.remove();
+    if (movedTo) {
+      joinOnlineGame(movedTo, false);
+      return;
+    }
     if (IsTournament) {
       navigate(`/tournament/${window.currentTournamentId}`);
     } else {
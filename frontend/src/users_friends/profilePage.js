@@ -21,7 +21,7 @@ export async function initProfilePage(username){
 
     renderUser(profile);
     renderStats(profile);
-    renderMatchHistory(profile.username);
+    renderMatchHistory(profile);
 
     if (isSelf) setupOwnProfile();
     else hideOwnProfileSections();
@@ -94,25 +94,31 @@ function setupAddFriend(){
     });
 }
 
-async function renderMatchHistory(username){
-    const res = await fetchWithRefreshAuth(`/api/match-history/${username}`);
-    const data = await res.json();
+// the profile response already carries the latest Pong and chess matches
+function renderMatchHistory(profile){
+    const username = profile.username;
+    const matches = profile.recent_matches;
     const container = document.getElementById("match-list");
     const template = document.getElementById("match-template");
 
     container.innerHTML = "";
-    if (!data.matches || data.matches.length === 0)
+    if (!matches || matches.length === 0)
         return;
 
-    data.matches.slice(0, 10).forEach(m => {
+    matches.forEach(m => {
         const wrapDiv = document.createElement("div");
         wrapDiv.innerHTML = template.innerHTML;
         const row = wrapDiv.firstElementChild;
 
-        const isPlayer1 = m.player1 === username;
-        const opponent = isPlayer1 ? m.player2 : m.player1;
-        const myScore = isPlayer1 ? m.player1_score : m.player2_score;
-        const oppScore = isPlayer1 ? m.player2_score : m.player1_score;
+        let opponent, score;
+        if (m.game_type === 'chess') {
+            opponent = m.opponent;
+            score = m.result;
+        } else {
+            const isPlayer1 = m.player1 === username;
+            opponent = isPlayer1 ? m.player2 : m.player1;
+            score = isPlayer1 ? `${m.player1_score}-${m.player2_score}` : `${m.player2_score}-${m.player1_score}`;
+        }
         let resultKey, colorClass;
         if (m.winner === null) {
             resultKey = 'PROFILE_DRAW';
@@ -126,7 +132,7 @@ async function renderMatchHistory(username){
         }
 
         row.querySelector(".match-opponent").textContent = opponent;
-        row.querySelector(".match-score").textContent = `${myScore}-${oppScore}`;
+        row.querySelector(".match-score").textContent = score;
         row.querySelector(".match-result").textContent = t(resultKey);
         row.querySelector(".match-result").classList.add(colorClass);
         row.querySelector(".match-date").textContent = new Date(m.timestamp).toLocaleDateString();